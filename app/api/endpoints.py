@@ -1,27 +1,38 @@
-import asyncio
-
 from aiogram.types import Update
-from fastapi.responses import JSONResponse
-from fastapi import APIRouter, Request, Depends
-from sqlalchemy.ext.asyncio import AsyncSession
+from fastapi.responses import JSONResponse, PlainTextResponse
+from fastapi import APIRouter, Request
 
 from app.core.config import Config
-from app.core.database import get_db
-from app.core.config_bot import bot, dp
+from app.services.metrics import metrics
+from app.services.update_dispatcher import update_dispatcher
 
 webhook_router = APIRouter()
 
 
 @webhook_router.post(Config.WEBHOOK_PATH, include_in_schema=False)
-async def handle_webhook(request: Request, db: AsyncSession = Depends(get_db)):
-    """Обработка запросов. Передача боту.
+async def handle_webhook(request: Request):
+    """Обработка запросов. Передача обновления в очередь обработки.
+    При переполнении очереди Telegram получает ошибку и повторит доставку позже.
     """
     update_data = await request.json()  # Получение данных из запроса
     update = Update(**update_data)  # Создание объекта обновления
-    asyncio.create_task(dp.feed_update(bot, update, db=db))  # Передача обновления боту
+    if not update_dispatcher.submit(update):  # Постановка обновления в очередь
+        return JSONResponse(status_code=503, content={"detail": "Update queue is full"})
     return JSONResponse(content={})  # Возвращение пустого ответа
 
 
+@webhook_router.get("/stats/updates", include_in_schema=False)
+async def update_stats():
+    """Статистика очереди входящих обновлений: глубина очереди и задержки обработки"""
+    return update_dispatcher.stats()
+
+
+@webhook_router.get("/metrics", include_in_schema=False)
+async def prometheus_metrics():
+    """Метрики приложения в текстовом формате Prometheus: длительность этапов сканирования и счетчики"""
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+
 @webhook_router.get("/")
 def read_root():
     return {"message": "Welcome to ProductWBsyncBot!"}
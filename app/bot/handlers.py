@@ -1,14 +1,17 @@
+from typing import Optional
+from datetime import datetime, timedelta, timezone
 from aiogram import types, F
 from fastapi import HTTPException
 from aiogram.fsm.context import FSMContext
-from aiogram.filters import Command, StateFilter
+from aiogram.filters import Command, CommandObject, StateFilter
 from sqlalchemy.ext.asyncio import AsyncSession
 
 from .states import FileState
 from app.core.config import Config
 from app.services.data_processing import FileService
-from app.db.crud import get_product_prices, clear_tables
-from app.services.functions import get_price_and_save
+from app.db.crud import iter_product_prices, clear_tables
+from app.services.scan_queue import scan_queue
+from app.services.telegram_sender import telegram_sender, MessagePacker
 
 
 async def show_main_menu(message: types.Message):
@@ -28,6 +31,10 @@ async def show_main_menu(message: types.Message):
             [
                 types.KeyboardButton(text="Посмотреть цены"),
             ],
+            [
+                types.KeyboardButton(text="Статус сканирования"),
+                types.KeyboardButton(text="Остановить сканирование"),
+            ],
 
         ],
         resize_keyboard=True
@@ -61,17 +68,19 @@ async def handle_get_file(message: types.Message, db: AsyncSession, state: FSMCo
                     # Получение данных из файла и сохранение в БД
                     res = await FileService.import_product_data(success, db)
 
-                    answer = ""
-                    for product in res[0]:
-                        pre_answer = f"Название:\n{product.title}\n\nurl:\n{product.url}\n\nxpath:\n{product.xpath}\n\n"
-
-                        if len(answer) + len(pre_answer) > 4096:
-                            await message.answer(answer)
-                            answer = ""
-                        answer += pre_answer
+                    parts = [f"Название:\n{product.title}\n\nurl:\n{product.url}\n\nxpath:\n{product.xpath}\n\n"
+                             for product in res[0]]
 
-                    await message.answer(answer)
-                    await message.answer(f"\nИмпортировано {res[1]} товаров")
+                    stats = res[1]
+                    shown = stats['inserted'] + stats['updated']
+                    if shown > len(res[0]):
+                        parts.append(f"... и еще {shown - len(res[0])}")
+                    # Через очередь отправки: сообщения упаковываются и приходят по порядку
+                    telegram_sender.send_many(message.chat.id, parts)
+                    telegram_sender.send(message.chat.id,
+                                         f"\nДобавлено товаров: {stats['inserted']}\n"
+                                         f"Обновлено: {stats['updated']}\n"
+                                         f"Пропущено (уже есть или без данных): {stats['skipped']}")
 
                 except HTTPException as e:
                     await message.answer(e.detail)
@@ -88,42 +97,82 @@ async def handle_get_file(message: types.Message, db: AsyncSession, state: FSMCo
         await message.answer("Пожалуйста, загрузите файл.")
 
 
-async def handle_parser(message: types.Message, db: AsyncSession):
-    """Парсинг цен товаров
+async def handle_parser(message: types.Message):
+    """Постановка сканирования цен в очередь. Результаты отправляет фоновый обработчик
     :param message:
-    :param db:
     :return:
     """
-    await message.answer(
-        "В зависимости от количества задач, процесс может потребовать длительного времени. Пожалуйста, ожидайте.")
-    async for answer in get_price_and_save(db):
-        await message.answer(answer, parse_mode="Markdown", disable_web_page_preview=True)
+    job, created = await scan_queue.submit(message.chat.id)
+    if created:
+        await message.answer(
+            f"Сканирование #{job.id} поставлено в очередь. В зависимости от количества задач, "
+            f"процесс может потребовать длительного времени. Результаты я пришлю по мере готовности.")
+    else:
+        await message.answer(
+            f"Сканирование #{job.id} уже запущено, я пришлю Вам его результаты. "
+            f"Посмотреть ход сканирования можно кнопкой \"Статус сканирования\".")
 
 
-async def view_price(message: types.Message, db: AsyncSession):
-    """Вывод списка цен товаров
+async def scan_status(message: types.Message):
+    """Ход текущего или итог последнего сканирования
+    :param message:
+    :return:
+    """
+    await message.answer(await scan_queue.describe())
+
+
+async def cancel_scan(message: types.Message):
+    """Остановка сканирования
+    :param message:
+    :return:
+    """
+    job_id = await scan_queue.cancel()
+    if job_id is None:
+        await message.answer("Сейчас сканирование не выполняется.")
+    else:
+        await message.answer(f"Сканирование #{job_id} останавливается. Уже полученные цены сохранены.")
+
+
+async def view_price(message: types.Message, db: AsyncSession, command: Optional[CommandObject] = None):
+    """Вывод списка цен товаров. История читается из БД постранично.
+    Кнопка "Посмотреть цены" выводит для каждого товара последние HISTORY_SCANS_PER_PRODUCT цен,
+    команда /prices N - цены за последние N дней: период длиннее ROLLUP_MIN_DAYS
+    читается из сводок по дням и неделям, а не из отдельных сканирований.
     :param message:
     :param db:
+    :param command: Команда /prices с необязательным количеством дней.
     :return:
     """
-    await message.answer("Список отслеживаемых ресурсов и цен по датам.")
-    result = await get_product_prices(db)
-    answer = ""
-    for title, url, dates in result:
-        title = f"[{title}]({url})"
-        pre_answer = f"{title}\n"
-        for date, price in dates.items():
-            pre_answer += f"{date} - {price / 100:.2f} ₽\n"
-        pre_answer += "\n"
-
-        if len(answer) + len(pre_answer) > 4096:
-            await message.answer(answer, parse_mode="Markdown", disable_web_page_preview=True)
-            answer = ""
-        answer += pre_answer
-
-    if not answer:
-        answer = "Список пуст"
-    await message.answer(answer, parse_mode="Markdown", disable_web_page_preview=True)
+    args = command.args.strip() if command is not None and command.args else ''
+    if args and not args.isdigit():
+        await message.answer("Использование: /prices [количество дней]")
+        return
+    if args:
+        date_to = datetime.now(timezone.utc)
+        selection = dict(date_from=date_to - timedelta(days=int(args)), date_to=date_to)
+        await message.answer(f"Список отслеживаемых ресурсов и цен за последние {int(args)} дн.")
+    else:
+        selection = dict(scans_per_product=Config.HISTORY_SCANS_PER_PRODUCT)
+        await message.answer("Список отслеживаемых ресурсов и цен по датам.")
+    options = dict(parse_mode="Markdown", disable_web_page_preview=True)
+    packer = MessagePacker()  # Товары упаковываются в минимальное количество сообщений
+    empty = True
+    async for page in iter_product_prices(db, page_size=Config.HISTORY_PAGE_SIZE, **selection):
+        for _, title, url, dates in page:
+            empty = False
+            title = f"[{title}]({url})"
+            pre_answer = f"{title}\n"
+            for date, price in dates.items():
+                pre_answer += f"{date} - {price / 100:.2f} ₽\n"
+            pre_answer += "\n"
+
+            for text in packer.add(pre_answer):
+                telegram_sender.send(message.chat.id, text, **options)
+
+    if empty:
+        telegram_sender.send(message.chat.id, "Список пуст")
+    for text in packer.flush():
+        telegram_sender.send(message.chat.id, text, **options)
 
 
 async def clear_db(message: types.Message, db: AsyncSession):
@@ -158,6 +207,8 @@ async def help_command(message: types.Message):
     - title - это название записи (подойдет название магазина/товара)
     - url   - url адрес интересующего Вас товара
     - xpath - путь к тегу с ценой (та самая циферка).
+    Можно добавить столбец interval - как часто (в минутах) проверять цену товара.
+    Без него я подберу интервал сам: чем чаще меняется цена, тем чаще проверяю.
     
 2. Нажимаете кнопку "Добавить товары (загрузить файл)", я Вам предложу загрузить файл.
    Обратите внимание, принимаю только файлы электронных таблиц с расширениями: xls, xlsx, csv.
@@ -168,7 +219,9 @@ async def help_command(message: types.Message):
 
 Чтобы обновить информацию о ценах отслеживаемых товаров, нажмите кнопку "Получить цены".
 Я сбегаю на сайты и запишу что у них теперь с ценами.
-Иногда ответ получить не удается, тогда в цену товара записывается 0.
+Если сканирование уже идет, новое не запускается: я пришлю Вам результаты текущего.
+Ход сканирования покажет кнопка "Статус сканирования", остановит - "Остановить сканирование".
+Иногда ответ получить не удается, тогда цена не записывается, а в отчете я напишу причину.
 
 Если хотите посмотреть цены, нажмите кнопку "Посмотреть цены".
 Я выведу список дат и цен, которые собирались при нажатии кнопки "Получить цены" для каждого товара.
@@ -176,6 +229,9 @@ async def help_command(message: types.Message):
 Доступные команды:
 /start - Начать работу с ботом.
 /help - Показать эту справку.
+/prices N - Цены за последние N дней (за долгий период - по дням или неделям).
+/status - Ход сканирования цен.
+/cancel - Остановить сканирование цен.
 /clear - Очистить базу данных.
 """
     await message.answer(help_text)
@@ -197,5 +253,10 @@ def register_handlers(router):
     router.message.register(handle_main_menu, F.text.in_(["Добавить товары (загрузить файл)"]))
     router.message.register(handle_parser, F.text.in_(["Получить цены"]))
     router.message.register(view_price, F.text.in_(["Посмотреть цены"]))
+    router.message.register(view_price, Command(commands=['prices']))
+    router.message.register(scan_status, Command(commands=['status']))
+    router.message.register(scan_status, F.text.in_(["Статус сканирования"]))
+    router.message.register(cancel_scan, Command(commands=['cancel']))
+    router.message.register(cancel_scan, F.text.in_(["Остановить сканирование"]))
     router.message.register(handle_get_file, StateFilter(FileState.send_file), F.content_type == 'document')
     router.message.register(handle_unknown_message)  # Обработчик по умолчанию
@@ -7,8 +7,98 @@ load_dotenv()
 class Config:
     BOT_TOKEN = os.getenv('BOT_TOKEN')
     DB_NAME = os.getenv('DB_NAME')
+    DATABASE_URL = os.getenv('DATABASE_URL')  # postgresql+asyncpg://... - общая БД для нескольких экземпляров
     APP_PORTS = os.getenv('APP_PORTS')[-4:]
     WEBHOOK_HOST = os.getenv('WEBHOOK_HOST')
     WEBHOOK_PATH = os.getenv('WEBHOOK_PATH')
     WEBHOOK_URL = f"{WEBHOOK_HOST}{WEBHOOK_PATH}"
     FILE_PATH = os.getenv('FILE_PATH')
+
+    # Пул браузеров для парсинга
+    BROWSER_POOL_SIZE = int(os.getenv('BROWSER_POOL_SIZE', 2))  # Количество одновременно запущенных браузеров
+    BROWSER_RECYCLE_PAGES = int(os.getenv('BROWSER_RECYCLE_PAGES', 200))  # Перезапуск браузера после N страниц
+
+    # Ограничения нагрузки при сканировании
+    SCAN_MAX_CONCURRENT = int(os.getenv('SCAN_MAX_CONCURRENT', 10))  # Общий лимит одновременных запросов
+    SCAN_DOMAIN_CONCURRENCY = int(os.getenv('SCAN_DOMAIN_CONCURRENCY', 2))  # Одновременных запросов к одному домену
+    SCAN_DOMAIN_INTERVAL = float(os.getenv('SCAN_DOMAIN_INTERVAL', 1.0))  # Минимальный интервал (сек) между запросами к домену
+    SCAN_BROWSER_PAGES = int(os.getenv('SCAN_BROWSER_PAGES', 5))  # Одновременно открытых страниц браузера
+
+    # Пакетная запись результатов сканирования
+    SCAN_WRITE_BATCH = int(os.getenv('SCAN_WRITE_BATCH', 100))  # Размер пакета записи
+    SCAN_WRITE_INTERVAL = float(os.getenv('SCAN_WRITE_INTERVAL', 2.0))  # Запись накопленного раз в N секунд
+
+    # Кэш страниц HTTP-уровня: условные запросы и пропуск разбора неизменившихся страниц
+    HTTP_CACHE_SIZE = int(os.getenv('HTTP_CACHE_SIZE', 10000))  # Страниц в кэше, 0 - кэш отключен
+    HTTP_CACHE_TTL = float(os.getenv('HTTP_CACHE_TTL', 86400))  # Срок жизни записи, секунды
+
+    # Архив снимков страниц для повторного извлечения цен без сети (python -m app.services.reextract)
+    SNAPSHOTS_ENABLED = os.getenv('SNAPSHOTS_ENABLED', '0') == '1'  # 1 - сохранять снимки загруженных страниц
+    SNAPSHOT_PATH = os.getenv('SNAPSHOT_PATH', 'snapshots')  # Каталог архива снимков
+    SNAPSHOT_RETENTION_DAYS = float(os.getenv('SNAPSHOT_RETENTION_DAYS', 30))  # Срок хранения снимков, дни
+
+    # Подключения к БД
+    DB_POOL_SIZE = int(os.getenv('DB_POOL_SIZE', 5))  # Постоянных соединений в пуле
+    DB_MAX_OVERFLOW = int(os.getenv('DB_MAX_OVERFLOW', 10))  # Дополнительных соединений при пиковой нагрузке
+    DB_POOL_TIMEOUT = float(os.getenv('DB_POOL_TIMEOUT', 30))  # Ожидание свободного соединения, секунды
+    SQLITE_BUSY_TIMEOUT = int(os.getenv('SQLITE_BUSY_TIMEOUT', 5000))  # Ожидание блокировки записи, мс
+    SQLITE_MMAP_SIZE = int(os.getenv('SQLITE_MMAP_SIZE', 268435456))  # Размер отображения файла БД в память, байты
+
+    # Просмотр истории цен
+    HISTORY_PAGE_SIZE = int(os.getenv('HISTORY_PAGE_SIZE', 50))  # Товаров в одном запросе к БД
+    HISTORY_SCANS_PER_PRODUCT = int(os.getenv('HISTORY_SCANS_PER_PRODUCT', 10))  # Последних цен на товар
+
+    # Хранение истории цен: scans - запись на каждое сканирование,
+    # intervals - запись на каждый период неизменной цены
+    PRICE_STORAGE_MODE = os.getenv('PRICE_STORAGE_MODE', 'scans')
+
+    # Сводки цен по дням и неделям
+    ROLLUP_TIMEZONE = os.getenv('ROLLUP_TIMEZONE', 'Europe/Moscow')  # Часовой пояс границ дней
+    ROLLUP_MIN_DAYS = int(os.getenv('ROLLUP_MIN_DAYS', 31))  # История за период длиннее читается из сводок
+    ROLLUP_WEEK_MIN_DAYS = int(os.getenv('ROLLUP_WEEK_MIN_DAYS', 180))  # За период длиннее - из недельных сводок
+
+    # Блокировка ненужных ресурсов при загрузке страниц в браузере
+    BLOCK_RESOURCES = os.getenv('BLOCK_RESOURCES', '1') == '1'  # 0 - выключить блокировку
+    RESOURCE_PROFILES_FILE = os.getenv('RESOURCE_PROFILES_FILE')  # JSON с профилями блокировки по доменам
+
+    # Адаптивные таймауты парсера
+    DOMAIN_STATS_FILE = os.getenv('DOMAIN_STATS_FILE', 'domain_stats.json')  # Файл статистики задержек по доменам
+    DOM_SETTLE_MS = int(os.getenv('DOM_SETTLE_MS', 1500))  # Страница без изменений DOM столько мс - элемента нет
+    TIER_REPROBE_PAGES = int(os.getenv('TIER_REPROBE_PAGES', 20))  # Через сколько страниц сайта браузером снова пробовать HTTP
+
+    # Повторы и отключение сайтов с ошибками
+    SCAN_RETRIES = int(os.getenv('SCAN_RETRIES', 2))  # Повторов при таймауте или ошибке соединения
+    SCAN_RETRY_DELAY = float(os.getenv('SCAN_RETRY_DELAY', 2.0))  # Базовая задержка (сек) перед повтором
+    BREAKER_THRESHOLD = int(os.getenv('BREAKER_THRESHOLD', 3))  # Неудачных страниц подряд до отключения сайта
+    BREAKER_COOLDOWN = float(os.getenv('BREAKER_COOLDOWN', 1800))  # На сколько секунд сайт отключается
+
+    # Сканирование по расписанию (интервалы в минутах)
+    SCHEDULE_ENABLED = os.getenv('SCHEDULE_ENABLED', '1') == '1'  # 0 - только ручной запуск
+    SCHEDULE_INTERVAL = int(os.getenv('SCHEDULE_INTERVAL', 360))  # Начальный интервал сканирования товара
+    SCHEDULE_MIN_INTERVAL = int(os.getenv('SCHEDULE_MIN_INTERVAL', 60))  # Для товаров с часто меняющейся ценой
+    SCHEDULE_MAX_INTERVAL = int(os.getenv('SCHEDULE_MAX_INTERVAL', 1440))  # Для товаров со стабильной ценой
+    SCHEDULE_MAX_PER_HOUR = int(os.getenv('SCHEDULE_MAX_PER_HOUR', 600))  # Не больше товаров в час по расписанию
+    SCHEDULE_TICK = int(os.getenv('SCHEDULE_TICK', 300))  # Проверка расписания раз в N секунд
+
+    # Продолжение прерванных сканирований: запуск старше N часов после перезапуска не продолжается
+    SCAN_RESUME_MAX_AGE = float(os.getenv('SCAN_RESUME_MAX_AGE', 12))
+    # Задача без отметки выполняющего экземпляра дольше N секунд считается прерванной и возвращается в очередь
+    SCAN_JOB_TIMEOUT = float(os.getenv('SCAN_JOB_TIMEOUT', 120))
+
+    # Внешние обработчики сканирования (python -m app.worker)
+    SCAN_EXTERNAL_WORKERS = os.getenv('SCAN_EXTERNAL_WORKERS', '0') == '1'  # 1 - приложение не сканирует само
+    SCAN_BATCH_SIZE = int(os.getenv('SCAN_BATCH_SIZE', 50))  # Товаров в пакете, выдаваемом обработчику
+    SCAN_LEASE_TIMEOUT = float(os.getenv('SCAN_LEASE_TIMEOUT', 300))  # Аренда пакета без продления, секунды
+    SCAN_BATCH_ATTEMPTS = int(os.getenv('SCAN_BATCH_ATTEMPTS', 3))  # Выдач пакета, после которых он не выдается
+    SCAN_POLL_INTERVAL = float(os.getenv('SCAN_POLL_INTERVAL', 5))  # Проверка новых пакетов и результатов, секунды
+
+    # Отправка сообщений Telegram
+    TG_GLOBAL_RATE = float(os.getenv('TG_GLOBAL_RATE', 25))  # Сообщений в секунду на весь бот
+    TG_CHAT_RATE = float(os.getenv('TG_CHAT_RATE', 1))  # Сообщений в секунду в один чат
+    TG_CHAT_BURST = float(os.getenv('TG_CHAT_BURST', 3))  # Сообщений в чат подряд без ожидания
+    TG_SEND_RETRIES = int(os.getenv('TG_SEND_RETRIES', 5))  # Повторов при ошибках сети и "retry after"
+    TG_PROGRESS_INTERVAL = float(os.getenv('TG_PROGRESS_INTERVAL', 3.0))  # Изменение хода сканирования раз в N сек
+
+    # Обработка входящих обновлений бота
+    UPDATE_WORKERS = int(os.getenv('UPDATE_WORKERS', 8))  # Обработчиков обновлений
+    UPDATE_QUEUE_SIZE = int(os.getenv('UPDATE_QUEUE_SIZE', 1000))  # Обновлений в очереди, сверх - отказ
@@ -1,31 +1,115 @@
 import os
-from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+from datetime import datetime, timezone
+from sqlalchemy import inspect, event, DateTime
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncEngine
 from sqlalchemy.ext.asyncio import AsyncAttrs
 from sqlalchemy.orm import DeclarativeBase
+from sqlalchemy.types import TypeDecorator
 
 # Импортируем конфигурацию
 from .config import Config
 
-# URL для подключения к базе данных SQLite
-DATABASE_URL = f"sqlite+aiosqlite:///{Config.DB_NAME}"
+# URL для подключения к базе данных: PostgreSQL из DATABASE_URL, иначе файл SQLite
+DATABASE_URL = Config.DATABASE_URL or f"sqlite+aiosqlite:///{Config.DB_NAME}"
+
+
+def apply_sqlite_pragmas(dbapi_connection, connection_record):
+    """
+    Настройка каждого нового соединения SQLite. WAL позволяет читать историю во время записи
+    результатов сканирования, synchronous=NORMAL в режиме WAL безопасен и не ждет диск на каждой
+    транзакции, busy_timeout заставляет ждать блокировку записи, а не сразу падать с "database is locked".
+    """
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.execute(f"PRAGMA busy_timeout={Config.SQLITE_BUSY_TIMEOUT}")
+    cursor.execute(f"PRAGMA mmap_size={Config.SQLITE_MMAP_SIZE}")
+    cursor.execute("PRAGMA temp_store=MEMORY")
+    cursor.close()
+
+
+def create_db_engine(url: str = DATABASE_URL) -> AsyncEngine:
+    """
+    Создание асинхронного движка SQLAlchemy с пулом соединений размером DB_POOL_SIZE + DB_MAX_OVERFLOW.
+    Для SQLite на каждое соединение применяются настройки apply_sqlite_pragmas.
+
+    :param url: URL базы данных (sqlite+aiosqlite://... или postgresql+asyncpg://...).
+    :return: Движок.
+    """
+    db_url = make_url(url)
+    options = dict(echo=False)  # Логи выключены
+    if db_url.get_backend_name() == 'postgresql':
+        options['pool_pre_ping'] = True  # Соединения, закрытые сервером, заменяются до выдачи
+    if db_url.database not in (None, '', ':memory:'):
+        options.update(pool_size=Config.DB_POOL_SIZE, max_overflow=Config.DB_MAX_OVERFLOW,
+                       pool_timeout=Config.DB_POOL_TIMEOUT)
+    db_engine = create_async_engine(db_url, **options)
+    if db_url.get_backend_name() == 'sqlite':
+        event.listen(db_engine.sync_engine, 'connect', apply_sqlite_pragmas)
+    return db_engine
+
 
 # Создание асинхронного движка SQLAlchemy
-engine = create_async_engine(DATABASE_URL, echo=False)  # Логи выключены
+engine = create_db_engine()
 
 # Создание асинхронной фабрики сессий
 async_session = async_sessionmaker(engine, expire_on_commit=False)
 
 
+class UTCDateTime(TypeDecorator):
+    """
+    Время в UTC без часового пояса. Время с часовым поясом приводится к UTC при записи:
+    SQLite отбрасывает часовой пояс сам, а PostgreSQL (asyncpg) не принимает его в TIMESTAMP.
+    """
+    impl = DateTime
+    cache_ok = True
+
+    def process_bind_param(self, value, dialect):
+        if isinstance(value, datetime) and value.tzinfo is not None:
+            value = value.astimezone(timezone.utc).replace(tzinfo=None)
+        return value
+
+
 # Базовый класс для моделей
 class Base(AsyncAttrs, DeclarativeBase):
     pass
 
 
-# Создаем все таблицы, определенные в моделях
+def dialect_insert(session):
+    """Конструктор INSERT с поддержкой ON CONFLICT для диалекта БД, к которой подключена сессия"""
+    return postgresql.insert if session.bind.dialect.name == 'postgresql' else sqlite.insert
+
+
+def add_missing_columns(conn):
+    """
+    Добавляет в существующие таблицы столбцы, появившиеся в моделях позже.
+    create_all создает только новые таблицы и не меняет уже созданные.
+    """
+    inspector = inspect(conn)
+    for table in Base.metadata.sorted_tables:
+        if not inspector.has_table(table.name):
+            continue
+        existing = {column['name'] for column in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name not in existing:
+                column_type = column.type.compile(dialect=conn.dialect)
+                conn.exec_driver_sql(f'ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}')
+
+
+def add_missing_indexes(conn):
+    """Создает индексы моделей, которых еще нет в существующих таблицах"""
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(conn, checkfirst=True)
+
+
+# Создаем все таблицы, определенные в моделях, и выполняем миграции
 async def create_tables():
-    from app.models.models import ProductInfo, PriceScan
+    from app.db.migrations import migrate
     async with engine.begin() as conn:
-        await conn.run_sync(Base.metadata.create_all)
+        await conn.run_sync(migrate)
 
 
 # Функция для получения асинхронной сессии
@@ -1,23 +1,39 @@
 import pytz
-from typing import List, Dict, Tuple, Sequence
-from datetime import datetime, timezone
-from sqlalchemy import delete
+from typing import AsyncIterator, List, Dict, Optional, Tuple, Sequence
+from datetime import datetime, timedelta, timezone
+from sqlalchemy import delete, insert, update, func, union, bindparam, exists, case
+from sqlalchemy.orm import aliased
 from sqlalchemy.future import select
-from sqlalchemy.orm import selectinload
 from sqlalchemy.ext.asyncio import AsyncSession
 
-from app.models.models import ProductInfo, PriceScan
-from app.core.database import engine, Base
+from app.models.models import ProductInfo, PriceScan, ScanRun, PriceInterval, ScanCheckpoint, SchemaMigration
+from app.core.config import Config
+from app.core.database import Base, dialect_insert
+from app.db.rollups import update_rollups, get_rollups, PERIOD_DAY, PERIOD_WEEK
+from app.services.outcomes import OK
 
+# Режимы хранения истории цен (Config.PRICE_STORAGE_MODE)
+STORAGE_SCANS = 'scans'  # Запись на каждое сканирование
+STORAGE_INTERVALS = 'intervals'  # Запись на каждый период неизменной цены
 
-async def get_all_products(session: AsyncSession) -> Sequence[ProductInfo]:
+
+async def get_all_products(session: AsyncSession, product_ids: Optional[List[int]] = None,
+                           exclude_run_id: Optional[str] = None) -> Sequence[ProductInfo]:
     """
     Асинхронно получает все записи из таблицы ProductInfo.
 
     :param session: Асинхронная сессия для взаимодействия с базой данных.
+    :param product_ids: Получить только товары с этими ID, None - все товары.
+    :param exclude_run_id: Пропустить товары, уже обработанные в этом запуске сканирования.
     :return: Список объектов ProductInfo.
     """
-    result = await session.execute(select(ProductInfo))
+    query = select(ProductInfo)
+    if product_ids is not None:
+        query = query.where(ProductInfo.id.in_(product_ids))
+    if exclude_run_id is not None:
+        query = query.where(~exists().where(ScanCheckpoint.run_id == exclude_run_id,
+                                            ScanCheckpoint.product_id == ProductInfo.id))
+    result = await session.execute(query)
     products = result.scalars().all()
     return products
 
@@ -30,66 +46,297 @@ async def add_price_scan(session: AsyncSession, product: ProductInfo, price: int
     :param product: Объект ProductInfo, для которого добавляется запись о цене.
     :param price: Цена продукта в копейках.
     """
-    price_scan = PriceScan(
+    await add_price_scans(session, [dict(
         product_id=product.id,
         price=price,
-        scan_time=datetime.now(timezone.utc)  # Используем datetime.now с timezone.utc
-    )
-    session.add(price_scan)
+        scan_time=datetime.now(timezone.utc),  # Используем datetime.now с timezone.utc
+        run_id=None
+    )])
+
+
+async def add_scan_run(session: AsyncSession, run_id: str, scan_time: datetime):
+    """
+    Асинхронно регистрирует запуск сканирования. Продолжаемый запуск уже зарегистрирован.
+
+    :param session: Асинхронная сессия для взаимодействия с базой данных.
+    :param run_id: Идентификатор запуска.
+    :param scan_time: Время сканирования, общее для всех записей запуска.
+    """
+    if await session.get(ScanRun, run_id) is None:
+        session.add(ScanRun(run_id=run_id, scan_time=scan_time))
+        await session.commit()
+
+
+async def get_scan_run(session: AsyncSession, run_id: str) -> Optional[ScanRun]:
+    """
+    Асинхронно получает запуск сканирования.
+
+    :param session: Асинхронная сессия для взаимодействия с базой данных.
+    :param run_id: Идентификатор запуска.
+    """
+    return await session.get(ScanRun, run_id)
+
+
+async def add_price_scans(session: AsyncSession, rows: List[Dict], checkpoints: Optional[List[Dict]] = None):
+    """
+    Асинхронно сохраняет пакет результатов сканирования и обновляет сводки одной транзакцией.
+    В режиме хранения STORAGE_SCANS каждый результат - новая запись PriceScan,
+    в режиме STORAGE_INTERVALS результаты сворачиваются в PriceInterval.
+
+    :param session: Асинхронная сессия для взаимодействия с базой данных.
+    :param rows: Список словарей с ключами product_id, price, scan_time и run_id.
+    :param checkpoints: Отметки об обработке товаров (ScanCheckpoint): run_id, product_id, status.
+                        Записываются в той же транзакции, что и цены.
+    """
+    if not rows and not checkpoints:
+        return
+    if checkpoints:
+        insert_stmt = dialect_insert(session)(ScanCheckpoint)
+        await session.execute(insert_stmt.on_conflict_do_nothing(), checkpoints)
+    if rows:
+        if Config.PRICE_STORAGE_MODE == STORAGE_INTERVALS:
+            await _extend_price_intervals(session, rows)
+        else:
+            await session.execute(insert(PriceScan), rows)
+        await update_rollups(session, rows)  # Сводки обновляются в той же транзакции
     await session.commit()
 
 
-async def get_product_prices(session: AsyncSession, user_timezone: str = 'Europe/Moscow') -> List[
-    Tuple[str, str, Dict[str, int]]]:
+async def _extend_price_intervals(session: AsyncSession, rows: List[Dict]):
     """
-    Асинхронно извлекает историю цен всех продуктов из базы данных.
+    Сворачивает результаты сканирования в периоды неизменной цены. Если цена совпадает
+    с ценой последнего периода товара, у периода продлевается last_seen, иначе начинается новый период.
+    Все изменения пакета выполняются двумя пакетными запросами.
+    Продолженный после прерывания запуск пишет результаты со своим прежним временем, поэтому
+    результат может оказаться старше последнего периода: last_seen при этом не уменьшается,
+    а другая цена записывается отдельным периодом из одного сканирования, не продлевая его.
+
+    :param session: Асинхронная сессия для взаимодействия с базой данных.
+    :param rows: Список словарей с ключами product_id, price, scan_time.
+    """
+    # Последний период каждого товара пакета
+    latest = select(
+        PriceInterval.id, PriceInterval.product_id, PriceInterval.price, PriceInterval.last_seen,
+        func.row_number().over(partition_by=PriceInterval.product_id,
+                               order_by=PriceInterval.last_seen.desc()).label('rn'),
+    ).where(PriceInterval.product_id.in_({row['product_id'] for row in rows})).subquery()
+    result = await session.execute(
+        select(latest.c.id, latest.c.product_id, latest.c.price, latest.c.last_seen).where(latest.c.rn == 1))
+    current = {product_id: dict(id=interval_id, price=price, last_seen=last_seen)
+               for interval_id, product_id, price, last_seen in result.all()}
+
+    extended: Dict[int, Dict] = {}  # id существующего периода -> продление
+    opened: Dict[int, Dict] = {}  # product_id -> новый период, который еще может продлиться в этом пакете
+    closed: List[Dict] = []  # Новые периоды, завершенные внутри пакета
+    for row in sorted(rows, key=lambda r: r['scan_time']):
+        product_id, price, scan_time = row['product_id'], row['price'], row['scan_time']
+        pending = opened.get(product_id)
+        last = current.get(product_id)
+        if pending is not None and pending['price'] == price:
+            pending['last_seen'] = scan_time
+            pending['scan_count'] += 1
+        elif pending is None and last is not None and last['price'] == price:
+            update_row = extended.setdefault(last['id'], dict(b_id=last['id'], b_count=0, b_last_seen=scan_time))
+            update_row['b_last_seen'] = max(update_row['b_last_seen'], scan_time)
+            update_row['b_count'] += 1
+        elif pending is None and last is not None and _to_utc_naive(scan_time) < _to_utc_naive(last['last_seen']):
+            # Результат старше последнего периода: новый период открывать нельзя, он перекрыл бы последний
+            closed.append(dict(product_id=product_id, price=price,
+                               first_seen=scan_time, last_seen=scan_time, scan_count=1))
+        else:
+            if pending is not None:
+                closed.append(pending)
+            opened[product_id] = dict(product_id=product_id, price=price,
+                                      first_seen=scan_time, last_seen=scan_time, scan_count=1)
+
+    if extended:
+        table = PriceInterval.__table__
+        seen = bindparam('b_last_seen', type_=table.c.last_seen.type)
+        await session.execute(
+            update(table).where(table.c.id == bindparam('b_id'))
+            .values(last_seen=case((seen > table.c.last_seen, seen), else_=table.c.last_seen),
+                    scan_count=table.c.scan_count + bindparam('b_count')),
+            list(extended.values())
+        )
+    if opened or closed:
+        await session.execute(insert(PriceInterval), closed + list(opened.values()))
+
+
+def price_points():
+    """
+    Источник точек истории (product_id, scan_time, price) для текущего режима хранения.
+    В режиме STORAGE_INTERVALS точки восстанавливаются из периодов и отметок об обработке
+    (ScanCheckpoint, в этом режиме они не удаляются после запуска): каждый запуск, успешно
+    сканировавший товар внутри периода, дает точку с ценой периода. Границы периода
+    добавляются отдельно, поэтому история не зависит от того, сохранились ли отметки.
+    Период из одного сканирования, записанный поверх более длинного (результат продолженного запуска),
+    заменяет точку длинного периода в это время.
+    """
+    if Config.PRICE_STORAGE_MODE != STORAGE_INTERVALS:
+        return select(PriceScan.product_id, PriceScan.scan_time, PriceScan.price).subquery()
+
+    first = select(PriceInterval.product_id, PriceInterval.first_seen.label('scan_time'), PriceInterval.price)
+    last = select(PriceInterval.product_id, PriceInterval.last_seen.label('scan_time'), PriceInterval.price)
+    single = aliased(PriceInterval)
+    scanned = (
+        select(PriceInterval.product_id, ScanRun.scan_time, PriceInterval.price)
+        .join(ScanCheckpoint, ScanCheckpoint.product_id == PriceInterval.product_id)
+        .join(ScanRun, ScanRun.run_id == ScanCheckpoint.run_id)
+        .where(ScanCheckpoint.status == OK,
+               ScanRun.scan_time > PriceInterval.first_seen, ScanRun.scan_time < PriceInterval.last_seen,
+               ~exists().where(single.product_id == PriceInterval.product_id,
+                               single.first_seen == ScanRun.scan_time, single.last_seen == ScanRun.scan_time))
+    )
+    return union(first, last, scanned).subquery()
+
+
+def _to_utc_naive(value: datetime) -> datetime:
+    """Время в UTC без часового пояса, в таком виде scan_time хранится в БД"""
+    if value.tzinfo is not None:
+        value = value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value
+
+
+async def get_product_prices_page(session: AsyncSession, after_id: int = 0, limit: int = 50,
+                                  scans_per_product: Optional[int] = None,
+                                  date_from: Optional[datetime] = None, date_to: Optional[datetime] = None,
+                                  user_timezone: str = 'Europe/Moscow') -> List[Tuple[int, str, str, Dict[str, int]]]:
+    """
+    Асинхронно извлекает страницу истории цен: `limit` товаров с id больше `after_id`
+    и для каждого последние `scans_per_product` сканирований и/или сканирования за период.
+    Отбор и сортировка выполняются в БД, в Python попадают только нужные строки.
+    Период длиннее Config.ROLLUP_MIN_DAYS читается из дневных сводок: одна цена
+    (последняя за день) на каждый день, период длиннее Config.ROLLUP_WEEK_MIN_DAYS - из недельных:
+    одна цена на неделю (дата - понедельник недели).
 
     :param session: Асинхронная сессия SQLAlchemy.
+    :param after_id: ID последнего товара предыдущей страницы (0 - с начала).
+    :param limit: Количество товаров на странице.
+    :param scans_per_product: Сколько последних сканирований вернуть для товара (None - все).
+    :param date_from: Начало периода (включительно), None - без ограничения.
+    :param date_to: Конец периода (не включительно), None - без ограничения.
     :param user_timezone: Часовой пояс пользователя, например, 'Europe/Moscow'.
-    :return: Список кортежей, где [0] - название продукта, [1] - url ресурса, а [2] - словарь {дата: цена},
-             отсортированный по дате.
+    :return: Список кортежей (id, название, url, словарь {дата: цена} по возрастанию даты).
+             Пустой список, если товары закончились.
     """
-    stmt = select(ProductInfo).options(selectinload(ProductInfo.price_scans))
-    result = await session.execute(stmt)
-    products = result.scalars().all()
+    products = (await session.execute(
+        select(ProductInfo.id, ProductInfo.title, ProductInfo.url)
+        .where(ProductInfo.id > after_id).order_by(ProductInfo.id).limit(limit)
+    )).all()
+    if not products:
+        return []
+
+    if date_from is not None and date_to is not None:
+        days = (date_to - date_from).days
+        if days > Config.ROLLUP_WEEK_MIN_DAYS:
+            return await _get_rollup_prices(session, products, PERIOD_WEEK, scans_per_product, date_from, date_to)
+        if days > Config.ROLLUP_MIN_DAYS:
+            return await _get_rollup_prices(session, products, PERIOD_DAY, scans_per_product, date_from, date_to)
+
+    # Последние N сканирований каждого товара страницы через оконную функцию
+    points = price_points()
+    scans = select(
+        points.c.product_id, points.c.scan_time, points.c.price,
+        func.row_number().over(partition_by=points.c.product_id,
+                               order_by=points.c.scan_time.desc()).label('rn'),
+    ).where(points.c.product_id.in_([product.id for product in products]))
+    if date_from is not None:
+        scans = scans.where(points.c.scan_time >= _to_utc_naive(date_from))
+    if date_to is not None:
+        scans = scans.where(points.c.scan_time < _to_utc_naive(date_to))
+    scans = scans.subquery()
+
+    stmt = select(scans.c.product_id, scans.c.scan_time, scans.c.price)
+    if scans_per_product is not None:
+        stmt = stmt.where(scans.c.rn <= scans_per_product)
+    stmt = stmt.order_by(scans.c.product_id, scans.c.scan_time)
 
     # Преобразование времени в часовой пояс пользователя
     user_tz = pytz.timezone(user_timezone)
-
-    def convert_to_user_timezone(scan_time):
+    history: Dict[int, Dict[str, int]] = {product.id: {} for product in products}
+    for product_id, scan_time, price in (await session.execute(stmt)).all():
         # Если scan_time наивное (без часового пояса), привязываем к UTC
         if scan_time.tzinfo is None:
             scan_time = scan_time.replace(tzinfo=timezone.utc)
-        # Преобразуем время в часовой пояс пользователя
-        return scan_time.astimezone(user_tz)
+        scan_time = scan_time.astimezone(user_tz)
+        history[product_id][scan_time.strftime("%d.%m.%Y %H:%M")] = price
+
+    return [(product.id, product.title, product.url, history[product.id]) for product in products]
+
+
+async def _get_rollup_prices(session: AsyncSession, products: Sequence, period: str,
+                             scans_per_product: Optional[int], date_from: datetime,
+                             date_to: datetime) -> List[Tuple[int, str, str, Dict[str, int]]]:
+    """
+    Страница истории цен по сводкам: последняя цена каждого дня (PERIOD_DAY)
+    или каждой недели (PERIOD_WEEK) периода. Неделя, в которую попадает начало периода, включается.
+    День, в который попадает конец периода, включается, если период захватывает его часть.
+    """
+    rollup_tz = pytz.timezone(Config.ROLLUP_TIMEZONE)
+
+    def to_day(value: datetime):
+        if value.tzinfo is None:
+            value = value.replace(tzinfo=timezone.utc)
+        return value.astimezone(rollup_tz).date()
+
+    first_day = to_day(date_from)
+    if period == PERIOD_WEEK:
+        first_day -= timedelta(days=first_day.weekday())  # Сводка недели хранится под ее понедельником
+    last_day = to_day(date_to - timedelta(microseconds=1)) + timedelta(days=1)
+    rollups = await get_rollups(session, [product.id for product in products], period, first_day, last_day)
+    result = []
+    for product in products:
+        periods = rollups[product.id][-scans_per_product:] if scans_per_product else rollups[product.id]
+        result.append((product.id, product.title, product.url,
+                       {rollup.period_start.strftime("%d.%m.%Y"): rollup.last_price for rollup in periods}))
+    return result
 
-    return [(
-        product.title, product.url, {
-            convert_to_user_timezone(scan.scan_time).strftime("%d.%m.%Y %H:%M"): scan.price
-            for scan in sorted(product.price_scans, key=lambda x: x.scan_time)
-        })
-        for product in products
-    ]
+
+async def iter_product_prices(session: AsyncSession, page_size: int = 50,
+                              **kwargs) -> AsyncIterator[List[Tuple[int, str, str, Dict[str, int]]]]:
+    """
+    Асинхронно перебирает историю цен постранично, следующая страница запрашивается
+    только когда нужна. Параметры отбора те же, что у get_product_prices_page.
+
+    :param session: Асинхронная сессия SQLAlchemy.
+    :param page_size: Количество товаров на странице.
+    :return: Асинхронный итератор страниц.
+    """
+    after_id = 0
+    while page := await get_product_prices_page(session, after_id=after_id, limit=page_size, **kwargs):
+        yield page
+        after_id = page[-1][0]
+
+
+async def get_product_prices(session: AsyncSession, user_timezone: str = 'Europe/Moscow') -> List[
+    Tuple[str, str, Dict[str, int]]]:
+    """
+    Асинхронно извлекает историю цен всех продуктов из базы данных.
+
+    :param session: Асинхронная сессия SQLAlchemy.
+    :param user_timezone: Часовой пояс пользователя, например, 'Europe/Moscow'.
+    :return: Список кортежей, где [0] - название продукта, [1] - url ресурса, а [2] - словарь {дата: цена},
+             отсортированный по дате.
+    """
+    return [(title, url, dates)
+            async for page in iter_product_prices(session, user_timezone=user_timezone)
+            for _, title, url, dates in page]
 
 
 async def clear_tables(session: AsyncSession) -> str:
     """
-    Удаляет все записи из таблиц ProductInfo и PriceScan.
+    Удаляет все записи из таблиц приложения одной транзакцией. Схема и отметки о выполненных
+    миграциях сохраняются, поэтому очистка безопасна и при нескольких экземплярах приложения с общей БД.
 
     :param session: Асинхронная сессия для взаимодействия с базой данных.
     """
     try:
-        pass
-        # Удаляем все таблицы
-        async with engine.begin() as conn:
-            await conn.run_sync(Base.metadata.drop_all)
-
-        # Создаем все таблицы заново
-        async with engine.begin() as conn:
-            await conn.run_sync(Base.metadata.create_all)
+        # Зависимые таблицы очищаются раньше тех, на которые они ссылаются
+        for table in reversed(Base.metadata.sorted_tables):
+            if table.name != SchemaMigration.__tablename__:
+                await session.execute(delete(table))
+        await session.commit()
     except Exception as e:
         await session.rollback()
         return f"Произошла ошибка при удалении записей: {e}"
-    finally:
-        await session.close()
-        return "База данных очищена"
+    return "База данных очищена"
@@ -0,0 +1,180 @@
+import sys
+import asyncio
+import logging
+from datetime import datetime, timezone
+from typing import Callable, Dict, List, Tuple
+
+from sqlalchemy import inspect, text, select, insert
+from sqlalchemy.engine import Connection
+
+from app.core.database import Base, add_missing_columns, add_missing_indexes
+from app.models.models import SchemaMigration
+from app.services.data_processing import normalize_url, normalize_xpath
+
+logger = logging.getLogger(__name__)
+
+UNIQUE_PRODUCT_INDEX = "ux_product_info_url_xpath"
+MIGRATION_LOCK_ID = 7310264  # Ключ блокировки PostgreSQL: миграции выполняет один экземпляр приложения
+
+
+def merge_duplicate_products(conn: Connection):
+    """
+    Разовая миграция перед созданием уникального индекса (url, xpath) в product_info.
+
+    Нормализует url и xpath существующих товаров, затем объединяет дубликаты:
+    остается запись с наименьшим id, история цен (price_scans, price_intervals), сводки (price_rollups)
+    и отметки об обработке (scan_checkpoints) остальных переносятся на нее, а сами дубликаты удаляются.
+    Если индекс уже создан, ничего не делает.
+    """
+    inspector = inspect(conn)
+    if not inspector.has_table("product_info"):
+        return
+    if any(index['name'] == UNIQUE_PRODUCT_INDEX for index in inspector.get_indexes("product_info")):
+        return
+
+    # Нормализация значений
+    rows = conn.execute(text("SELECT id, url, xpath FROM product_info ORDER BY id")).all()
+    keep_ids: Dict[Tuple[str, str], int] = {}
+    changed, duplicates = [], []
+    for row in rows:
+        url, xpath = normalize_url(row.url), normalize_xpath(row.xpath)
+        keep_id = keep_ids.setdefault((url, xpath), row.id)
+        if keep_id != row.id:
+            duplicates.append(dict(dup=row.id, keep=keep_id))
+        elif (row.url, row.xpath) != (url, xpath):
+            changed.append(dict(id=row.id, url=url, xpath=xpath))
+    if not duplicates:
+        if changed:
+            conn.execute(text("UPDATE product_info SET url = :url, xpath = :xpath WHERE id = :id"), changed)
+        return
+
+    # Перенос истории на оставляемую запись
+    tables = set(inspector.get_table_names())
+    for table in ("price_scans", "price_intervals"):
+        if table in tables:
+            conn.execute(text(f"UPDATE {table} SET product_id = :keep WHERE product_id = :dup"), duplicates)
+    if "scan_checkpoints" in tables:
+        # Если в запуске обработаны оба товара, остается отметка оставляемого
+        conn.execute(text("""
+            DELETE FROM scan_checkpoints WHERE product_id = :dup
+            AND run_id IN (SELECT run_id FROM scan_checkpoints WHERE product_id = :keep)
+        """), duplicates)
+        conn.execute(text("UPDATE scan_checkpoints SET product_id = :keep WHERE product_id = :dup"), duplicates)
+    if "price_rollups" in tables:
+        _merge_duplicate_rollups(conn, duplicates)
+
+    conn.execute(text("DELETE FROM product_info WHERE id = :dup"), duplicates)
+    if changed:
+        conn.execute(text("UPDATE product_info SET url = :url, xpath = :xpath WHERE id = :id"), changed)
+    logger.info(f"Merged {len(duplicates)} duplicate product(s) into existing records")
+
+
+def _merge_duplicate_rollups(conn: Connection, duplicates: List[Dict[str, int]]):
+    """
+    Перенос сводок цен дубликатов на оставляемые записи. Сводка за период, который есть
+    у обоих товаров, объединяется со сводкой оставляемой записи.
+    """
+    columns = "id, min_price, max_price, first_price, first_time, last_price, last_time, scan_count"
+    for pair in duplicates:
+        for rollup in conn.execute(text(
+                f"SELECT {columns}, period, period_start FROM price_rollups WHERE product_id = :dup"), pair).all():
+            kept = conn.execute(text(
+                f"SELECT {columns} FROM price_rollups "
+                f"WHERE product_id = :keep AND period = :period AND period_start = :period_start"
+            ), dict(keep=pair['keep'], period=rollup.period, period_start=rollup.period_start)).first()
+            if kept is None:
+                conn.execute(text("UPDATE price_rollups SET product_id = :keep WHERE id = :id"),
+                             dict(keep=pair['keep'], id=rollup.id))
+                continue
+            first = min(kept, rollup, key=lambda item: item.first_time)
+            last = max(kept, rollup, key=lambda item: item.last_time)
+            conn.execute(text("""
+                UPDATE price_rollups SET min_price = :min_price, max_price = :max_price,
+                first_price = :first_price, first_time = :first_time, last_price = :last_price,
+                last_time = :last_time, scan_count = :scan_count WHERE id = :id
+            """), dict(id=kept.id, min_price=min(kept.min_price, rollup.min_price),
+                       max_price=max(kept.max_price, rollup.max_price),
+                       first_price=first.first_price, first_time=first.first_time,
+                       last_price=last.last_price, last_time=last.last_time,
+                       scan_count=kept.scan_count + rollup.scan_count))
+            conn.execute(text("DELETE FROM price_rollups WHERE id = :id"), dict(id=rollup.id))
+
+
+# Миграции данных по порядку выполнения. Каждая выполняется один раз и записывается в schema_migrations.
+# Новые таблицы, столбцы и индексы моделей создаются автоматически, миграция нужна для изменений,
+# которые нельзя получить добавлением: перенос и исправление данных, удаление, переименование.
+# Миграции выполняются до создания недостающих индексов.
+MIGRATIONS: List[Tuple[str, Callable[[Connection], None]]] = [
+    ("0001_merge_duplicate_products", merge_duplicate_products),
+]
+
+
+def applied_migrations(conn: Connection) -> List[str]:
+    """Имена выполненных миграций"""
+    if not inspect(conn).has_table(SchemaMigration.__tablename__):
+        return []
+    return list(conn.execute(select(SchemaMigration.name)).scalars().all())
+
+
+def pending_migrations(conn: Connection) -> List[str]:
+    """Имена миграций, которые еще не выполнены"""
+    applied = set(applied_migrations(conn))
+    return [name for name, _ in MIGRATIONS if name not in applied]
+
+
+def migrate(conn: Connection) -> List[str]:
+    """
+    Приведение схемы БД к моделям: создание новых таблиц и столбцов, выполнение
+    невыполненных миграций и создание недостающих индексов. Выполняется в одной транзакции
+    при каждом запуске приложения. В PostgreSQL экземпляры приложения, запущенные одновременно,
+    ждут друг друга на блокировке, поэтому миграция не выполняется дважды.
+
+    :param conn: Соединение в открытой транзакции.
+    :return: Имена выполненных миграций.
+    """
+    if conn.dialect.name == 'postgresql':
+        conn.execute(text("SELECT pg_advisory_xact_lock(:key)"), dict(key=MIGRATION_LOCK_ID))
+    Base.metadata.create_all(conn)
+    add_missing_columns(conn)
+    done = []
+    applied = set(applied_migrations(conn))
+    for name, migration in MIGRATIONS:
+        if name in applied:
+            continue
+        migration(conn)
+        conn.execute(insert(SchemaMigration), dict(name=name, applied_at=datetime.now(timezone.utc)))
+        logger.info(f"Applied migration {name}")
+        done.append(name)
+    add_missing_indexes(conn)
+    return done
+
+
+async def main():
+    """
+    Запуск из командной строки: python -m app.db.migrations [status].
+    Без аргументов выполняет миграции, status - выводит выполненные и ожидающие миграции.
+    Проверить миграции без PostgreSQL можно на копии файла SQLite: DATABASE_URL=sqlite+aiosqlite:///copy.db
+    """
+    from app.core.database import engine
+
+    command = sys.argv[1:]
+    if command not in ([], ['status']):
+        print("Использование: python -m app.db.migrations [status]")
+        return
+    async with engine.begin() as conn:
+        if command == ['status']:
+            applied = await conn.run_sync(applied_migrations)
+            pending = await conn.run_sync(pending_migrations)
+        else:
+            done = await conn.run_sync(migrate)
+    await engine.dispose()
+    print(f"БД: {engine.url.render_as_string(hide_password=True)}")
+    if command == ['status']:
+        print("Выполнены: " + (", ".join(applied) or "нет"))
+        print("Ожидают: " + (", ".join(pending) or "нет"))
+    else:
+        print("Выполнены миграции: " + (", ".join(done) or "нет новых"))
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,173 @@
+import sys
+import pytz
+import asyncio
+import logging
+from datetime import date, datetime, timedelta, timezone
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy import case, delete, select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.core.config import Config
+from app.core.database import dialect_insert
+from app.models.models import PriceRollup
+
+logger = logging.getLogger(__name__)
+
+# Периоды сводок
+PERIOD_DAY = 'day'
+PERIOD_WEEK = 'week'
+
+BACKFILL_BATCH = 10000  # Сколько точек истории агрегируется за один проход при пересчете
+
+
+def _utc_naive(value: datetime) -> datetime:
+    """Время в UTC без часового пояса, в таком виде время хранится в БД"""
+    if value.tzinfo is not None:
+        value = value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value
+
+
+def period_starts(scan_time: datetime) -> List[Tuple[str, date]]:
+    """
+    Начала дня и недели, в которые попадает время сканирования, в часовом поясе сводок.
+
+    :param scan_time: Время сканирования (без часового пояса считается UTC).
+    :return: Список пар (период, первый день периода).
+    """
+    if scan_time.tzinfo is None:
+        scan_time = scan_time.replace(tzinfo=timezone.utc)
+    day = scan_time.astimezone(pytz.timezone(Config.ROLLUP_TIMEZONE)).date()
+    return [(PERIOD_DAY, day), (PERIOD_WEEK, day - timedelta(days=day.weekday()))]
+
+
+def aggregate(points: Iterable[Tuple[int, datetime, int]]) -> List[Dict]:
+    """
+    Сворачивает точки истории в строки сводок.
+
+    :param points: Точки (product_id, scan_time, price).
+    :return: Список словарей для вставки в PriceRollup.
+    """
+    rollups: Dict[Tuple[int, str, date], Dict] = {}
+    for product_id, scan_time, price in points:
+        scan_time = _utc_naive(scan_time)
+        for period, start in period_starts(scan_time):
+            rollup = rollups.get((product_id, period, start))
+            if rollup is None:
+                rollups[(product_id, period, start)] = dict(
+                    product_id=product_id, period=period, period_start=start,
+                    min_price=price, max_price=price, first_price=price, first_time=scan_time,
+                    last_price=price, last_time=scan_time, scan_count=1)
+                continue
+            rollup['min_price'] = min(rollup['min_price'], price)
+            rollup['max_price'] = max(rollup['max_price'], price)
+            if scan_time < rollup['first_time']:
+                rollup['first_price'], rollup['first_time'] = price, scan_time
+            if scan_time >= rollup['last_time']:
+                rollup['last_price'], rollup['last_time'] = price, scan_time
+            rollup['scan_count'] += 1
+    return list(rollups.values())
+
+
+async def merge_rollups(session: AsyncSession, rollups: List[Dict]):
+    """
+    Добавляет строки сводок, объединяя их с уже записанными за те же периоды (без commit).
+
+    :param session: Асинхронная сессия для взаимодействия с базой данных.
+    :param rollups: Строки сводок, результат aggregate.
+    """
+    if not rollups:
+        return
+    stmt = dialect_insert(session)(PriceRollup)
+    new, old = stmt.excluded, PriceRollup.__table__.c
+    stmt = stmt.on_conflict_do_update(
+        index_elements=['product_id', 'period', 'period_start'],
+        set_=dict(
+            min_price=case((new.min_price < old.min_price, new.min_price), else_=old.min_price),
+            max_price=case((new.max_price > old.max_price, new.max_price), else_=old.max_price),
+            first_price=case((new.first_time < old.first_time, new.first_price), else_=old.first_price),
+            first_time=case((new.first_time < old.first_time, new.first_time), else_=old.first_time),
+            last_price=case((new.last_time >= old.last_time, new.last_price), else_=old.last_price),
+            last_time=case((new.last_time >= old.last_time, new.last_time), else_=old.last_time),
+            scan_count=old.scan_count + new.scan_count,
+        )
+    )
+    await session.execute(stmt, rollups)
+
+
+async def update_rollups(session: AsyncSession, rows: List[Dict]):
+    """
+    Инкрементально обновляет сводки по пакету результатов сканирования (без commit).
+
+    :param session: Асинхронная сессия для взаимодействия с базой данных.
+    :param rows: Список словарей с ключами product_id, price, scan_time.
+    """
+    await merge_rollups(session, aggregate((row['product_id'], row['scan_time'], row['price']) for row in rows))
+
+
+async def backfill_rollups(session: AsyncSession) -> int:
+    """
+    Пересчитывает все сводки по сохраненной истории цен. История читается потоком
+    и агрегируется пакетами, в памяти не держится целиком.
+
+    :param session: Асинхронная сессия для взаимодействия с базой данных.
+    :return: Количество обработанных точек истории.
+    """
+    from app.db.crud import price_points
+
+    points = price_points()
+    await session.execute(delete(PriceRollup))
+    total = 0
+    result = await session.stream(select(points.c.product_id, points.c.scan_time, points.c.price))
+    async for batch in result.partitions(BACKFILL_BATCH):
+        await merge_rollups(session, aggregate(batch))
+        total += len(batch)
+    await session.commit()
+    return total
+
+
+async def get_rollups(session: AsyncSession, product_ids: List[int], period: str = PERIOD_DAY,
+                      date_from: Optional[date] = None, date_to: Optional[date] = None) -> Dict[int, List[PriceRollup]]:
+    """
+    Асинхронно читает сводки цен товаров за период.
+
+    :param session: Асинхронная сессия для взаимодействия с базой данных.
+    :param product_ids: ID товаров.
+    :param period: PERIOD_DAY или PERIOD_WEEK.
+    :param date_from: Первый день (включительно), None - без ограничения.
+    :param date_to: Последний день (не включительно), None - без ограничения.
+    :return: Словарь {product_id: список сводок по возрастанию даты}.
+    """
+    stmt = select(PriceRollup).where(PriceRollup.product_id.in_(product_ids), PriceRollup.period == period)
+    if date_from is not None:
+        stmt = stmt.where(PriceRollup.period_start >= date_from)
+    if date_to is not None:
+        stmt = stmt.where(PriceRollup.period_start < date_to)
+    stmt = stmt.order_by(PriceRollup.product_id, PriceRollup.period_start)
+
+    rollups: Dict[int, List[PriceRollup]] = {product_id: [] for product_id in product_ids}
+    for rollup in (await session.execute(stmt)).scalars().all():
+        rollups[rollup.product_id].append(rollup)
+    return rollups
+
+
+async def main():
+    """Запуск из командной строки: python -m app.db.rollups backfill"""
+    from app.core.database import async_session, create_tables
+    from app.db.crud import STORAGE_INTERVALS
+
+    if sys.argv[1:] != ['backfill']:
+        print("Использование: python -m app.db.rollups backfill")
+        return
+    if Config.PRICE_STORAGE_MODE == STORAGE_INTERVALS:
+        # Периоды не хранят каждое сканирование: пересчет удалил бы точные сводки и построил приближенные
+        print("Пересчет сводок работает только при PRICE_STORAGE_MODE=scans")
+        return
+    await create_tables()
+    async with async_session() as session:
+        total = await backfill_rollups(session)
+    print(f"Сводки пересчитаны, обработано записей истории: {total}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,193 @@
+from collections import Counter
+from datetime import datetime, timedelta, timezone
+from typing import List, Optional
+
+from sqlalchemy import update, and_, or_, func
+from sqlalchemy.future import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.models.models import ProductInfo, ScanBatch, ScanCheckpoint
+
+# Состояния пакета
+BATCH_QUEUED = 'queued'  # Ждет обработчика
+BATCH_LEASED = 'leased'  # Выдан обработчику
+BATCH_DONE = 'done'  # Обработан
+BATCH_FAILED = 'failed'  # Не обработан за SCAN_BATCH_ATTEMPTS выдач
+BATCH_CANCELLED = 'cancelled'  # Задача остановлена
+
+FINISHED_BATCH_STATUSES = (BATCH_DONE, BATCH_FAILED, BATCH_CANCELLED)
+
+
+def _utc_now() -> datetime:
+    """Текущее время в UTC без часового пояса, в таком виде время хранится в БД"""
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+def _available(now: datetime):
+    """Условие выдачи пакета: ожидает обработчика или аренда истекла"""
+    return or_(ScanBatch.status == BATCH_QUEUED,
+               and_(ScanBatch.status == BATCH_LEASED, ScanBatch.lease_until < now))
+
+
+async def create_scan_batches(session: AsyncSession, job_id: int, run_id: str,
+                              product_ids: Optional[List[int]], batch_size: int) -> int:
+    """
+    Асинхронно делит товары задачи на пакеты для внешних обработчиков. Товары, уже
+    обработанные в запуске (продолжение прерванной задачи), в пакеты не попадают.
+
+    :param session: Асинхронная сессия для взаимодействия с базой данных.
+    :param job_id: ID задачи.
+    :param run_id: Идентификатор запуска задачи.
+    :param product_ids: Товары задачи, None - все товары.
+    :param batch_size: Товаров в пакете.
+    :return: Количество товаров в пакетах.
+    """
+    query = select(ProductInfo.id).order_by(ProductInfo.id)
+    if product_ids is not None:
+        query = query.where(ProductInfo.id.in_(product_ids))
+    done = select(ScanCheckpoint.product_id).where(ScanCheckpoint.run_id == run_id)
+    ids = list((await session.execute(query.where(ProductInfo.id.not_in(done)))).scalars().all())
+    session.add_all([ScanBatch(job_id=job_id, run_id=run_id, product_ids=ids[start:start + batch_size],
+                               status=BATCH_QUEUED, attempts=0, reported=False)
+                     for start in range(0, len(ids), batch_size)])
+    await session.commit()
+    return len(ids)
+
+
+async def get_scan_batches(session: AsyncSession, job_id: int) -> List[ScanBatch]:
+    """
+    Асинхронно получает пакеты задачи.
+
+    :param session: Асинхронная сессия для взаимодействия с базой данных.
+    :param job_id: ID задачи.
+    """
+    result = await session.execute(select(ScanBatch).where(ScanBatch.job_id == job_id).order_by(ScanBatch.id))
+    return list(result.scalars().all())
+
+
+async def lease_scan_batch(session: AsyncSession, worker: str, lease_timeout: float,
+                           max_attempts: int) -> Optional[ScanBatch]:
+    """
+    Асинхронно выдает обработчику пакет: ожидающий или с истекшей арендой. Пакет, выданный
+    max_attempts раз и так и не обработанный (например, роняет обработчик), помечается
+    ошибочным. Выдача - условное обновление строки, поэтому один пакет не достается двум
+    обработчикам, даже если они запрашивают его одновременно.
+
+    :param session: Асинхронная сессия для взаимодействия с базой данных.
+    :param worker: Имя обработчика.
+    :param lease_timeout: Срок аренды, секунды.
+    :param max_attempts: Максимум выдач пакета.
+    :return: Пакет или None, если выдавать нечего.
+    """
+    now = _utc_now()
+    await session.execute(
+        update(ScanBatch)
+        .where(_available(now), ScanBatch.attempts >= max_attempts)
+        .values(status=BATCH_FAILED, worker=None, error="Обработчики не смогли обработать пакет",
+                finished_at=now)
+    )
+    await session.commit()
+    while True:
+        batch_id = (await session.execute(
+            select(ScanBatch.id).where(_available(now)).order_by(ScanBatch.id).limit(1)
+        )).scalar()
+        if batch_id is None:
+            return None
+        leased = await session.execute(
+            update(ScanBatch)
+            .where(ScanBatch.id == batch_id, _available(now))
+            .values(status=BATCH_LEASED, worker=worker, lease_until=now + timedelta(seconds=lease_timeout),
+                    attempts=ScanBatch.attempts + 1)
+        )
+        await session.commit()
+        if leased.rowcount:
+            return await session.get(ScanBatch, batch_id, populate_existing=True)
+        # Пакет успел взять другой обработчик - берем следующий
+
+
+async def extend_scan_batch(session: AsyncSession, batch_id: int, worker: str, lease_timeout: float) -> bool:
+    """
+    Асинхронно продлевает аренду пакета.
+
+    :param session: Асинхронная сессия для взаимодействия с базой данных.
+    :param batch_id: ID пакета.
+    :param worker: Имя обработчика.
+    :param lease_timeout: Новый срок аренды от текущего момента, секунды.
+    :return: False, если пакет больше не принадлежит обработчику (задача остановлена
+             или аренда истекла и пакет выдан другому).
+    """
+    result = await session.execute(
+        update(ScanBatch)
+        .where(ScanBatch.id == batch_id, ScanBatch.worker == worker, ScanBatch.status == BATCH_LEASED)
+        .values(lease_until=_utc_now() + timedelta(seconds=lease_timeout))
+    )
+    await session.commit()
+    return bool(result.rowcount)
+
+
+async def finish_scan_batch(session: AsyncSession, batch_id: int, worker: str, status: str,
+                            result: Optional[str] = None, error: Optional[str] = None) -> bool:
+    """
+    Асинхронно записывает итог обработки пакета.
+
+    :param session: Асинхронная сессия для взаимодействия с базой данных.
+    :param batch_id: ID пакета.
+    :param worker: Имя обработчика.
+    :param status: BATCH_DONE или BATCH_QUEUED (обработчик останавливается и возвращает пакет).
+    :param result: Результаты товаров для пользователя.
+    :param error: Текст ошибки.
+    :return: False, если пакет уже не принадлежит обработчику.
+    """
+    values = dict(status=status, worker=None, lease_until=None, result=result, error=error)
+    if status != BATCH_QUEUED:
+        values['finished_at'] = _utc_now()
+    updated = await session.execute(
+        update(ScanBatch)
+        .where(ScanBatch.id == batch_id, ScanBatch.worker == worker, ScanBatch.status == BATCH_LEASED)
+        .values(**values)
+    )
+    await session.commit()
+    return bool(updated.rowcount)
+
+
+async def mark_scan_batches_reported(session: AsyncSession, batch_ids: List[int]):
+    """
+    Асинхронно отмечает пакеты, результаты которых отправлены в чаты задачи.
+
+    :param session: Асинхронная сессия для взаимодействия с базой данных.
+    :param batch_ids: ID пакетов.
+    """
+    await session.execute(update(ScanBatch).where(ScanBatch.id.in_(batch_ids)).values(reported=True))
+    await session.commit()
+
+
+async def cancel_scan_batches(session: AsyncSession, job_id: int):
+    """
+    Асинхронно отменяет необработанные пакеты задачи. Обработчик пакета узнает об отмене
+    при продлении аренды и прекращает сканирование.
+
+    :param session: Асинхронная сессия для взаимодействия с базой данных.
+    :param job_id: ID задачи.
+    """
+    await session.execute(
+        update(ScanBatch)
+        .where(ScanBatch.job_id == job_id, ScanBatch.status.in_((BATCH_QUEUED, BATCH_LEASED)))
+        .values(status=BATCH_CANCELLED, worker=None, lease_until=None, finished_at=_utc_now())
+    )
+    await session.commit()
+
+
+async def count_checkpoint_statuses(session: AsyncSession, run_id: str) -> Counter:
+    """
+    Асинхронно считает товары запуска по результатам сканирования.
+
+    :param session: Асинхронная сессия для взаимодействия с базой данных.
+    :param run_id: Идентификатор запуска.
+    :return: Counter {результат: количество товаров}.
+    """
+    result = await session.execute(
+        select(ScanCheckpoint.status, func.count())
+        .where(ScanCheckpoint.run_id == run_id)
+        .group_by(ScanCheckpoint.status)
+    )
+    return Counter(dict(result.all()))
@@ -0,0 +1,186 @@
+from datetime import datetime, timedelta, timezone
+from typing import List, Optional, Tuple
+
+from sqlalchemy import update, delete, func, and_, or_
+from sqlalchemy.future import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.models.models import ScanJob, ScanCheckpoint
+
+# Состояния задачи сканирования
+JOB_QUEUED = 'queued'  # Ждет обработчика
+JOB_RUNNING = 'running'  # Выполняется
+JOB_DONE = 'done'  # Завершена
+JOB_FAILED = 'failed'  # Завершена с ошибкой или прервана остановкой приложения и не продолжена
+JOB_CANCELLED = 'cancelled'  # Остановлена пользователем
+
+ACTIVE_STATUSES = (JOB_QUEUED, JOB_RUNNING)
+
+
+async def get_active_scan_job(session: AsyncSession) -> Optional[ScanJob]:
+    """
+    Асинхронно получает задачу, которая ждет обработки или выполняется (выполняющаяся в приоритете).
+
+    :param session: Асинхронная сессия для взаимодействия с базой данных.
+    :return: Объект ScanJob или None.
+    """
+    result = await session.execute(
+        select(ScanJob)
+        .where(ScanJob.status.in_(ACTIVE_STATUSES))
+        .order_by((ScanJob.status == JOB_RUNNING).desc(), ScanJob.id)
+        .limit(1)
+    )
+    return result.scalars().first()
+
+
+async def enqueue_scan_job(session: AsyncSession, chat_id: Optional[int],
+                           product_ids: Optional[List[int]] = None) -> Tuple[ScanJob, bool]:
+    """
+    Асинхронно ставит сканирование в очередь. Если ожидающая или выполняющаяся задача уже
+    сканирует все товары, новая не создается: чат добавляется к получателям результатов
+    существующей задачи. Запрос на часть товаров объединяется с ожидающей задачей.
+
+    :param session: Асинхронная сессия для взаимодействия с базой данных.
+    :param chat_id: Чат, которому отправлять результаты, None - без уведомлений.
+    :param product_ids: Товары для сканирования, None - все товары.
+    :return: Задача и признак того, что она создана этим вызовом.
+    """
+    result = await session.execute(select(ScanJob).where(ScanJob.status.in_(ACTIVE_STATUSES)).order_by(ScanJob.id))
+    active = result.scalars().all()
+    # Задача на все товары покрывает любой запрос
+    job = next((job for job in active if job.product_ids is None), None)
+    queued = next((job for job in active if job.status == JOB_QUEUED), None)
+    created = False
+    if job is None and queued is not None:
+        # Ожидающая задача на часть товаров расширяется запросом
+        job = queued
+        job.product_ids = None if product_ids is None else sorted(set(job.product_ids) | set(product_ids))
+    if job is None:
+        job = ScanJob(status=JOB_QUEUED, chat_ids=[], product_ids=product_ids, created_at=datetime.now(timezone.utc))
+        session.add(job)
+        created = True
+    if chat_id is not None and chat_id not in job.chat_ids:
+        job.chat_ids = job.chat_ids + [chat_id]  # Новый список, чтобы изменение JSON попало в UPDATE
+    await session.commit()
+    return job, created
+
+
+async def get_last_scan_job(session: AsyncSession) -> Optional[ScanJob]:
+    """
+    Асинхронно получает последнюю созданную задачу.
+
+    :param session: Асинхронная сессия для взаимодействия с базой данных.
+    """
+    result = await session.execute(select(ScanJob).order_by(ScanJob.id.desc()).limit(1))
+    return result.scalars().first()
+
+
+async def claim_scan_job(session: AsyncSession, owner: str) -> Optional[ScanJob]:
+    """
+    Асинхронно берет на выполнение самую старую задачу из очереди. Выдача - условное обновление
+    строки, поэтому одну задачу не возьмут два экземпляра приложения с общей БД.
+
+    :param session: Асинхронная сессия для взаимодействия с базой данных.
+    :param owner: Имя экземпляра приложения.
+    :return: Задача в состоянии JOB_RUNNING или None, если очередь пуста.
+    """
+    while True:
+        job_id = (await session.execute(
+            select(ScanJob.id).where(ScanJob.status == JOB_QUEUED).order_by(ScanJob.id).limit(1)
+        )).scalar()
+        if job_id is None:
+            return None
+        claimed = await session.execute(
+            update(ScanJob)
+            .where(ScanJob.id == job_id, ScanJob.status == JOB_QUEUED)
+            .values(status=JOB_RUNNING, owner=owner, heartbeat_at=datetime.now(timezone.utc))
+        )
+        await session.commit()
+        if claimed.rowcount:
+            return await session.get(ScanJob, job_id, populate_existing=True)
+        # Задачу успел взять другой экземпляр - берем следующую
+
+
+async def heartbeat_scan_job(session: AsyncSession, job_id: int, owner: str) -> bool:
+    """
+    Асинхронно отмечает, что экземпляр продолжает выполнять задачу.
+
+    :param session: Асинхронная сессия для взаимодействия с базой данных.
+    :param job_id: ID задачи.
+    :param owner: Имя экземпляра приложения.
+    :return: False, если задача больше не выполняется этим экземпляром (остановлена
+             или возвращена в очередь как прерванная).
+    """
+    result = await session.execute(
+        update(ScanJob)
+        .where(ScanJob.id == job_id, ScanJob.owner == owner, ScanJob.status == JOB_RUNNING)
+        .values(heartbeat_at=datetime.now(timezone.utc))
+    )
+    await session.commit()
+    return bool(result.rowcount)
+
+
+async def update_scan_job(session: AsyncSession, job_id: int, **values):
+    """
+    Асинхронно обновляет поля задачи.
+
+    :param session: Асинхронная сессия для взаимодействия с базой данных.
+    :param job_id: ID задачи.
+    :param values: Новые значения полей ScanJob.
+    """
+    await session.execute(update(ScanJob).where(ScanJob.id == job_id).values(**values))
+    await session.commit()
+
+
+async def requeue_interrupted_scan_jobs(session: AsyncSession, max_age: timedelta,
+                                        timeout: timedelta) -> Tuple[int, int]:
+    """
+    Асинхронно обрабатывает задачи, выполнявшиеся экземпляром, который аварийно остановился:
+    у таких задач нет отметок выполнения дольше `timeout`. Задачи, которые выполняют работающие
+    экземпляры (в том числе другие экземпляры с общей БД), не затрагиваются. Недавно запущенные
+    прерванные задачи возвращаются в очередь и будут продолжены с необработанных товаров,
+    запущенные раньше `max_age` назад помечаются прерванными.
+
+    :param session: Асинхронная сессия для взаимодействия с базой данных.
+    :param max_age: Максимальный возраст продолжаемой задачи.
+    :param timeout: Сколько задача может быть без отметки выполнения.
+    :return: Количество возвращенных в очередь и прерванных задач.
+    """
+    now = datetime.now(timezone.utc)
+    naive_now = now.replace(tzinfo=None)
+    interrupted = and_(ScanJob.status == JOB_RUNNING,
+                       or_(ScanJob.heartbeat_at.is_(None), ScanJob.heartbeat_at < naive_now - timeout))
+    failed = await session.execute(
+        update(ScanJob)
+        .where(interrupted, ScanJob.started_at < naive_now - max_age)
+        .values(status=JOB_FAILED, error="Прервано остановкой приложения", finished_at=now)
+    )
+    requeued = await session.execute(
+        update(ScanJob).where(interrupted).values(status=JOB_QUEUED, owner=None, heartbeat_at=None)
+    )
+    await session.commit()
+    return requeued.rowcount, failed.rowcount
+
+
+async def count_scan_checkpoints(session: AsyncSession, run_id: str) -> int:
+    """
+    Асинхронно считает товары, уже обработанные в запуске сканирования.
+
+    :param session: Асинхронная сессия для взаимодействия с базой данных.
+    :param run_id: Идентификатор запуска.
+    """
+    result = await session.execute(
+        select(func.count()).select_from(ScanCheckpoint).where(ScanCheckpoint.run_id == run_id)
+    )
+    return result.scalar()
+
+
+async def delete_scan_checkpoints(session: AsyncSession, run_id: str):
+    """
+    Асинхронно удаляет отметки завершенного запуска, продолжать его больше не понадобится.
+
+    :param session: Асинхронная сессия для взаимодействия с базой данных.
+    :param run_id: Идентификатор запуска.
+    """
+    await session.execute(delete(ScanCheckpoint).where(ScanCheckpoint.run_id == run_id))
+    await session.commit()
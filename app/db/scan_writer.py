@@ -0,0 +1,95 @@
+import time
+import asyncio
+import logging
+from datetime import datetime
+from typing import Callable, Dict, List, Optional
+
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.core.config import Config
+from app.core.database import async_session
+from app.db.crud import add_price_scans, add_scan_run
+from app.services.metrics import observe_stage, STAGE_DB_WRITE
+from app.services.outcomes import OK
+
+logger = logging.getLogger(__name__)
+
+
+class PriceScanWriter:
+    """
+    Буферизованная запись результатов сканирования в PriceScan.
+
+    Результаты копятся в памяти и записываются одной пакетной вставкой, когда буфер
+    заполнен или прошло `flush_interval` секунд. При выходе из контекста (в том числе
+    по ошибке или отмене) остаток буфера записывается. Все записи запуска получают
+    один run_id и одно время сканирования. Вместе с ценами записываются отметки
+    об обработке товаров (ScanCheckpoint), по которым прерванный запуск можно продолжить.
+    """
+
+    def __init__(self, run_id: str, scan_time: datetime,
+                 batch_size: int = Config.SCAN_WRITE_BATCH, flush_interval: float = Config.SCAN_WRITE_INTERVAL,
+                 session_factory: Callable[[], AsyncSession] = async_session):
+        self.run_id = run_id
+        self.scan_time = scan_time
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._session_factory = session_factory
+        self._buffer: List[Dict] = []
+        self._checkpoints: List[Dict] = []
+        self._lock = asyncio.Lock()
+        self._timer: Optional[asyncio.Task] = None
+        self.written = 0  # Всего записано строк
+
+    async def __aenter__(self) -> "PriceScanWriter":
+        async with self._session_factory() as session:
+            await add_scan_run(session, self.run_id, self.scan_time)
+        self._timer = asyncio.create_task(self._flush_periodically())
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        self._timer.cancel()
+        # Остаток записываем даже при отмене сканирования
+        await asyncio.shield(self.flush())
+
+    async def _flush_periodically(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.error(f"Price scan flush failed: {e}")
+
+    async def add(self, product_id: int, price: Optional[int], status: str = OK):
+        """
+        Добавляет результат в буфер, при заполнении буфера записывает его в БД.
+
+        :param product_id: ID товара.
+        :param price: Цена в копейках, None - цена не получена (записывается только отметка об обработке).
+        :param status: Результат сканирования товара.
+        """
+        if price is not None:
+            self._buffer.append(dict(product_id=product_id, price=price, scan_time=self.scan_time,
+                                     run_id=self.run_id))
+        self._checkpoints.append(dict(run_id=self.run_id, product_id=product_id, status=status))
+        if len(self._checkpoints) >= self.batch_size:
+            await self.flush()
+
+    async def flush(self):
+        """Записывает накопленные результаты одной транзакцией"""
+        async with self._lock:
+            if not self._checkpoints:
+                return
+            rows, self._buffer = self._buffer, []
+            checkpoints, self._checkpoints = self._checkpoints, []
+            started = time.monotonic()
+            try:
+                async with self._session_factory() as session:
+                    await add_price_scans(session, rows, checkpoints)
+            except Exception:
+                observe_stage(STAGE_DB_WRITE, started, outcome='error')
+                # Вернем строки в буфер, чтобы записать при следующей попытке
+                self._buffer[:0] = rows
+                self._checkpoints[:0] = checkpoints
+                raise
+            observe_stage(STAGE_DB_WRITE, started)
+            self.written += len(rows)
@@ -0,0 +1,144 @@
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional
+
+from sqlalchemy import update, bindparam, func
+from sqlalchemy.future import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.core.config import Config
+from app.models.models import ProductInfo
+
+GOLDEN_RATIO = 0.6180339887498949  # Сдвиги id * φ (mod 1) равномерно распределены по интервалу
+ADAPT_SLOWER = 1.5  # Во сколько раз увеличивается интервал, если цена не изменилась
+ADAPT_FASTER = 0.5  # Во сколько раз уменьшается интервал, если цена изменилась
+EPOCH = datetime(1970, 1, 1)
+RESCHEDULE_CHUNK = 500  # Товаров в одном запросе при обновлении расписания
+
+
+def effective_interval(fixed_interval: Optional[int], scan_interval: Optional[int]) -> int:
+    """Интервал сканирования товара, минуты: заданный пользователем, иначе адаптивный, иначе по умолчанию"""
+    return fixed_interval or scan_interval or Config.SCHEDULE_INTERVAL
+
+
+def adapt_interval(interval: int, changed: bool) -> int:
+    """
+    Новый адаптивный интервал: товары с меняющейся ценой сканируются чаще, со стабильной - реже.
+
+    :param interval: Текущий интервал, минуты.
+    :param changed: Изменилась ли цена с прошлого сканирования.
+    :return: Интервал в пределах SCHEDULE_MIN_INTERVAL..SCHEDULE_MAX_INTERVAL, минуты.
+    """
+    interval = round(interval * (ADAPT_FASTER if changed else ADAPT_SLOWER))
+    return min(Config.SCHEDULE_MAX_INTERVAL, max(Config.SCHEDULE_MIN_INTERVAL, interval))
+
+
+def next_slot(product_id: int, interval: int, now: datetime, min_wait: float = 0.5) -> datetime:
+    """
+    Время следующего сканирования товара. У каждого товара постоянный сдвиг внутри интервала,
+    зависящий от id, поэтому товары с одинаковым интервалом распределены по нему равномерно
+    и не собираются в одно время, даже если сканировались вместе.
+
+    :param product_id: ID товара.
+    :param interval: Интервал сканирования, минуты.
+    :param now: Текущее время (UTC, без часового пояса).
+    :param min_wait: Минимальное ожидание в долях интервала: товар, только что сканированный
+                     вне своего слота, ждет следующий слот.
+    :return: Ближайший слот товара не раньше, чем через min_wait интервала.
+    """
+    period = interval * 60
+    phase = (product_id * GOLDEN_RATIO) % 1 * period
+    wait = (phase - (now - EPOCH).total_seconds()) % period
+    if wait < period * min_wait:
+        wait += period
+    return now + timedelta(seconds=wait)
+
+
+async def schedule_new_products(session: AsyncSession, now: datetime) -> int:
+    """
+    Асинхронно назначает время первого сканирования товарам, у которых его еще нет.
+    Первые сканирования распределяются по интервалу, а не выполняются все сразу.
+
+    :param session: Асинхронная сессия для взаимодействия с базой данных.
+    :param now: Текущее время (UTC, без часового пояса).
+    :return: Количество товаров, добавленных в расписание.
+    """
+    result = await session.execute(
+        select(ProductInfo.id, ProductInfo.fixed_interval, ProductInfo.scan_interval)
+        .where(ProductInfo.next_scan_at.is_(None))
+    )
+    rows = [dict(b_id=row.id, next_scan_at=next_slot(row.id, effective_interval(row.fixed_interval, row.scan_interval),
+                                                     now, min_wait=0))
+            for row in result.all()]
+    if rows:
+        await session.execute(
+            update(ProductInfo.__table__).where(ProductInfo.__table__.c.id == bindparam('b_id')),
+            rows
+        )
+        await session.commit()
+    return len(rows)
+
+
+async def get_due_product_ids(session: AsyncSession, now: datetime, limit: int) -> List[int]:
+    """
+    Асинхронно получает товары, время сканирования которых наступило, самые просроченные первыми.
+
+    :param session: Асинхронная сессия для взаимодействия с базой данных.
+    :param now: Текущее время (UTC, без часового пояса).
+    :param limit: Максимальное количество товаров.
+    :return: Список ID товаров.
+    """
+    result = await session.execute(
+        select(ProductInfo.id)
+        .where(ProductInfo.next_scan_at <= now)
+        .order_by(ProductInfo.next_scan_at)
+        .limit(limit)
+    )
+    return list(result.scalars().all())
+
+
+async def get_scheduled_load(session: AsyncSession) -> float:
+    """
+    Асинхронно оценивает нагрузку расписания: сколько товаров в час нужно сканировать
+    при текущих интервалах.
+
+    :param session: Асинхронная сессия для взаимодействия с базой данных.
+    :return: Товаров в час.
+    """
+    interval = func.coalesce(ProductInfo.fixed_interval, ProductInfo.scan_interval, Config.SCHEDULE_INTERVAL)
+    result = await session.execute(select(func.sum(60.0 / interval)))
+    return result.scalar() or 0.0
+
+
+async def reschedule_products(session: AsyncSession, results: Dict[int, Optional[int]], now: datetime):
+    """
+    Асинхронно обновляет расписание сканированных товаров: адаптивный интервал по тому,
+    изменилась ли цена, и время следующего сканирования. Интервал товара, цену которого
+    получить не удалось, не меняется.
+
+    :param session: Асинхронная сессия для взаимодействия с базой данных.
+    :param results: Словарь {ID товара: цена в копейках или None, если цена не получена}.
+    :param now: Время сканирования (UTC, без часового пояса).
+    """
+    table = ProductInfo.__table__
+    ids = list(results)
+    for start in range(0, len(ids), RESCHEDULE_CHUNK):
+        chunk = ids[start:start + RESCHEDULE_CHUNK]
+        result = await session.execute(
+            select(table.c.id, table.c.fixed_interval, table.c.scan_interval, table.c.last_price)
+            .where(table.c.id.in_(chunk))
+        )
+        rows = []
+        for row in result.all():
+            price = results[row.id]
+            scan_interval = row.scan_interval or Config.SCHEDULE_INTERVAL
+            last_price = row.last_price
+            if price is not None:
+                # Первая полученная цена не считается изменением
+                scan_interval = adapt_interval(scan_interval, last_price is not None and price != last_price)
+                last_price = price
+            rows.append(dict(b_id=row.id, scan_interval=scan_interval, last_price=last_price,
+                             next_scan_at=next_slot(row.id, effective_interval(row.fixed_interval,
+                                                                               scan_interval), now)))
+        if rows:
+            await session.execute(update(table).where(table.c.id == bindparam('b_id')), rows)
+    await session.commit()
@@ -0,0 +1,95 @@
+from datetime import datetime
+from typing import AsyncIterator, Iterable, List, Optional, Set
+
+from sqlalchemy import delete, exists, and_
+from sqlalchemy.future import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.core.database import dialect_insert
+from app.models.models import PageSnapshot, PriceScan, ProductInfo
+
+SNAPSHOT_BATCH = 1000  # Снимков в одном проходе повторного извлечения
+
+
+async def add_page_snapshots(session: AsyncSession, rows: List[dict]):
+    """
+    Асинхронно записывает снимки страниц запуска. Повторный снимок той же страницы в запуске
+    (например, DOM браузера после промаха HTTP-уровня) заменяет прежний.
+
+    :param session: Асинхронная сессия для взаимодействия с базой данных.
+    :param rows: Список словарей с ключами run_id, url, content_hash, scan_time и tier.
+    """
+    if not rows:
+        return
+    stmt = dialect_insert(session)(PageSnapshot)
+    stmt = stmt.on_conflict_do_update(index_elements=['run_id', 'url'],
+                                      set_=dict(content_hash=stmt.excluded.content_hash, tier=stmt.excluded.tier))
+    await session.execute(stmt, rows)
+    await session.commit()
+
+
+async def expire_page_snapshots(session: AsyncSession, before: datetime) -> Set[str]:
+    """
+    Асинхронно удаляет снимки, сделанные раньше указанного времени.
+
+    :param session: Асинхронная сессия для взаимодействия с базой данных.
+    :param before: Граница срока хранения (UTC).
+    :return: Хэши содержимого, на которые больше не ссылается ни один снимок - их файлы можно удалить.
+    """
+    expired = set((await session.execute(
+        select(PageSnapshot.content_hash).where(PageSnapshot.scan_time < before).distinct())).scalars())
+    if not expired:
+        return set()
+    await session.execute(delete(PageSnapshot).where(PageSnapshot.scan_time < before))
+    still_used = await get_referenced_hashes(session, expired)
+    await session.commit()
+    return expired - still_used
+
+
+async def get_referenced_hashes(session: AsyncSession, hashes: Optional[Iterable[str]] = None) -> Set[str]:
+    """
+    Асинхронно выбирает хэши содержимого, на которые ссылаются снимки.
+
+    :param session: Асинхронная сессия для взаимодействия с базой данных.
+    :param hashes: Проверяемые хэши, None - все хэши.
+    :return: Множество хэшей.
+    """
+    stmt = select(PageSnapshot.content_hash).distinct()
+    if hashes is None:
+        return set((await session.execute(stmt)).scalars())
+    hashes = list(hashes)
+    referenced = set()
+    for start in range(0, len(hashes), SNAPSHOT_BATCH):
+        chunk = hashes[start:start + SNAPSHOT_BATCH]
+        referenced.update((await session.execute(stmt.where(PageSnapshot.content_hash.in_(chunk)))).scalars())
+    return referenced
+
+
+async def iter_product_snapshots(session: AsyncSession, product_ids: Optional[List[int]] = None,
+                                 since: Optional[datetime] = None, missing_only: bool = False,
+                                 batch_size: int = SNAPSHOT_BATCH) -> AsyncIterator[list]:
+    """
+    Асинхронно перебирает пары (снимок, товар с URL снимка) пачками.
+
+    :param session: Асинхронная сессия для взаимодействия с базой данных.
+    :param product_ids: Только эти товары, None - все товары.
+    :param since: Только снимки не раньше этого времени (UTC).
+    :param missing_only: Только пары, для которых в запуске снимка нет цены товара.
+    :param batch_size: Размер пачки.
+    :return: Асинхронный генератор списков строк (run_id, scan_time, content_hash, product_id, url, xpath).
+    """
+    stmt = (select(PageSnapshot.run_id, PageSnapshot.scan_time, PageSnapshot.content_hash,
+                   ProductInfo.id.label('product_id'), ProductInfo.url, ProductInfo.xpath)
+            .join(ProductInfo, ProductInfo.url == PageSnapshot.url))
+    if product_ids is not None:
+        stmt = stmt.where(ProductInfo.id.in_(product_ids))
+    if since is not None:
+        stmt = stmt.where(PageSnapshot.scan_time >= since)
+    if missing_only:
+        stmt = stmt.where(~exists().where(and_(PriceScan.product_id == ProductInfo.id,
+                                                 PriceScan.run_id == PageSnapshot.run_id)))
+    # Снимки с одним содержимым идут подряд - файл распаковывается и разбирается один раз
+    stmt = stmt.order_by(PageSnapshot.content_hash, ProductInfo.id)
+    result = await session.stream(stmt)
+    async for batch in result.partitions(batch_size):
+        yield batch
@@ -6,6 +6,13 @@ from app.core.config import Config
 from app.core.config_bot import bot, dp
 from app.core.database import create_tables
 from app.api.endpoints import webhook_router
+from app.services.browser_pool import browser_pool
+from app.services.http_fetcher import http_fetcher
+from app.services.domain_stats import domain_stats
+from app.services.scan_queue import scan_queue
+from app.services.telegram_sender import telegram_sender
+from app.services.update_dispatcher import update_dispatcher
+from app.services.scheduler import scan_scheduler
 
 
 @asynccontextmanager
@@ -21,10 +28,28 @@ async def lifespan(app: FastAPI):
     logging.info(f"Webhook set to URL: {Config.WEBHOOK_URL}")
     # Создание таблиц в БД
     await create_tables()
+    # Запуск пула браузеров для парсинга (с внешними обработчиками сканируют они)
+    if not Config.SCAN_EXTERNAL_WORKERS:
+        await browser_pool.start()
+        await http_fetcher.start()
+    # Очередь исходящих сообщений, обработчики входящих обновлений и очереди сканирований
+    telegram_sender.start(bot)
+    update_dispatcher.start(dp, bot)
+    await scan_queue.start()
+    # Запуск сканирования по расписанию
+    if Config.SCHEDULE_ENABLED:
+        await scan_scheduler.start()
 
     yield
 
     # shutdown
+    await update_dispatcher.stop()  # Обработка принятых обновлений
+    await scan_scheduler.stop()  # Остановка расписания
+    await scan_queue.stop()  # Остановка сканирования до закрытия браузеров
+    await telegram_sender.stop()  # Отправка оставшихся сообщений
+    await http_fetcher.stop()  # Закрытие HTTP-клиента
+    await browser_pool.stop()  # Закрытие браузеров
+    domain_stats.save()  # Сохранение статистики задержек по доменам
     await bot.delete_webhook()  # Удаление вебхука
     await dp.storage.close()  # Закрытие хранилища
 
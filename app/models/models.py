@@ -1,8 +1,8 @@
-from datetime import datetime
-from sqlalchemy import Integer, String, ForeignKey, DateTime
+from datetime import date, datetime
+from sqlalchemy import Integer, String, Text, JSON, Boolean, ForeignKey, Date, Index, UniqueConstraint
 from sqlalchemy.orm import mapped_column, Mapped, relationship
 
-from app.core.database import Base
+from app.core.database import Base, UTCDateTime
 
 
 class ProductInfo(Base):
@@ -10,12 +10,24 @@ class ProductInfo(Base):
     Данные для парсинга товара
     """
     __tablename__ = "product_info"
+    __table_args__ = (
+        # Один товар - одна пара (url, xpath) в нормализованном виде, повторная загрузка файла не создает копий
+        Index("ux_product_info_url_xpath", "url", "xpath", unique=True),
+    )
 
     id: Mapped[int] = mapped_column(Integer, primary_key=True, index=True, autoincrement=True,
         doc="Уникальный идентификатор записи")
     title: Mapped[str] = mapped_column(String(length=255), nullable=False, doc="Название продукта")
     url: Mapped[str] = mapped_column(String(length=500), nullable=False, doc="URL продукта на сайте")
     xpath: Mapped[str] = mapped_column(String(length=500), nullable=False, doc="XPath для парсинга цены на странице")
+    fixed_interval: Mapped[int | None] = mapped_column(Integer, nullable=True,
+        doc="Заданный пользователем интервал сканирования по расписанию, минуты (None - адаптивный)")
+    scan_interval: Mapped[int | None] = mapped_column(Integer, nullable=True,
+        doc="Адаптивный интервал сканирования, минуты (None - интервал по умолчанию)")
+    next_scan_at: Mapped[datetime | None] = mapped_column(UTCDateTime, nullable=True, index=True,
+        doc="Время следующего сканирования по расписанию (UTC)")
+    last_price: Mapped[int | None] = mapped_column(Integer, nullable=True,
+        doc="Последняя полученная цена в копейках, для обнаружения изменений")
 
     # Связь один-ко-многим с таблицей цен
     price_scans: Mapped[list["PriceScan"]] = relationship("PriceScan",back_populates="product",
@@ -30,14 +42,20 @@ class PriceScan(Base):
     История цен на товары в модели с данными для парсинга
     """
     __tablename__ = "price_scans"
+    __table_args__ = (
+        # История цен товара выбирается по product_id с сортировкой по времени
+        Index("ix_price_scans_product_time", "product_id", "scan_time"),
+    )
 
     id: Mapped[int] = mapped_column(Integer, primary_key=True, index=True, autoincrement=True,
         doc="Уникальный идентификатор записи сканирования")
     product_id: Mapped[int] = mapped_column(Integer, ForeignKey("product_info.id", ondelete="CASCADE"),
         nullable=False, index=True, doc="ID связанного продукта из таблицы product_info")
     price: Mapped[int] = mapped_column(Integer, nullable=False, doc="Цена в копейках на момент сканирования")
-    scan_time: Mapped[datetime] = mapped_column(DateTime, nullable=False, default=datetime.utcnow,
+    scan_time: Mapped[datetime] = mapped_column(UTCDateTime, nullable=False, default=datetime.utcnow,
         doc="Дата и время сканирования в формате UTC")
+    run_id: Mapped[str | None] = mapped_column(String(length=32), nullable=True, index=True,
+        doc="Идентификатор запуска сканирования, общий для всех записей запуска")
 
     # Обратная связь с ProductInfo
     product: Mapped["ProductInfo"] = relationship("ProductInfo", back_populates="price_scans",
@@ -45,3 +63,203 @@ class PriceScan(Base):
 
     def __repr__(self) -> str:
         return f"<PriceScan(id={self.id}, product_id={self.product_id}, price={self.price}, time={self.scan_time})>"
+
+
+class ScanRun(Base):
+    """
+    Запуск сканирования цен
+    """
+    __tablename__ = "scan_runs"
+
+    run_id: Mapped[str] = mapped_column(String(length=32), primary_key=True,
+        doc="Идентификатор запуска сканирования")
+    scan_time: Mapped[datetime] = mapped_column(UTCDateTime, nullable=False, index=True,
+        doc="Время сканирования в формате UTC, общее для всех записей запуска")
+
+    def __repr__(self) -> str:
+        return f"<ScanRun(run_id={self.run_id}, time={self.scan_time})>"
+
+
+class PriceInterval(Base):
+    """
+    Сжатая история цен: одна запись на период, в течение которого цена товара не менялась
+    """
+    __tablename__ = "price_intervals"
+    __table_args__ = (
+        Index("ix_price_intervals_product_last_seen", "product_id", "last_seen"),
+    )
+
+    id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True,
+        doc="Уникальный идентификатор записи")
+    product_id: Mapped[int] = mapped_column(Integer, ForeignKey("product_info.id", ondelete="CASCADE"),
+        nullable=False, doc="ID связанного продукта из таблицы product_info")
+    price: Mapped[int] = mapped_column(Integer, nullable=False, doc="Цена в копейках")
+    first_seen: Mapped[datetime] = mapped_column(UTCDateTime, nullable=False,
+        doc="Время первого сканирования с этой ценой (UTC)")
+    last_seen: Mapped[datetime] = mapped_column(UTCDateTime, nullable=False,
+        doc="Время последнего сканирования с этой ценой (UTC)")
+    scan_count: Mapped[int] = mapped_column(Integer, nullable=False, default=1,
+        doc="Количество сканирований с этой ценой")
+
+    def __repr__(self) -> str:
+        return (f"<PriceInterval(product_id={self.product_id}, price={self.price}, "
+                f"{self.first_seen} - {self.last_seen}, scans={self.scan_count})>")
+
+
+class PriceRollup(Base):
+    """
+    Сводка цен товара за день или неделю, обновляется при каждой записи результатов сканирования
+    """
+    __tablename__ = "price_rollups"
+    __table_args__ = (
+        UniqueConstraint("product_id", "period", "period_start", name="ux_price_rollups_product_period"),
+    )
+
+    id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True,
+        doc="Уникальный идентификатор записи")
+    product_id: Mapped[int] = mapped_column(Integer, ForeignKey("product_info.id", ondelete="CASCADE"),
+        nullable=False, doc="ID связанного продукта из таблицы product_info")
+    period: Mapped[str] = mapped_column(String(length=8), nullable=False, doc="Период сводки: day или week")
+    period_start: Mapped[date] = mapped_column(Date, nullable=False,
+        doc="Первый день периода (для недели - понедельник) в часовом поясе сводок")
+    min_price: Mapped[int] = mapped_column(Integer, nullable=False, doc="Минимальная цена за период")
+    max_price: Mapped[int] = mapped_column(Integer, nullable=False, doc="Максимальная цена за период")
+    first_price: Mapped[int] = mapped_column(Integer, nullable=False, doc="Первая цена за период")
+    first_time: Mapped[datetime] = mapped_column(UTCDateTime, nullable=False, doc="Время первого сканирования (UTC)")
+    last_price: Mapped[int] = mapped_column(Integer, nullable=False, doc="Последняя цена за период")
+    last_time: Mapped[datetime] = mapped_column(UTCDateTime, nullable=False, doc="Время последнего сканирования (UTC)")
+    scan_count: Mapped[int] = mapped_column(Integer, nullable=False, doc="Количество сканирований за период")
+
+    def __repr__(self) -> str:
+        return (f"<PriceRollup(product_id={self.product_id}, {self.period} {self.period_start}, "
+                f"min={self.min_price}, max={self.max_price}, last={self.last_price}, scans={self.scan_count})>")
+
+
+class ScanJob(Base):
+    """
+    Задача сканирования цен. Выполняется фоновым обработчиком, запросы нескольких
+    пользователей во время ожидания или выполнения задачи присоединяются к ней
+    """
+    __tablename__ = "scan_jobs"
+
+    id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True,
+        doc="Уникальный идентификатор задачи")
+    status: Mapped[str] = mapped_column(String(length=16), nullable=False, index=True,
+        doc="Состояние: queued, running, done, failed, cancelled")
+    chat_ids: Mapped[list] = mapped_column(JSON, nullable=False, default=list,
+        doc="Чаты, которые ждут результатов задачи")
+    product_ids: Mapped[list | None] = mapped_column(JSON, nullable=True,
+        doc="Товары для сканирования (None - все товары)")
+    run_id: Mapped[str | None] = mapped_column(String(length=32), nullable=True,
+        doc="Идентификатор запуска сканирования (scan_runs), назначается при старте")
+    owner: Mapped[str | None] = mapped_column(String(length=64), nullable=True,
+        doc="Экземпляр приложения, выполняющий задачу")
+    heartbeat_at: Mapped[datetime | None] = mapped_column(UTCDateTime, nullable=True,
+        doc="Последняя отметка выполняющего экземпляра (UTC), без отметок задача считается прерванной")
+    total: Mapped[int] = mapped_column(Integer, nullable=False, default=0, doc="Товаров к сканированию")
+    processed: Mapped[int] = mapped_column(Integer, nullable=False, default=0, doc="Товаров обработано")
+    created_at: Mapped[datetime] = mapped_column(UTCDateTime, nullable=False, default=datetime.utcnow,
+        doc="Время постановки в очередь (UTC)")
+    started_at: Mapped[datetime | None] = mapped_column(UTCDateTime, nullable=True, doc="Время запуска (UTC)")
+    finished_at: Mapped[datetime | None] = mapped_column(UTCDateTime, nullable=True, doc="Время завершения (UTC)")
+    summary: Mapped[str | None] = mapped_column(Text, nullable=True, doc="Итоговый отчет сканирования")
+    error: Mapped[str | None] = mapped_column(Text, nullable=True, doc="Текст ошибки")
+
+    def __repr__(self) -> str:
+        return f"<ScanJob(id={self.id}, status={self.status}, processed={self.processed}/{self.total})>"
+
+
+class ScanCheckpoint(Base):
+    """
+    Отметка об обработке товара в запуске сканирования. Записывается вместе с ценой,
+    по отметкам прерванный запуск продолжается с необработанных товаров
+    """
+    __tablename__ = "scan_checkpoints"
+    __table_args__ = (
+        # В режиме хранения периодами история товара восстанавливается по его отметкам
+        Index("ix_scan_checkpoints_product", "product_id"),
+    )
+
+    run_id: Mapped[str] = mapped_column(String(length=32), primary_key=True,
+        doc="Идентификатор запуска сканирования")
+    product_id: Mapped[int] = mapped_column(Integer, ForeignKey("product_info.id", ondelete="CASCADE"),
+        primary_key=True, doc="ID обработанного товара")
+    status: Mapped[str] = mapped_column(String(length=16), nullable=False, doc="Результат сканирования товара")
+
+    def __repr__(self) -> str:
+        return f"<ScanCheckpoint(run_id={self.run_id}, product_id={self.product_id}, status={self.status})>"
+
+
+class ScanBatch(Base):
+    """
+    Пакет товаров задачи сканирования для внешних обработчиков (python -m app.worker).
+    Обработчик берет пакет в аренду и продлевает ее, пока сканирует. Пакет с истекшей арендой
+    (обработчик упал или потерял связь с БД) снова выдается
+    """
+    __tablename__ = "scan_batches"
+    __table_args__ = (
+        Index("ix_scan_batches_status_lease", "status", "lease_until"),
+    )
+
+    id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True,
+        doc="Уникальный идентификатор пакета")
+    job_id: Mapped[int] = mapped_column(Integer, ForeignKey("scan_jobs.id", ondelete="CASCADE"),
+        nullable=False, index=True, doc="ID задачи сканирования")
+    run_id: Mapped[str] = mapped_column(String(length=32), nullable=False, doc="Идентификатор запуска задачи")
+    product_ids: Mapped[list] = mapped_column(JSON, nullable=False, doc="Товары пакета")
+    status: Mapped[str] = mapped_column(String(length=16), nullable=False,
+        doc="Состояние: queued, leased, done, failed, cancelled")
+    worker: Mapped[str | None] = mapped_column(String(length=64), nullable=True,
+        doc="Обработчик, которому выдан пакет")
+    lease_until: Mapped[datetime | None] = mapped_column(UTCDateTime, nullable=True,
+        doc="Окончание аренды (UTC), после него пакет выдается другому обработчику")
+    attempts: Mapped[int] = mapped_column(Integer, nullable=False, default=0, doc="Сколько раз пакет выдавался")
+    result: Mapped[str | None] = mapped_column(Text, nullable=True, doc="Результаты товаров для пользователя")
+    error: Mapped[str | None] = mapped_column(Text, nullable=True, doc="Текст ошибки")
+    reported: Mapped[bool] = mapped_column(Boolean, nullable=False, default=False,
+        doc="Результаты отправлены в чаты задачи")
+    finished_at: Mapped[datetime | None] = mapped_column(UTCDateTime, nullable=True,
+        doc="Время завершения (UTC)")
+
+    def __repr__(self) -> str:
+        return (f"<ScanBatch(id={self.id}, job_id={self.job_id}, status={self.status}, "
+                f"products={len(self.product_ids)}, worker={self.worker})>")
+
+
+class PageSnapshot(Base):
+    """
+    Снимок страницы, загруженной при сканировании. Сжатый HTML хранится в файле архива снимков
+    по хэшу содержимого (app/services/snapshots.py), одинаковые страницы хранятся один раз
+    """
+    __tablename__ = "page_snapshots"
+    __table_args__ = (
+        # Снимки старше срока хранения удаляются по времени сканирования
+        Index("ix_page_snapshots_time", "scan_time"),
+    )
+
+    run_id: Mapped[str] = mapped_column(String(length=32), primary_key=True,
+        doc="Идентификатор запуска сканирования")
+    url: Mapped[str] = mapped_column(String(length=500), primary_key=True, doc="URL страницы")
+    content_hash: Mapped[str] = mapped_column(String(length=32), nullable=False, index=True,
+        doc="Хэш HTML страницы, имя файла в архиве снимков")
+    scan_time: Mapped[datetime] = mapped_column(UTCDateTime, nullable=False,
+        doc="Время сканирования запуска (UTC)")
+    tier: Mapped[str] = mapped_column(String(length=16), nullable=False,
+        doc="Уровень извлечения: http - исходный HTML, browser - DOM после выполнения скриптов")
+
+    def __repr__(self) -> str:
+        return f"<PageSnapshot(run_id={self.run_id}, url={self.url}, hash={self.content_hash})>"
+
+
+class SchemaMigration(Base):
+    """
+    Выполненная миграция схемы или данных БД (app/db/migrations.py)
+    """
+    __tablename__ = "schema_migrations"
+
+    name: Mapped[str] = mapped_column(String(length=100), primary_key=True, doc="Имя миграции")
+    applied_at: Mapped[datetime] = mapped_column(UTCDateTime, nullable=False, default=datetime.utcnow,
+        doc="Время выполнения (UTC)")
+
+    def __repr__(self) -> str:
+        return f"<SchemaMigration(name={self.name}, applied_at={self.applied_at})>"
@@ -0,0 +1,159 @@
+import time
+import asyncio
+import logging
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, List, Optional
+
+from playwright.async_api import async_playwright, Browser, Page, Playwright, Error as PlaywrightError
+
+from app.core.config import Config
+from app.services.metrics import observe_stage, STAGE_BROWSER_LAUNCH
+
+logger = logging.getLogger(__name__)
+
+# Параметры запуска браузера и контекста, общие для всех страниц пула
+LAUNCH_ARGS = ['--disable-blink-features=AutomationControlled']
+CONTEXT_OPTIONS = dict(
+    viewport={'width': 1280, 'height': 720},
+    user_agent='Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36',
+    locale='ru-RU',
+    timezone_id='Europe/Moscow'
+)
+INIT_SCRIPT = "Object.defineProperty(navigator, 'webdriver', {get: () => undefined})"
+EXTRA_HEADERS = {
+    'Accept-Language': 'ru-RU,ru;q=0.9,en-US;q=0.8,en;q=0.7',
+    'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,image/webp,*/*;q=0.8'
+}
+
+
+class _BrowserSlot:
+    """
+    Один браузер пула со счетчиками выданных и открытых страниц
+    """
+
+    def __init__(self, browser: Browser):
+        self.browser = browser
+        self.pages_served = 0  # Сколько страниц выдано с момента запуска
+        self.active = 0  # Сколько страниц открыто сейчас
+        self.retired = False  # Браузер выведен из ротации и будет закрыт после освобождения
+
+    @property
+    def alive(self) -> bool:
+        return not self.retired and self.browser.is_connected()
+
+
+class BrowserPool:
+    """
+    Пул долгоживущих браузеров Chromium.
+
+    Браузеры запускаются один раз (при старте приложения), задачи сканирования получают
+    изолированный контекст со страницей через `page()`. Браузер перезапускается после
+    `recycle_pages` выданных страниц или при падении.
+    """
+
+    def __init__(self, size: int = 1, recycle_pages: int = 200):
+        self.size = max(1, size)
+        self.recycle_pages = max(1, recycle_pages)
+        self._playwright: Optional[Playwright] = None
+        self._slots: List[_BrowserSlot] = []
+        self._next = 0  # Индекс для выдачи браузеров по кругу
+        self._lock = asyncio.Lock()
+
+    @property
+    def started(self) -> bool:
+        return self._playwright is not None
+
+    async def start(self):
+        """Запуск Playwright и браузеров пула"""
+        async with self._lock:
+            if self.started:
+                return
+            self._playwright = await async_playwright().start()
+            self._slots = [await self._launch() for _ in range(self.size)]
+            logger.info(f"Browser pool started: {self.size} browser(s), recycle after {self.recycle_pages} pages")
+
+    async def stop(self):
+        """Закрытие всех браузеров и остановка Playwright"""
+        async with self._lock:
+            if not self.started:
+                return
+            for slot in self._slots:
+                await self._close(slot)
+            self._slots = []
+            await self._playwright.stop()
+            self._playwright = None
+            logger.info("Browser pool stopped")
+
+    async def _launch(self) -> _BrowserSlot:
+        started = time.monotonic()
+        try:
+            browser = await self._playwright.chromium.launch(headless=True, args=LAUNCH_ARGS)
+        except Exception:
+            observe_stage(STAGE_BROWSER_LAUNCH, started, outcome='error')
+            raise
+        observe_stage(STAGE_BROWSER_LAUNCH, started)
+        return _BrowserSlot(browser)
+
+    @staticmethod
+    async def _close(slot: _BrowserSlot):
+        slot.retired = True
+        try:
+            await slot.browser.close()
+        except PlaywrightError:
+            pass  # Браузер уже упал или закрыт
+
+    async def _acquire(self) -> _BrowserSlot:
+        """Выбор браузера по кругу с заменой упавших и отработавших свой ресурс"""
+        if not self.started:
+            await self.start()
+        async with self._lock:
+            index = self._next % len(self._slots)
+            self._next += 1
+            slot = self._slots[index]
+            if not slot.alive or slot.pages_served >= self.recycle_pages:
+                # Старый браузер закрывается сразу, если на нем нет открытых страниц,
+                # иначе последней освобожденной страницей (см. _release)
+                slot.retired = True
+                if slot.active == 0:
+                    await self._close(slot)
+                slot = self._slots[index] = await self._launch()
+            slot.pages_served += 1
+            slot.active += 1
+            return slot
+
+    async def _release(self, slot: _BrowserSlot):
+        slot.active -= 1
+        if slot.retired and slot.active == 0:
+            await self._close(slot)
+
+    @asynccontextmanager
+    async def page(self) -> AsyncIterator[Page]:
+        """
+        Выдает страницу в отдельном контексте браузера. Контекст закрывается при выходе.
+
+        :return: Страница Playwright, готовая к навигации.
+        """
+        slot = await self._acquire()
+        context = None
+        try:
+            context = await slot.browser.new_context(**CONTEXT_OPTIONS)
+            await context.add_init_script(INIT_SCRIPT)
+            page = await context.new_page()
+            await page.set_extra_http_headers(EXTRA_HEADERS)
+            yield page
+        except PlaywrightError:
+            # Браузер мог упасть - при следующей выдаче он будет перезапущен
+            if not slot.browser.is_connected():
+                slot.retired = True
+            raise
+        finally:
+            if context is not None:
+                try:
+                    await context.close()
+                except PlaywrightError:
+                    pass
+            await self._release(slot)
+
+
+# Общий пул приложения, запускается и останавливается в lifespan
+browser_pool = BrowserPool(size=Config.BROWSER_POOL_SIZE, recycle_pages=Config.BROWSER_RECYCLE_PAGES)
@@ -0,0 +1,57 @@
+import time
+import logging
+from typing import Dict
+
+from app.core.config import Config
+
+logger = logging.getLogger(__name__)
+
+
+class CircuitBreaker:
+    """
+    Автомат отключения сайтов, которые постоянно отвечают ошибками.
+
+    После `threshold` неудачных страниц подряд домен пропускается `cooldown` секунд.
+    По истечении паузы домену дается одна попытка: пока она выполняется, остальные страницы
+    домена пропускаются. Успех сбрасывает счетчик, ошибка снова отключает домен на `cooldown`.
+    Попытка, результат которой так и не записан (сканирование остановлено), через `cooldown`
+    заменяется новой.
+    """
+
+    def __init__(self, threshold: int = 3, cooldown: float = 1800):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self._failures: Dict[str, int] = {}  # Неудачных страниц подряд
+        self._opened_until: Dict[str, float] = {}  # До какого времени домен пропускается (time.monotonic)
+        self._probing: Dict[str, float] = {}  # Домены с выполняющейся попыткой: время ее начала
+
+    def allow(self, domain: str) -> bool:
+        """Можно ли сейчас обращаться к домену. После паузы разрешается только одна попытка"""
+        opened_until = self._opened_until.get(domain)
+        if opened_until is None:
+            return True
+        now = time.monotonic()
+        if now < opened_until or now - self._probing.get(domain, -self.cooldown) < self.cooldown:
+            return False
+        self._probing[domain] = now
+        return True
+
+    def record_success(self, domain: str):
+        """Страница домена загружена (даже если элемент не найден - сайт работает)"""
+        self._failures.pop(domain, None)
+        self._opened_until.pop(domain, None)
+        self._probing.pop(domain, None)
+
+    def record_failure(self, domain: str):
+        """Страница домена не загружена из-за таймаута, ошибки соединения или блокировки"""
+        failures = self._failures.get(domain, 0) + 1
+        self._failures[domain] = failures
+        self._probing.pop(domain, None)
+        if failures >= self.threshold:
+            self._opened_until[domain] = time.monotonic() + self.cooldown
+            logger.warning(f"Circuit opened for {domain} after {failures} failures, "
+                           f"skipping for {self.cooldown:.0f} s")
+
+
+# Общий автомат приложения: состояние сохраняется между запусками сканирования
+circuit_breaker = CircuitBreaker(threshold=Config.BREAKER_THRESHOLD, cooldown=Config.BREAKER_COOLDOWN)
@@ -1,32 +1,80 @@
 import os
 import httpx
+import openpyxl
 import pandas as pd
+from itertools import islice
 from aiogram import Bot
-from typing import List, Tuple
+from typing import Dict, Iterator, List, Tuple
+from urllib.parse import urlsplit, urlunsplit
 from fastapi import HTTPException
+from sqlalchemy import select, update, bindparam
 from sqlalchemy.exc import SQLAlchemyError
 from sqlalchemy.ext.asyncio import AsyncSession
 
+from app.core.database import dialect_insert
 from app.models.models import ProductInfo
 
+REQUIRED_COLUMNS = ['title', 'url', 'xpath']  # Обязательные столбцы таблицы
+OPTIONAL_COLUMNS = ['interval']  # Необязательные столбцы: interval - интервал сканирования по расписанию, минуты
+IMPORT_CHUNK_SIZE = 5000  # Количество строк, читаемых и вставляемых за раз
+IMPORT_PREVIEW_LIMIT = 50  # Сколько импортированных товаров возвращать для показа пользователю
+
+# Режимы импорта
+IMPORT_UPSERT = 'upsert'  # Новые товары добавляются, у существующих обновляется название
+IMPORT_INSERT_NEW = 'insert_new'  # Новые товары добавляются, существующие не меняются
+
+DEFAULT_PORTS = {'http': 80, 'https': 443}
+
+
+def normalize_url(url: str) -> str:
+    """
+    Приводит URL к единому виду: без пробелов по краям, схема и домен в нижнем регистре,
+    без порта по умолчанию и без якоря (#...). Некорректный URL (например, с нечисловым портом)
+    остается как есть.
+    """
+    try:
+        parts = urlsplit(url.strip())
+        port = parts.port
+    except ValueError:
+        return url.strip()  # Не URL, оставляем как есть
+    scheme = parts.scheme.lower()
+    netloc = (parts.hostname or '').lower()
+    if ':' in netloc:
+        netloc = f"[{netloc}]"  # Адрес IPv6 записывается в квадратных скобках
+    if port and port != DEFAULT_PORTS.get(scheme):
+        netloc = f"{netloc}:{port}"
+    if parts.username:
+        netloc = f"{parts.username}{':' + parts.password if parts.password else ''}@{netloc}"
+    if not netloc:
+        return url.strip()  # Не URL, оставляем как есть
+    return urlunsplit((scheme, netloc, parts.path or '/', parts.query, ''))
+
+
+def normalize_xpath(xpath: str) -> str:
+    """Приводит XPath к единому виду: без пробелов по краям"""
+    return xpath.strip()
+
 
 class FileService:
     @staticmethod
     async def download_file(bot: Bot, file_path: str, destination_path: str) -> str | None:
         """
         Асинхронно скачивает файл по указанному пути и сохраняет его на диск.
+        Файл пишется на диск частями по мере получения, без загрузки целиком в память.
         Если файл с таким именем уже существует, добавляет числовой суффикс.
 
         :param bot: Экземпляр бота, используемый для получения токена.
         :param file_path: Путь к файлу на сервере Telegram.
         :param destination_path: Локальный путь, куда будет сохранен файл.
-        :return: Кортеж (путь, имя файла) если файл успешно скачан и сохранен, иначе None.
+        :return: Путь к сохраненному файлу, если файл успешно скачан, иначе None.
         """
         url = f'https://api.telegram.org/file/bot{bot.token}/{file_path}'
 
         async with httpx.AsyncClient() as client:
-            response = await client.get(url)
-            if response.status_code == 200:
+            async with client.stream('GET', url) as response:
+                if response.status_code != 200:
+                    return None
+
                 # Извлекаем имя файла из пути
                 file_name = os.path.basename(destination_path)
                 name, ext = os.path.splitext(file_name)
@@ -38,73 +86,190 @@ class FileService:
                     new_file_path = os.path.join(os.path.dirname(destination_path), f"{name}_{counter}{ext}")
                     counter += 1
 
-                # Сохраняем файл
-                with open(new_file_path, 'wb') as f:
-                    f.write(response.content)
+                # Сохраняем файл частями
+                try:
+                    with open(new_file_path, 'wb') as f:
+                        async for chunk in response.aiter_bytes():
+                            f.write(chunk)
+                except (httpx.HTTPError, OSError):
+                    if os.path.exists(new_file_path):
+                        os.remove(new_file_path)  # Не оставляем недокачанный файл
+                    return None
 
                 return new_file_path
-            else:
-                return None
 
     @staticmethod
-    async def import_product_data(file_path: str, db: AsyncSession) -> Tuple[List[ProductInfo], int]:
+    def read_table_chunks(file_path: str, chunk_size: int = IMPORT_CHUNK_SIZE) -> Iterator[pd.DataFrame]:
+        """
+        Читает таблицу частями по `chunk_size` строк. Перед чтением данных проверяет,
+        что в таблице есть обязательные столбцы.
+
+        :param file_path: Путь к файлу таблицы (CSV, XLSX, XLS).
+        :param chunk_size: Количество строк в одной части.
+        :return: Итератор DataFrame с обязательными и имеющимися в таблице необязательными столбцами.
+
+        :raises HTTPException: Если формат не поддерживается, файл пуст или нет обязательных столбцов.
+        """
+        file_ext = os.path.splitext(file_path)[1].lower()
+
+        if file_ext == '.csv':
+            columns = FileService._check_columns(list(pd.read_csv(file_path, nrows=0).columns))
+            yield from pd.read_csv(file_path, usecols=columns, dtype=str, chunksize=chunk_size)
+
+        elif file_ext == '.xlsx':
+            # openpyxl в режиме read_only читает лист построчно, не загружая его целиком
+            workbook = openpyxl.load_workbook(file_path, read_only=True, data_only=True)
+            try:
+                rows = workbook.worksheets[0].iter_rows(values_only=True)
+                header = next(rows, None)
+                if header is None:
+                    raise pd.errors.EmptyDataError()
+                columns = [str(column) if column is not None else '' for column in header]
+                used_columns = FileService._check_columns(columns)
+                while batch := list(islice(rows, chunk_size)):
+                    yield pd.DataFrame(batch, columns=columns)[used_columns]
+            finally:
+                workbook.close()
+
+        elif file_ext == '.xls':
+            # Старый формат Excel не читается потоково
+            df = pd.read_excel(file_path, dtype=str)
+            used_columns = FileService._check_columns(list(df.columns))
+            for start in range(0, len(df), chunk_size):
+                yield df[used_columns].iloc[start:start + chunk_size]
+
+        else:
+            raise HTTPException(
+                status_code=400,
+                detail=f"Неподдерживаемый формат файла: {file_ext}. Поддерживаются только CSV и Excel."
+            )
+
+    @staticmethod
+    def _check_columns(columns: List[str]) -> List[str]:
+        """Проверка наличия обязательных столбцов, возвращает столбцы для чтения"""
+        missing_columns = [col for col in REQUIRED_COLUMNS if col not in columns]
+        if missing_columns:
+            raise HTTPException(status_code=400,
+                detail=f"В таблице отсутствуют обязательные столбцы: {', '.join(missing_columns)}"
+            )
+        return REQUIRED_COLUMNS + [col for col in OPTIONAL_COLUMNS if col in columns]
+
+    @staticmethod
+    def prepare_rows(chunk: pd.DataFrame) -> List[dict]:
+        """
+        Очищает часть таблицы: убирает строки без обязательных значений и пробелы по краям,
+        нормализует url и xpath и убирает повторы пары (url, xpath). Столбец interval
+        превращается в fixed_interval: пустое или некорректное значение - адаптивный интервал.
+
+        :param chunk: Часть таблицы с обязательными столбцами.
+        :return: Список словарей для вставки в ProductInfo.
+        """
+        chunk = chunk.dropna(subset=REQUIRED_COLUMNS)
+        chunk = chunk.assign(**{column: chunk[column].astype(str).str.strip() for column in REQUIRED_COLUMNS})
+        chunk = chunk[(chunk[REQUIRED_COLUMNS] != '').all(axis=1)]
+        chunk = chunk.assign(url=chunk['url'].map(normalize_url), xpath=chunk['xpath'].map(normalize_xpath))
+        if 'interval' in chunk:
+            interval = pd.to_numeric(chunk['interval'], errors='coerce').round()
+            chunk = chunk.drop(columns='interval').assign(
+                fixed_interval=[int(value) if value > 0 else None for value in interval.fillna(0)])
+        chunk = chunk.drop_duplicates(subset=['url', 'xpath'], keep='last')
+        return chunk.to_dict('records')
+
+    @staticmethod
+    async def import_product_data(file_path: str, db: AsyncSession,
+                                  mode: str = IMPORT_UPSERT) -> Tuple[List[ProductInfo], Dict[str, int]]:
         """
         Асинхронно читает файл таблицы по указанному пути, извлекает из него данные
-        трех текстовых столбцов (title, url, xpath) и записывает их в таблицу ProductInfo.
+        трех текстовых столбцов (title, url, xpath) и необязательного интервала сканирования
+        (interval, минуты) и записывает их в таблицу ProductInfo.
+
+        Товар определяется нормализованной парой (url, xpath). Новые товары добавляются,
+        у уже существующих в режиме IMPORT_UPSERT обновляются название и интервал, копии не создаются.
+        Таблица читается частями, новые строки каждой части записываются одной пакетной вставкой,
+        которая сразу возвращает ID. Весь импорт выполняется в одной транзакции.
 
         :param file_path: Путь к файлу таблицы (поддерживаются форматы CSV, Excel)
         :param db: Асинхронная сессия SQLAlchemy для работы с БД
+        :param mode: Режим импорта: IMPORT_UPSERT или IMPORT_INSERT_NEW
 
-        :return Tuple[List[ProductInfo], int]: Кортеж, содержащий список созданных объектов ProductInfo и их количество
+        :return Tuple[List[ProductInfo], Dict[str, int]]: Кортеж, содержащий первые IMPORT_PREVIEW_LIMIT
+            добавленных или обновленных объектов ProductInfo и счетчики inserted, updated, skipped
 
         :raises HTTPException: В случае ошибки чтения файла или сохранения данных в БД
         """
         try:
-            # Определяем формат файла по расширению
-            file_ext = os.path.splitext(file_path)[1].lower()
-
-            # Читаем файл в зависимости от формата
-            if file_ext == '.csv':
-                df = pd.read_csv(file_path)
-            elif file_ext in ['.xlsx', '.xls']:
-                df = pd.read_excel(file_path)
-            else:
-                raise HTTPException(
-                    status_code=400,
-                    detail=f"Неподдерживаемый формат файла: {file_ext}. Поддерживаются только CSV и Excel."
-                )
+            preview = []
+            stats = dict(inserted=0, updated=0, skipped=0)
+            table = ProductInfo.__table__
+            for chunk in FileService.read_table_chunks(file_path):
+                rows = FileService.prepare_rows(chunk)
+                # Строки без данных и повторы внутри файла пропускаются (берется последнее название)
+                stats['skipped'] += len(chunk) - len(rows)
+                if not rows:
+                    continue
 
-            # Проверяем наличие необходимых столбцов
-            required_columns = ['title', 'url', 'xpath']
-            missing_columns = [col for col in required_columns if col not in df.columns]
-
-            if missing_columns:
-                raise HTTPException(status_code=400,
-                    detail=f"В таблице отсутствуют обязательные столбцы: {', '.join(missing_columns)}"
+                # Существующие товары части одним запросом
+                result = await db.execute(
+                    select(table.c.id, table.c.title, table.c.url, table.c.xpath, table.c.fixed_interval)
+                    .where(table.c.url.in_({row['url'] for row in rows}))
                 )
+                existing = {(row.url, row.xpath): row for row in result.all()}
+                # Интервал обновляется, только если столбец есть в таблице
+                has_interval = 'fixed_interval' in rows[0]
 
-            # Создаем список объектов ProductInfo
-            product_info_objects = []
+                new_rows, changed = [], []
+                for row in rows:
+                    found = existing.get((row['url'], row['xpath']))
+                    if found is None:
+                        new_rows.append(row)
+                    elif mode == IMPORT_UPSERT and (found.title != row['title'] or (
+                            has_interval and found.fixed_interval != row['fixed_interval'])):
+                        changed.append(dict(row, id=found.id))
+                    else:
+                        stats['skipped'] += 1
 
-            # Проходим по каждой строке DataFrame
-            for _, row in df.iterrows():
-                product_info = ProductInfo(
-                    title=row['title'],
-                    url=row['url'],
-                    xpath=row['xpath']
-                )
-                product_info_objects.append(product_info)
+                if new_rows:
+                    # Пакетная вставка на уровне Core: строки уходят многострочными INSERT ... RETURNING,
+                    # ID возвращаются вместе с данными. ON CONFLICT защищает от параллельного импорта
+                    insert_stmt = dialect_insert(db)(table)
+                    if mode == IMPORT_UPSERT:
+                        set_ = dict(title=insert_stmt.excluded.title)
+                        if has_interval:
+                            set_['fixed_interval'] = insert_stmt.excluded.fixed_interval
+                        insert_stmt = insert_stmt.on_conflict_do_update(index_elements=['url', 'xpath'], set_=set_)
+                    else:
+                        # Товар, добавленный параллельным импортом, не меняется и не возвращается
+                        insert_stmt = insert_stmt.on_conflict_do_nothing(index_elements=['url', 'xpath'])
+                    result = await db.execute(
+                        insert_stmt.returning(table.c.id, table.c.title, table.c.url, table.c.xpath),
+                        new_rows
+                    )
+                    inserted = result.all()
+                    stats['inserted'] += len(inserted)
+                    stats['skipped'] += len(new_rows) - len(inserted)
+                    # Объекты ORM создаются только для строк, которые будут показаны пользователю
+                    for row in inserted[:IMPORT_PREVIEW_LIMIT - len(preview)]:
+                        preview.append(ProductInfo(**row._asdict()))
 
-            # Добавляем объекты в БД
-            db.add_all(product_info_objects)
-            await db.commit()
-
-            # Обновляем объекты после коммита, чтобы получить их ID
-            for product_info in product_info_objects:
-                await db.refresh(product_info)
+                if changed:
+                    values = dict(title=bindparam('b_title'))
+                    if has_interval:
+                        values['fixed_interval'] = bindparam('b_fixed_interval')
+                    await db.execute(
+                        update(table).where(table.c.id == bindparam('b_id')).values(**values),
+                        [dict(b_id=row['id'], b_title=row['title'], b_fixed_interval=row.get('fixed_interval'))
+                         for row in changed]
+                    )
+                    stats['updated'] += len(changed)
+                    for row in changed[:IMPORT_PREVIEW_LIMIT - len(preview)]:
+                        preview.append(ProductInfo(**row))
 
-            return product_info_objects, len(product_info_objects)
+            await db.commit()
+            return preview, stats
 
+        except HTTPException:
+            await db.rollback()
+            raise
         except pd.errors.EmptyDataError:
             await db.rollback()
             raise HTTPException(
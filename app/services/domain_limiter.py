@@ -0,0 +1,85 @@
+import time
+import asyncio
+from collections import defaultdict, deque
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Callable, Dict, Iterable, List, TypeVar
+
+from app.core.config import Config
+from app.services.parser import get_domain
+
+T = TypeVar('T')
+
+
+def interleave_by_domain(items: Iterable[T], get_url: Callable[[T], str]) -> List[T]:
+    """
+    Переставляет элементы так, чтобы домены чередовались по кругу:
+    a1, b1, c1, a2, b2, a3 ... Порядок внутри домена сохраняется.
+
+    :param items: Элементы для сканирования (например, ProductInfo).
+    :param get_url: Функция получения URL элемента.
+    :return: Список элементов в порядке чередования доменов.
+    """
+    queues: Dict[str, deque] = defaultdict(deque)
+    for item in items:
+        queues[get_domain(get_url(item))].append(item)
+
+    result = []
+    rotation = deque(queues.values())
+    while rotation:
+        queue = rotation.popleft()
+        result.append(queue.popleft())
+        if queue:
+            rotation.append(queue)
+    return result
+
+
+class DomainLimiter:
+    """
+    Ограничитель нагрузки на сайты при сканировании.
+
+    Для каждого домена ограничивает число одновременных запросов и минимальный интервал
+    между началами запросов, дополнительно действует общий лимит. Задача сначала ждет
+    слот своего домена и только потом занимает общий слот, поэтому медленный домен
+    не держит общие слоты и остальные домены продолжают работать.
+    """
+
+    def __init__(self, max_concurrent: int = 10, per_domain: int = 2, min_interval: float = 1.0):
+        self.max_concurrent = max_concurrent
+        self.per_domain = per_domain
+        self.min_interval = min_interval
+        self._global = asyncio.Semaphore(max_concurrent)
+        self._domains: Dict[str, asyncio.Semaphore] = {}
+        self._next_start: Dict[str, float] = {}  # Ближайшее разрешенное время начала запроса к домену
+
+    def _domain_semaphore(self, domain: str) -> asyncio.Semaphore:
+        if domain not in self._domains:
+            self._domains[domain] = asyncio.Semaphore(self.per_domain)
+        return self._domains[domain]
+
+    @asynccontextmanager
+    async def slot(self, url: str) -> AsyncIterator[None]:
+        """
+        Занимает слот для запроса к URL с учетом лимитов домена и общего лимита.
+
+        :param url: URL, к которому будет выполнен запрос.
+        """
+        domain = get_domain(url)
+        async with self._domain_semaphore(domain):
+            # Резервируем время старта: между чтением и записью нет await, гонки нет
+            now = time.monotonic()
+            start = max(now, self._next_start.get(domain, now))
+            self._next_start[domain] = start + self.min_interval
+            if start > now:
+                await asyncio.sleep(start - now)
+
+            async with self._global:
+                yield
+
+
+def create_limiter() -> DomainLimiter:
+    """Ограничитель с настройками из конфигурации, создается на каждый запуск сканирования"""
+    return DomainLimiter(
+        max_concurrent=Config.SCAN_MAX_CONCURRENT,
+        per_domain=Config.SCAN_DOMAIN_CONCURRENCY,
+        min_interval=Config.SCAN_DOMAIN_INTERVAL,
+    )
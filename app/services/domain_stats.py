@@ -0,0 +1,137 @@
+import os
+import json
+import logging
+from collections import deque
+from typing import Deque, Dict, Optional
+
+from app.core.config import Config
+
+logger = logging.getLogger(__name__)
+
+# Виды измерений
+NAVIGATION = 'navigation'  # Загрузка страницы (page.goto до domcontentloaded)
+SELECTOR = 'selector'  # Время от загрузки страницы до появления элемента с ценой
+
+MAX_SAMPLES = 50  # Сколько последних измерений хранить для домена
+MIN_SAMPLES = 5  # Меньше измерений - используются таймауты по умолчанию
+TIMEOUT_FACTOR = 2.0  # Таймаут = p95 * множитель
+
+# Границы таймаутов, мс: (минимум, максимум = значение по умолчанию)
+TIMEOUT_LIMITS = {
+    NAVIGATION: (5000, 30000),
+    SELECTOR: (2000, 20000),
+}
+
+
+def percentile(samples, q: float) -> float:
+    """Перцентиль q (0..1) по ближайшему рангу"""
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+class DomainStats:
+    """
+    Статистика задержек по доменам и запомненный уровень извлечения цены.
+
+    По последним измерениям загрузки страницы и появления элемента вычисляются таймауты
+    для домена, чтобы быстрые сайты не держали слот сканирования до таймаута по умолчанию.
+    Статистика сохраняется в файл и загружается при старте.
+    """
+
+    def __init__(self, path: Optional[str] = None):
+        self.path = path
+        self._samples: Dict[str, Dict[str, Deque[float]]] = {}
+        self._tiers: Dict[str, str] = {}
+        self._tier_pages: Dict[str, int] = {}  # Страниц домена, просканированных запомненным уровнем
+
+    def record(self, domain: str, kind: str, elapsed_ms: float):
+        """
+        Добавляет измерение. Ожидание, прерванное таймаутом, записывается значением таймаута:
+        настоящая длительность не меньше, и частые таймауты поднимают p95, а с ним и таймаут домена.
+
+        :param domain: Домен.
+        :param kind: NAVIGATION или SELECTOR.
+        :param elapsed_ms: Длительность, мс.
+        """
+        samples = self._samples.setdefault(domain, {})
+        samples.setdefault(kind, deque(maxlen=MAX_SAMPLES)).append(elapsed_ms)
+
+    def percentile(self, domain: str, kind: str, q: float) -> Optional[float]:
+        """Перцентиль измерений домена или None, если измерений мало"""
+        samples = self._samples.get(domain, {}).get(kind)
+        if not samples or len(samples) < MIN_SAMPLES:
+            return None
+        return percentile(samples, q)
+
+    def timeout(self, domain: str, kind: str) -> float:
+        """
+        Таймаут для домена, мс: p95 измерений с запасом, в пределах TIMEOUT_LIMITS.
+        Пока измерений мало - максимальный таймаут.
+        """
+        low, high = TIMEOUT_LIMITS[kind]
+        p95 = self.percentile(domain, kind, 0.95)
+        if p95 is None:
+            return high
+        return min(high, max(low, p95 * TIMEOUT_FACTOR))
+
+    def get_tier(self, domain: str) -> Optional[str]:
+        """Уровень извлечения, сработавший для домена последним"""
+        return self._tiers.get(domain)
+
+    def set_tier(self, domain: str, tier: str):
+        if self._tiers.get(domain) != tier:
+            self._tier_pages.pop(domain, None)
+        self._tiers[domain] = tier
+
+    def reprobe_due(self, domain: str, every: int) -> bool:
+        """
+        Пора ли снова попробовать уровень, которым домен сейчас не сканируется: каждая every-я страница
+        домена. Так сайт, перешедший на отдачу цены в HTML, не остается навсегда за браузером.
+
+        :param domain: Домен.
+        :param every: Через сколько страниц пробовать, 0 - не пробовать.
+        """
+        if every <= 0:
+            return False
+        pages = self._tier_pages[domain] = self._tier_pages.get(domain, 0) + 1
+        return pages % every == 0
+
+    def load(self):
+        """Загрузка статистики из файла, отсутствующий или поврежденный файл пропускается"""
+        if not self.path or not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, encoding='utf-8') as f:
+                data = json.load(f)
+        except (OSError, ValueError) as e:
+            logger.warning(f"Failed to load domain stats from {self.path}: {e}")
+            return
+        for domain, item in data.get('domains', {}).items():
+            for kind in (NAVIGATION, SELECTOR):
+                if item.get(kind):
+                    self._samples.setdefault(domain, {})[kind] = deque(item[kind], maxlen=MAX_SAMPLES)
+            if item.get('tier'):
+                self._tiers[domain] = item['tier']
+
+    def save(self):
+        """Сохранение статистики в файл (через временный файл, чтобы не оставить обрезанный)"""
+        if not self.path:
+            return
+        domains = {}
+        for domain in set(self._samples) | set(self._tiers):
+            item = {kind: [round(value) for value in samples] for kind, samples in self._samples.get(domain, {}).items()}
+            if domain in self._tiers:
+                item['tier'] = self._tiers[domain]
+            domains[domain] = item
+        tmp_path = f"{self.path}.tmp"
+        try:
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump({'domains': domains}, f)
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            logger.warning(f"Failed to save domain stats to {self.path}: {e}")
+
+
+# Общая статистика приложения
+domain_stats = DomainStats(Config.DOMAIN_STATS_FILE)
+domain_stats.load()
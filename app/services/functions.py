@@ -1,76 +1,219 @@
-import re
+import time
+import uuid
+import logging
+import random
 import asyncio
-
-from app.services.parser import get_element_content
-from app.db.crud import get_all_products, add_price_scan
+from collections import Counter
+from datetime import datetime, timezone
+from typing import Callable, Dict, List, Optional, Sequence
+
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.core.config import Config
+from app.core.database import async_session
+from app.services.parser import get_prices_content, get_domain, TIER_HTTP, TIER_BROWSER
+from app.services.outcomes import (ScanOutcome, OK, PARSE_ERROR, SKIPPED, TRANSIENT, SITE_FAILURES,
+                                   DESCRIPTIONS)
+from app.services.circuit_breaker import circuit_breaker
+from app.services.page_cache import CacheReport
+from app.services.prices import parse_price, parse_prices
+from app.services.resource_blocking import BlockingReport
+from app.services.snapshots import SnapshotRecorder, snapshot_archive
+from app.services.domain_stats import domain_stats
+from app.services.domain_limiter import DomainLimiter, create_limiter, interleave_by_domain
+from app.services.metrics import observe_stage, scanned_products, scan_failures, scan_runs, STAGE_PARSE, STAGE_PAGE
+from app.db.crud import get_all_products
+from app.db.scan_writer import PriceScanWriter
+from app.db.schedule import reschedule_products
 from app.models.models import ProductInfo
 
+logger = logging.getLogger(__name__)
+
+
 def convert_price_to_kopecks(price_str: str) -> int:
     """
-    Преобразует строку с ценой в копейки.
+    Преобразует строку с ценой в копейки (см. prices.parse_price).
 
-    :param price_str: Строка с ценой, которая может содержать цифры, знак рубля и дробную запятую.
-    :return: Цена в копейках как целое число или 0, если строка не соответствует формату.
+    :param price_str: Строка с ценой, которая может содержать разделители разрядов, знак валюты и дробную часть.
+    :return: Цена в копейках как целое число или 0, если цену распознать не удалось.
     """
-    # Проверяем длину строки
-    if not price_str or len(price_str) > 20:
-        return 0
+    return parse_price(price_str) or 0
 
-    # Оставляем только цифры и дробную запятую
-    cleaned_price = re.sub(r'[^0-9,]', '', price_str)
 
-    # Заменяем запятую на точку для корректного преобразования в float
-    cleaned_price = cleaned_price.replace(',', '.')
-
-    try:
-        # Преобразуем в число с плавающей точкой
-        price_float = float(cleaned_price)
-
-        # Переводим в копейки
-        kopecks = int(price_float * 100)
-        return kopecks
-    except ValueError:
-        # Если преобразование не удалось, возвращаем None
-        return 0
+def group_by_url(products: Sequence[ProductInfo]) -> List[List[ProductInfo]]:
+    """
+    План сканирования: товары с одинаковым URL объединяются, чтобы страница загружалась один раз.
 
+    :param products: Товары для сканирования.
+    :return: Список групп товаров, в группе товары одной страницы. Порядок первого появления URL сохраняется.
+    """
+    groups: Dict[str, List[ProductInfo]] = {}
+    for product in products:
+        groups.setdefault(product.url, []).append(product)
+    return list(groups.values())
 
-# Вспомогательная функция-обёртка
-async def wrapped_task(product: ProductInfo, semaphore: asyncio.Semaphore) -> tuple:
-    result = await get_element_content(product.url, product.xpath, semaphore)
-    return product, result
 
+def backoff_delay(attempt: int) -> float:
+    """
+    Задержка перед повтором: экспоненциальный рост от SCAN_RETRY_DELAY со случайным разбросом,
+    чтобы повторы к одному сайту не приходили одновременно.
 
-async def get_price_and_save(session, max_concurrent_tasks: int = 10):
+    :param attempt: Номер неудачной попытки, начиная с 0.
+    :return: Задержка в секундах.
+    """
+    delay = Config.SCAN_RETRY_DELAY * 2 ** attempt
+    return random.uniform(delay / 2, delay)
+
+
+# Вспомогательная функция-обёртка: одна загрузка страницы на группу товаров с одним URL
+async def wrapped_task(group: List[ProductInfo], limiter: DomainLimiter, semaphore: asyncio.Semaphore,
+                       report: BlockingReport, cache_report: CacheReport,
+                       snapshots: Optional[SnapshotRecorder] = None) -> List[tuple]:
+    url = group[0].url
+    domain = get_domain(url)
+    pending = list(dict.fromkeys(product.xpath for product in group))
+    results: Dict[str, ScanOutcome] = {}
+    started = time.monotonic()
+
+    for attempt in range(Config.SCAN_RETRIES + 1):
+        async with limiter.slot(url):  # Ждем очереди домена и общего лимита
+            # Пока задача ждала очереди, сайт мог быть отключен из-за ошибок других страниц
+            if not circuit_breaker.allow(domain):
+                break
+            outcomes = await get_prices_content(url, pending, semaphore, report, cache_report, snapshots)
+        results.update(outcomes)
+
+        # Сайт ответил хотя бы по одному элементу - он работает
+        if all(outcome.status in SITE_FAILURES for outcome in outcomes.values()):
+            circuit_breaker.record_failure(domain)
+        else:
+            circuit_breaker.record_success(domain)
+
+        # Повторяем только временные ошибки
+        pending = [xpath for xpath, outcome in outcomes.items() if outcome.status in TRANSIENT]
+        if not pending or attempt == Config.SCAN_RETRIES:
+            break
+        await asyncio.sleep(backoff_delay(attempt))
+
+    skipped = ScanOutcome(SKIPPED, error=f"Circuit open for {domain}")
+    outcomes = [results.get(product.xpath, skipped) for product in group]
+    # Страница целиком, с ожиданием очереди домена и повторами: цена найдена хотя бы для одного товара или нет
+    observe_stage(STAGE_PAGE, started, domain,
+                  OK if any(outcome.ok for outcome in outcomes) else outcomes[0].status)
+    return list(zip(group, outcomes))
+
+
+async def get_price_and_save(session, run_id: Optional[str] = None,
+                             progress: Optional[Callable[[int, int], None]] = None,
+                             product_ids: Optional[List[int]] = None,
+                             scan_time: Optional[datetime] = None, resume: bool = False,
+                             raise_errors: bool = False,
+                             session_factory: Callable[[], AsyncSession] = async_session):
+    """
+    Сканирование цен товаров с записью результатов в БД и обновлением расписания товаров.
+
+    :param session: Асинхронная сессия для чтения списка товаров.
+    :param run_id: Идентификатор запуска, по умолчанию создается новый.
+    :param progress: Функция progress(обработано, всего), вызывается после каждого товара.
+    :param product_ids: Сканировать только товары с этими ID, None - все товары.
+    :param scan_time: Время сканирования запуска, по умолчанию текущее.
+    :param resume: Продолжение прерванного запуска run_id: товары, уже обработанные в нем, пропускаются.
+    :param raise_errors: Пробросить ошибку, прервавшую сканирование (например, ошибку БД), а не сообщать
+                         о ней в итоговом отчете: так внешний обработчик вернет пакет в очередь.
+    :param session_factory: Фабрика сессий для записи результатов и снимков страниц.
+    :return: Асинхронный генератор блоков текста для пользователя: строка результата каждого товара
+             и итоговый отчет.
+    """
+    tiers = Counter()  # Количество товаров, обработанных каждым уровнем извлечения
+    statuses = Counter()  # Количество товаров по результату сканирования
+    report = BlockingReport()  # Статистика блокировки ресурсов в браузере
+    cache_report = CacheReport()  # Попадания в кэш страниц HTTP-уровня
+    tasks = []
+    pages = 0  # Количество загружаемых страниц (различных URL)
+    scanned: Dict[int, Optional[int]] = {}  # Результаты для расписания: {ID товара: цена или None}
+    answer = ""  # Текст итогового сообщения
+    scan_time = scan_time or datetime.now(timezone.utc)
+    # Все записи запуска получают общий run_id и время
+    run_id = run_id or uuid.uuid4().hex
+    # Снимки загруженных страниц для повторного извлечения цен без сети
+    snapshots = SnapshotRecorder(snapshot_archive, run_id, scan_time, session_factory=session_factory) \
+        if snapshot_archive else None
     try:
-        products = await get_all_products(session)  # Получаем список товаров
-        semaphore = asyncio.Semaphore(max_concurrent_tasks)  # Создаём семафор
-
-        # Создаём список пар (task, product)
-        tasks = [asyncio.create_task(wrapped_task(p, semaphore)) for p in products]
-
-        count = 10  # Счетчик количества строк вывода
-        answer = ""
-        # Используем as_completed для обработки результатов по мере их готовности
-        for task in asyncio.as_completed(tasks):
-            product, content = await task  # Получаем результат текущей задачи
-
-            # Обработка и сохранение результата
-            print(content)
-            price = convert_price_to_kopecks(content)
-            await add_price_scan(session, product, price)
-            title = f"[{product.title}]({product.url})"
-            answer += f"{title}\n  Цена: {price / 100:.2f} ₽\n"
-
-            count -= 1
-            if count == 0:
-                answer += "\nПродолжение следует..."
-                yield answer
-                answer = ""
-                count = 10
-
+        # Получаем список товаров
+        products = await get_all_products(session, product_ids, exclude_run_id=run_id if resume else None)
+        processed = 0
+        if progress:
+            progress(processed, len(products))
+        limiter = create_limiter()  # Лимиты нагрузки на домены
+        semaphore = asyncio.Semaphore(Config.SCAN_BROWSER_PAGES)  # Лимит открытых страниц браузера
+
+        # Создаём задачи по одной на страницу, чередуя домены, чтобы сайты опрашивались равномерно
+        groups = group_by_url(products)
+        pages = len(groups)
+        tasks = [asyncio.create_task(wrapped_task(group, limiter, semaphore, report, cache_report, snapshots))
+                 for group in interleave_by_domain(groups, lambda group: group[0].url)]
+
+        # Запись результатов в БД идет пакетами
+        async with PriceScanWriter(run_id, scan_time, session_factory=session_factory) as writer:
+            # Используем as_completed для обработки результатов по мере их готовности
+            for task in asyncio.as_completed(tasks):
+                # Результаты страницы раздаются товарам группы, цены страницы разбираются пакетом
+                page_results = await task
+                domain = get_domain(page_results[0][0].url)
+                started = time.monotonic()
+                prices = parse_prices([outcome.content if outcome.ok else None for _, outcome in page_results])
+                parsed = all(price is not None for (_, outcome), price in zip(page_results, prices) if outcome.ok)
+                observe_stage(STAGE_PARSE, started, domain, OK if parsed else PARSE_ERROR)
+                for (product, outcome), price in zip(page_results, prices):
+                    # Обработка результата, в БД сохраняются только полученные цены
+                    status = outcome.status
+                    if outcome.ok:
+                        tiers[outcome.tier] += 1
+                        if price is None:
+                            status = PARSE_ERROR
+                    scanned_products.inc(domain, status)
+                    if status != OK:
+                        scan_failures.inc(domain, status)
+                    # Цена и отметка об обработке товара для продолжения прерванного запуска
+                    await writer.add(product.id, price, status)
+                    scanned[product.id] = price
+                    statuses[status] += 1
+                    processed += 1
+                    if progress:
+                        progress(processed, len(products))
+
+                    # Строка результата товара, упаковкой в сообщения занимается отправитель
+                    title = f"[{product.title}]({product.url})"
+                    if status == OK:
+                        yield f"{title}\n  Цена: {price / 100:.2f} ₽\n"
+                    else:
+                        yield f"{title}\n  Цена не получена: {DESCRIPTIONS[status]}\n"
 
     except Exception as e:
-        answer = f"Извините. Произошла ошибка: {str(e)}"
-
+        if raise_errors:
+            raise
+        answer = f"Извините. Произошла ошибка: {str(e)}\n"
+    finally:
+        # При ошибке или отмене не оставляем работающих задач сканирования
+        for task in tasks:
+            task.cancel()
+        if snapshots is not None:
+            await asyncio.shield(snapshots.close())
+        domain_stats.save()  # Статистика доменов пригодится следующему запуску
+        if scanned:
+            try:
+                # Следующее сканирование по расписанию - и для остановленного запуска
+                now = datetime.now(timezone.utc).replace(tzinfo=None)
+                await asyncio.shield(reschedule_products(session, scanned, now))
+            except Exception as e:
+                logger.error(f"Failed to reschedule scanned products: {e}")
+
+    scan_runs.inc()
     answer += "\nКонец списка."
+    answer += f"\nСтраниц: {pages}, HTTP: {tiers[TIER_HTTP]}, браузер: {tiers[TIER_BROWSER]}"
+    if statuses:
+        answer += "\n" + ", ".join(f"{DESCRIPTIONS[status]}: {count}" for status, count in statuses.items())
+    answer += f"\n{report.summary()}"
+    if cache_report.hits:
+        answer += f"\n{cache_report.summary()}"
     yield answer
@@ -0,0 +1,187 @@
+import logging
+from collections import Counter
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import httpx
+from lxml import html, etree
+
+from app.core.config import Config
+from app.services.browser_pool import CONTEXT_OPTIONS, EXTRA_HEADERS
+from app.services.metrics import metrics
+from app.services.page_cache import (PageCache, CachedPage, CacheReport, content_hash, NOT_MODIFIED, UNCHANGED,
+                                     MISS)
+from app.services.snapshots import SnapshotRecorder
+
+TIER_HTTP = 'http'  # Уровень извлечения: обычный HTTP-запрос и XPath по исходному HTML
+
+logger = logging.getLogger(__name__)
+
+
+def _node_text(tree: html.HtmlElement, xpath: str) -> Optional[str]:
+    """Текст первого непустого узла, найденного по XPath"""
+    try:
+        found = tree.xpath(xpath)
+    except (etree.XPathError, ValueError):
+        return None
+
+    if not isinstance(found, list):
+        found = [found]  # XPath может вернуть строку или число, например string(...)
+    for node in found:
+        text = node.text_content() if isinstance(node, html.HtmlElement) else str(node)
+        if text and text.strip():
+            return text
+    return None
+
+
+def extract_by_xpaths(page_html: str | bytes, xpaths: Iterable[str]) -> Dict[str, Optional[str]]:
+    """
+    Вычисляет несколько XPath на одном HTML-документе, документ разбирается один раз.
+
+    :param page_html: HTML страницы.
+    :param xpaths: XPath элементов.
+    :return: Словарь {xpath: текст узла или None, если узел не найден или пуст}.
+    """
+    try:
+        tree = html.fromstring(page_html)
+    except (etree.ParserError, ValueError):
+        return {xpath: None for xpath in xpaths}
+    return {xpath: _node_text(tree, xpath) for xpath in xpaths}
+
+
+def extract_by_xpath(page_html: str | bytes, xpath: str) -> Optional[str]:
+    """
+    Вычисляет XPath на HTML-документе и возвращает текст первого найденного узла.
+
+    :param page_html: HTML страницы.
+    :param xpath: XPath элемента с ценой.
+    :return: Текст узла или None, если узел не найден или пуст.
+    """
+    return extract_by_xpaths(page_html, [xpath])[xpath]
+
+
+class HttpFetcher:
+    """
+    Быстрый уровень извлечения цены: загрузка страницы обычным HTTP-запросом
+    и вычисление XPath без браузера. Клиент httpx создается один раз и переиспользует соединения.
+    Страница, загруженная раньше, запрашивается условно (If-None-Match, If-Modified-Since):
+    при ответе 304 или совпадении хэша тела с прошлой загрузкой тексты элементов берутся из кэша без разбора.
+    Если тело изменилось, а тексты элементов совпали с прошлыми, страница тоже считается неизменившейся.
+    Страницы, цена на которых появляется только после выполнения скриптов, сканируются браузером
+    и не кэшируются: их HTML часто не меняется, когда меняется цена.
+    """
+
+    def __init__(self, max_connections: int = 20, timeout: float = 15.0, cache: Optional[PageCache] = None):
+        self.max_connections = max_connections
+        self.timeout = timeout
+        self.cache = cache if cache is not None else PageCache(max_size=0)
+        self.cache_stats = Counter()  # Загрузок страниц по результату обращения к кэшу за все время
+        self._client: Optional[httpx.AsyncClient] = None
+
+    async def start(self):
+        """Создание общего HTTP-клиента"""
+        if self._client is None:
+            headers = dict(EXTRA_HEADERS, **{'User-Agent': CONTEXT_OPTIONS['user_agent']})
+            self._client = httpx.AsyncClient(
+                headers=headers,
+                timeout=self.timeout,
+                follow_redirects=True,
+                limits=httpx.Limits(max_connections=self.max_connections,
+                                    max_keepalive_connections=self.max_connections),
+            )
+
+    async def stop(self):
+        """Закрытие HTTP-клиента"""
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    def _count(self, result: str, report: Optional[CacheReport]):
+        self.cache_stats[result] += 1
+        if report is not None:
+            report.hits[result] += 1
+
+    async def fetch_elements(self, url: str, xpaths: List[str], report: Optional[CacheReport] = None,
+                             snapshots: Optional[SnapshotRecorder] = None
+                             ) -> Tuple[Optional[int], Dict[str, Optional[str]]]:
+        """
+        Загружает страницу один раз и ищет на ней элементы по всем XPath.
+        Неизменившаяся страница не разбирается: тексты элементов берутся из кэша.
+
+        :param url: URL страницы с товаром.
+        :param xpaths: XPath элементов.
+        :param report: Статистика кэша страниц сканирования.
+        :param snapshots: Снимки страниц запуска, None - снимки не сохраняются.
+        :return: HTTP-статус ответа (None - ошибка соединения) и словарь
+                 {xpath: текст элемента или None, если без браузера его получить не удалось}.
+        """
+        if self._client is None:
+            await self.start()
+        cached = self.cache.get(url)
+        if cached is not None and not cached.covers(xpaths):
+            cached = None  # Нужны элементы, которых на прошлой загрузке не искали
+        try:
+            response = await self._client.get(url, headers=cached.conditional_headers() if cached else None)
+        except httpx.HTTPError as e:
+            logger.debug(f"HTTP tier failed for {url}: {e}")
+            return None, {xpath: None for xpath in xpaths}
+
+        if response.status_code == 304 and cached is not None:
+            self._count(NOT_MODIFIED, report)
+            if snapshots is not None:
+                await snapshots.add(url, TIER_HTTP, digest=cached.body_hash)
+            return response.status_code, {xpath: cached.contents[xpath] for xpath in xpaths}
+        if response.status_code != 200:
+            return response.status_code, {xpath: None for xpath in xpaths}
+        if snapshots is not None:
+            await snapshots.add(url, TIER_HTTP, content=response.content)
+        if not self.cache.enabled:
+            return response.status_code, extract_by_xpaths(response.content, xpaths)
+
+        body_hash = content_hash(response.content)
+        if cached is not None and cached.body_hash == body_hash:
+            self._count(UNCHANGED, report)
+            return response.status_code, {xpath: cached.contents[xpath] for xpath in xpaths}
+        contents = extract_by_xpaths(response.content, xpaths)
+        # Тело могло измениться вне элементов с ценой (токены CSRF, время генерации страницы):
+        # страница не изменилась, если совпали найденные на ней элементы
+        unchanged = cached is not None and all(cached.contents[xpath] == contents[xpath] for xpath in xpaths)
+        self._count(UNCHANGED if unchanged else MISS, report)
+        if unchanged:
+            contents = dict(cached.contents, **contents)
+        self.cache.put(url, CachedPage(response.headers.get('ETag'), response.headers.get('Last-Modified'),
+                                       body_hash, contents))
+        return response.status_code, {xpath: contents[xpath] for xpath in xpaths}
+
+    async def get_elements_content(self, url: str, xpaths: List[str], report: Optional[CacheReport] = None,
+                                   snapshots: Optional[SnapshotRecorder] = None) -> Dict[str, Optional[str]]:
+        """
+        Загружает страницу один раз и ищет на ней элементы по всем XPath.
+
+        :param url: URL страницы с товаром.
+        :param xpaths: XPath элементов.
+        :param report: Статистика кэша страниц сканирования.
+        :param snapshots: Снимки страниц запуска, None - снимки не сохраняются.
+        :return: Словарь {xpath: текст элемента или None, если без браузера его получить не удалось}.
+        """
+        return (await self.fetch_elements(url, xpaths, report, snapshots))[1]
+
+    async def get_element_content(self, url: str, xpath: str, report: Optional[CacheReport] = None) -> Optional[str]:
+        """
+        Загружает страницу и ищет на ней элемент по XPath.
+
+        :param url: URL страницы с товаром.
+        :param xpath: XPath для элемента, содержащего цену.
+        :param report: Статистика кэша страниц сканирования.
+        :return: Текст элемента или None, если без браузера цену получить не удалось.
+        """
+        return (await self.get_elements_content(url, [xpath], report))[xpath]
+
+
+# Общий HTTP-клиент приложения, запускается и останавливается в lifespan
+http_fetcher = HttpFetcher(cache=PageCache(max_size=Config.HTTP_CACHE_SIZE, ttl=Config.HTTP_CACHE_TTL))
+
+# Попадания в кэш страниц читаются при выдаче /metrics
+metrics.callback('counter', 'page_cache_requests_total', 'Загрузки страниц HTTP-уровня по результату обращения к кэшу',
+                 ('result',), lambda: {(result,): http_fetcher.cache_stats[result]
+                                       for result in (NOT_MODIFIED, UNCHANGED, MISS)})
+metrics.callback('gauge', 'page_cache_size', 'Страниц в кэше HTTP-уровня', (), lambda: {(): len(http_fetcher.cache)})
@@ -0,0 +1,181 @@
+import time
+from bisect import bisect_left
+from typing import Callable, Dict, Iterable, List, Sequence, Tuple
+
+# Границы интервалов гистограмм, секунды: от разбора цены (микросекунды) до загрузки медленной страницы
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+# Этапы сканирования (метка stage гистограммы stage_seconds)
+STAGE_BROWSER_LAUNCH = 'browser_launch'  # Запуск браузера
+STAGE_BROWSER_PAGE = 'browser_page'  # Получение страницы браузера (контекст, настройки)
+STAGE_NAVIGATION = 'navigation'  # page.goto
+STAGE_SELECTOR = 'selector'  # Ожидание элемента с ценой и чтение текста
+STAGE_HTTP = 'http_fetch'  # Загрузка страницы и поиск элементов без браузера
+STAGE_PARSE = 'parse'  # Разбор строки цены
+STAGE_PAGE = 'page'  # Страница целиком: ожидание очереди домена, все уровни и повторы
+STAGE_DB_WRITE = 'db_write'  # Запись пакета цен в БД
+
+LabelValues = Tuple[str, ...]
+
+
+def _escape(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(names: Sequence[str], values: Sequence[str], extra: str = '') -> str:
+    pairs = [f'{name}="{_escape(str(value))}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _number(value: float) -> str:
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    """Счетчик с метками: увеличивается на месте события"""
+
+    kind = 'counter'
+
+    def __init__(self, name: str, documentation: str, labels: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self._values: Dict[LabelValues, float] = {}
+
+    def inc(self, *label_values: str, amount: float = 1):
+        self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def value(self, *label_values: str) -> float:
+        return self._values.get(label_values, 0)
+
+    def render(self) -> Iterable[str]:
+        for label_values, value in sorted(self._values.items()):
+            yield f"{self.name}{_labels(self.labels, label_values)} {_number(value)}"
+
+
+class Histogram:
+    """
+    Гистограмма с метками. Измерение - поиск интервала и два сложения,
+    накопительные значения интервалов считаются только при выдаче метрик.
+    """
+
+    kind = 'histogram'
+
+    def __init__(self, name: str, documentation: str, labels: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets)
+        self._series: Dict[LabelValues, List] = {}  # {метки: [счетчики интервалов, сумма]}
+
+    def observe(self, value: float, *label_values: str):
+        series = self._series.get(label_values)
+        if series is None:
+            series = self._series[label_values] = [[0] * (len(self.buckets) + 1), 0.0]
+        series[0][bisect_left(self.buckets, value)] += 1
+        series[1] += value
+
+    def count(self, *label_values: str) -> int:
+        series = self._series.get(label_values)
+        return sum(series[0]) if series else 0
+
+    def render(self) -> Iterable[str]:
+        for label_values, (counts, total) in sorted(self._series.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += count
+                le = f'le="{_number(bound)}"'
+                yield f"{self.name}_bucket{_labels(self.labels, label_values, le)} {cumulative}"
+            yield f"{self.name}_sum{_labels(self.labels, label_values)} {_number(total)}"
+            yield f"{self.name}_count{_labels(self.labels, label_values)} {cumulative}"
+
+
+class Callback:
+    """
+    Метрика, значения которой берутся у владельца в момент выдачи: счетчики и размеры очередей,
+    которые сервис уже считает сам, не дублируются на каждом событии.
+    """
+
+    def __init__(self, kind: str, name: str, documentation: str, labels: Sequence[str],
+                 collect: Callable[[], Dict[LabelValues, float]]):
+        self.kind = kind
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self.collect = collect
+
+    def render(self) -> Iterable[str]:
+        for label_values, value in sorted(self.collect().items()):
+            yield f"{self.name}{_labels(self.labels, label_values)} {_number(value)}"
+
+
+class MetricsRegistry:
+    """Метрики приложения в текстовом формате Prometheus"""
+
+    def __init__(self, prefix: str = 'price_parser_'):
+        self.prefix = prefix
+        self._metrics: Dict[str, object] = {}
+
+    def _add(self, metric):
+        if metric.name in self._metrics:
+            raise ValueError(f"Metric {metric.name} is already registered")
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, documentation: str, labels: Sequence[str] = ()) -> Counter:
+        return self._add(Counter(self.prefix + name, documentation, labels))
+
+    def histogram(self, name: str, documentation: str, labels: Sequence[str] = (),
+                  buckets: Sequence[float] = DEFAULT_BUCKETS) -> Histogram:
+        return self._add(Histogram(self.prefix + name, documentation, labels, buckets))
+
+    def callback(self, kind: str, name: str, documentation: str, labels: Sequence[str],
+                 collect: Callable[[], Dict[LabelValues, float]]) -> Callback:
+        """
+        Регистрирует метрику, значения которой вычисляются при выдаче.
+
+        :param kind: Тип Prometheus: counter или gauge.
+        :param name: Имя без префикса.
+        :param documentation: Описание.
+        :param labels: Имена меток.
+        :param collect: Функция, возвращающая {значения меток: значение}.
+        """
+        return self._add(Callback(kind, self.prefix + name, documentation, labels, collect))
+
+    def render(self) -> str:
+        """Все метрики в текстовом формате Prometheus"""
+        lines = []
+        for metric in self._metrics.values():
+            lines.append(f"# HELP {metric.name} {_escape(metric.documentation)}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+
+# Общий реестр метрик приложения, выдается на /metrics
+metrics = MetricsRegistry()
+
+stage_seconds = metrics.histogram(
+    'stage_seconds', 'Длительность этапов сканирования, секунды', ('stage', 'domain', 'outcome'))
+scanned_products = metrics.counter(
+    'scanned_products_total', 'Отсканированные товары по результату', ('domain', 'status'))
+scan_failures = metrics.counter(
+    'scan_failures_total', 'Товары, цену которых получить не удалось', ('domain', 'status'))
+scan_runs = metrics.counter('scan_runs_total', 'Завершенные запуски сканирования')
+
+
+def observe_stage(stage: str, started: float, domain: str = '', outcome: str = 'ok'):
+    """
+    Записывает длительность этапа сканирования.
+
+    :param stage: Этап (STAGE_*).
+    :param started: Начало этапа по time.monotonic().
+    :param domain: Домен страницы.
+    :param outcome: Результат этапа (статус из outcomes или ok/error).
+    """
+    stage_seconds.observe(time.monotonic() - started, stage, domain, outcome)
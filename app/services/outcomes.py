@@ -0,0 +1,43 @@
+from typing import NamedTuple, Optional
+
+# Результаты извлечения цены
+OK = 'ok'  # Элемент найден
+TIMEOUT = 'timeout'  # Страница или элемент не дождались таймаута
+NOT_FOUND = 'not_found'  # Страница загружена, элемента нет (или страницы нет - 404)
+BLOCKED = 'blocked'  # Сайт отказал в доступе (401, 403, 429, 503)
+NETWORK_ERROR = 'network_error'  # Ошибка соединения или браузера
+PARSE_ERROR = 'parse_error'  # Элемент найден, но цену из него не получить
+SKIPPED = 'skipped'  # Не сканировался: сайт временно отключен автоматом (circuit breaker)
+
+# Ошибки, при которых имеет смысл повторить попытку
+TRANSIENT = {TIMEOUT, NETWORK_ERROR}
+# Ошибки, которые говорят о проблеме сайта, а не отдельного товара
+SITE_FAILURES = {TIMEOUT, NETWORK_ERROR, BLOCKED}
+
+# Описания для пользователя
+DESCRIPTIONS = {
+    OK: 'получена',
+    TIMEOUT: 'таймаут',
+    NOT_FOUND: 'элемент не найден',
+    BLOCKED: 'доступ запрещен сайтом',
+    NETWORK_ERROR: 'ошибка соединения',
+    PARSE_ERROR: 'не удалось распознать цену',
+    SKIPPED: 'сайт временно пропускается из-за ошибок',
+}
+
+# HTTP-статусы, означающие отказ в доступе
+BLOCKED_STATUSES = {401, 403, 429, 503}
+
+
+class ScanOutcome(NamedTuple):
+    """
+    Результат извлечения содержимого элемента со страницы
+    """
+    status: str  # Одна из констант выше
+    content: Optional[str] = None  # Текст элемента, если status == OK
+    tier: Optional[str] = None  # Уровень извлечения (HTTP или браузер)
+    error: Optional[str] = None  # Текст ошибки
+
+    @property
+    def ok(self) -> bool:
+        return self.status == OK
@@ -0,0 +1,107 @@
+import time
+import hashlib
+from collections import Counter, OrderedDict
+from typing import Dict, Iterable, Optional
+
+# Результаты обращения к кэшу (ключи CacheReport.hits)
+NOT_MODIFIED = 'not_modified'  # Сайт ответил 304 на условный запрос
+UNCHANGED = 'unchanged'  # Страница загружена, но совпала с прошлой (целиком или элементами с ценой)
+MISS = 'miss'  # Страница новая или изменилась
+
+
+def content_hash(content: bytes) -> str:
+    """Хэш тела ответа для сравнения с прошлой загрузкой"""
+    return hashlib.blake2b(content, digest_size=16).hexdigest()
+
+
+class CachedPage:
+    """Прошлая загрузка страницы: валидаторы HTTP, хэш тела и найденные тексты элементов"""
+
+    __slots__ = ('etag', 'last_modified', 'body_hash', 'contents', 'stored_at')
+
+    def __init__(self, etag: Optional[str], last_modified: Optional[str], body_hash: str,
+                 contents: Dict[str, Optional[str]]):
+        self.etag = etag
+        self.last_modified = last_modified
+        self.body_hash = body_hash
+        self.contents = contents
+        self.stored_at = time.monotonic()
+
+    def covers(self, xpaths: Iterable[str]) -> bool:
+        """Для всех ли XPath известен результат"""
+        return all(xpath in self.contents for xpath in xpaths)
+
+    def conditional_headers(self) -> Dict[str, str]:
+        """Заголовки условного запроса: сайт ответит 304, если страница не изменилась"""
+        headers = {}
+        if self.etag:
+            headers['If-None-Match'] = self.etag
+        if self.last_modified:
+            headers['If-Modified-Since'] = self.last_modified
+        return headers
+
+
+class PageCache:
+    """
+    Кэш страниц HTTP-уровня по URL с вытеснением давно не использованных (LRU) и устаревших (TTL) записей.
+    Устаревшая запись не используется: страница загружается заново без условных заголовков,
+    так сайты с неверными валидаторами не отдают старую цену дольше TTL.
+    """
+
+    def __init__(self, max_size: int = 10000, ttl: float = 86400):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._pages: OrderedDict[str, CachedPage] = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._pages)
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_size > 0
+
+    def get(self, url: str) -> Optional[CachedPage]:
+        """
+        Запись страницы, если она есть и не устарела.
+
+        :param url: URL страницы.
+        :return: Запись кэша или None.
+        """
+        page = self._pages.get(url)
+        if page is None:
+            return None
+        if time.monotonic() - page.stored_at > self.ttl:
+            del self._pages[url]
+            return None
+        self._pages.move_to_end(url)
+        return page
+
+    def put(self, url: str, page: CachedPage):
+        """Сохраняет запись страницы, вытесняя самую давно использованную при переполнении"""
+        if not self.enabled:
+            return
+        self._pages[url] = page
+        self._pages.move_to_end(url)
+        while len(self._pages) > self.max_size:
+            self._pages.popitem(last=False)
+
+    def clear(self):
+        self._pages.clear()
+
+
+class CacheReport:
+    """
+    Статистика кэша страниц за одно сканирование
+    """
+
+    def __init__(self):
+        self.hits = Counter()  # Загрузок страниц по результату обращения к кэшу
+
+    @property
+    def hit_rate(self) -> float:
+        total = sum(self.hits.values())
+        return (self.hits[NOT_MODIFIED] + self.hits[UNCHANGED]) / total if total else 0.0
+
+    def summary(self) -> str:
+        return (f"Кэш страниц: 304 - {self.hits[NOT_MODIFIED]}, без изменений - {self.hits[UNCHANGED]}, "
+                f"загружено - {self.hits[MISS]} (попаданий {self.hit_rate:.0%})")
@@ -1,41 +1,270 @@
+import time
 import asyncio
-from typing import Union
-from playwright.async_api import async_playwright
+import logging
+from typing import Dict, List, Optional
+from urllib.parse import urlsplit
 
+from playwright.async_api import TimeoutError as PlaywrightTimeoutError
 
-async def get_element_content(url: str, xpath: str, semaphore: asyncio.Semaphore) -> Union[str, None]:
+from app.core.config import Config
+from app.services.browser_pool import browser_pool
+from app.services.domain_stats import domain_stats, NAVIGATION, SELECTOR
+from app.services.http_fetcher import http_fetcher, TIER_HTTP
+from app.services.metrics import (observe_stage, STAGE_BROWSER_PAGE, STAGE_NAVIGATION, STAGE_SELECTOR,
+                                   STAGE_HTTP)
+from app.services.page_cache import CacheReport
+from app.services.resource_blocking import BlockingReport, block_resources
+from app.services.snapshots import SnapshotRecorder
+from app.services.outcomes import (ScanOutcome, OK, TIMEOUT, NOT_FOUND, BLOCKED, NETWORK_ERROR,
+                                   BLOCKED_STATUSES)
+
+logger = logging.getLogger(__name__)
+
+# Уровни извлечения цены: TIER_HTTP (http_fetcher) и браузер
+TIER_BROWSER = 'browser'  # Headless Chromium
+
+# Ожидание элемента на странице. Промис завершается, когда элемент появился ('found'),
+# когда загрузка закончилась и DOM не меняется settleMs ('settled') или по таймауту ('timeout').
+# Так отсутствующий элемент не держит слот сканирования до конца таймаута
+WAIT_FOR_XPATH_JS = """
+([xpath, settleMs, timeoutMs]) => new Promise((resolve) => {
+    const find = () => document.evaluate(
+        xpath, document, null, XPathResult.FIRST_ORDERED_NODE_TYPE, null).singleNodeValue;
+    if (find()) return resolve('found');
+    let settleTimer = null;
+    const observer = new MutationObserver(() => { if (find()) done('found'); else armSettle(); });
+    const hardTimer = setTimeout(() => done('timeout'), timeoutMs);
+    function done(result) {
+        observer.disconnect();
+        clearTimeout(settleTimer);
+        clearTimeout(hardTimer);
+        resolve(result);
+    }
+    function armSettle() {
+        clearTimeout(settleTimer);
+        settleTimer = setTimeout(() => {
+            if (document.readyState === 'complete') done('settled'); else armSettle();
+        }, settleMs);
+    }
+    observer.observe(document, {childList: true, subtree: true, characterData: true});
+    armSettle();
+})
+"""
+
+
+def get_domain(url: str) -> str:
+    """Домен (host) из URL в нижнем регистре"""
+    return (urlsplit(url).hostname or '').lower()
+
+
+# Признаки ошибки Playwright, когда страница перешла на другой адрес во время выполнения скрипта
+# (редирект скриптом страницы): контекст, в котором выполнялся скрипт, уничтожен
+NAVIGATED_ERRORS = ('Execution context was destroyed', 'Cannot find context with specified id')
+NAVIGATED_RETRIES = 2  # Сколько раз повторить ожидание элемента на новой странице
+
+
+def is_navigated_error(error: Exception) -> bool:
+    """Ошибка из-за перехода страницы на другой адрес во время выполнения скрипта"""
+    message = str(error)
+    return any(sign in message for sign in NAVIGATED_ERRORS)
+
+
+def classify_error(error: Exception, default: str = NETWORK_ERROR) -> ScanOutcome:
+    """
+    Результат сканирования по исключению Playwright.
+
+    :param error: Исключение.
+    :param default: Результат для прочих ошибок: при загрузке страницы это ошибка соединения
+                    или браузера, при поиске элемента (например, некорректный XPath) - NOT_FOUND.
+    """
+    message = str(error)
+    if isinstance(error, PlaywrightTimeoutError):
+        return ScanOutcome(TIMEOUT, tier=TIER_BROWSER, error=message)
+    if 'net::' in message or 'closed' in message or 'crash' in message.lower() or is_navigated_error(error):
+        return ScanOutcome(NETWORK_ERROR, tier=TIER_BROWSER, error=message)
+    return ScanOutcome(default, tier=TIER_BROWSER, error=message)
+
+
+async def _wait_for_xpath(page, xpath: str, timeout: float) -> str:
+    """
+    Ожидание элемента на странице (WAIT_FOR_XPATH_JS): 'found', 'settled' или 'timeout'.
+    Если страница перешла на другой адрес во время ожидания, ожидание повторяется на новой
+    странице в пределах оставшегося времени.
+    """
+    deadline = time.monotonic() + timeout / 1000
+    for attempt in range(NAVIGATED_RETRIES + 1):
+        try:
+            if attempt:
+                # Новая страница еще загружается: скрипт ожидания выполнится после ее загрузки
+                await page.wait_for_load_state('domcontentloaded', timeout=timeout)
+                timeout = (deadline - time.monotonic()) * 1000
+                if timeout <= 0:
+                    break
+            return await page.evaluate(WAIT_FOR_XPATH_JS, [xpath, Config.DOM_SETTLE_MS, timeout])
+        except Exception as e:
+            if not is_navigated_error(e) or attempt == NAVIGATED_RETRIES:
+                raise
+        timeout = (deadline - time.monotonic()) * 1000
+        if timeout <= 0:
+            break
+    return 'timeout'
+
+
+async def _selector_text(page, domain: str, xpath: str) -> ScanOutcome:
+    """
+    Текст элемента на открытой странице.
+    Таймаут ожидания берется из статистики домена. В статистику попадает и время ожидания
+    без результата: по таймауту - сам таймаут (элемент появился бы не раньше), по загрузке
+    страницы без элемента - время до ее завершения. Иначе на медленном сайте таймаут
+    вычислялся бы только по успешным быстрым ответам и не мог бы вырасти.
+    """
+    timeout = domain_stats.timeout(domain, SELECTOR)
+    started = time.monotonic()
+    try:
+        state = await _wait_for_xpath(page, xpath, timeout)
+        domain_stats.record(domain, SELECTOR, timeout if state == 'timeout' else (time.monotonic() - started) * 1000)
+        if state != 'found':
+            status = TIMEOUT if state == 'timeout' else NOT_FOUND
+            outcome = ScanOutcome(status, tier=TIER_BROWSER, error=f"Element not found ({state}): {xpath}")
+        else:
+            content = await page.locator(f'xpath={xpath}').first.text_content()
+            if not content or not content.strip():
+                outcome = ScanOutcome(NOT_FOUND, tier=TIER_BROWSER, error=f"Element is empty: {xpath}")
+            else:
+                outcome = ScanOutcome(OK, content=content, tier=TIER_BROWSER)
+    except Exception as e:
+        outcome = classify_error(e, default=NOT_FOUND)
+    observe_stage(STAGE_SELECTOR, started, domain, outcome.status)
+    return outcome
+
+
+async def get_elements_content(url: str, xpaths: List[str], semaphore: asyncio.Semaphore,
+                               report: Optional[BlockingReport] = None,
+                               snapshots: Optional[SnapshotRecorder] = None) -> Dict[str, ScanOutcome]:
+    """
+    Асинхронно извлекает содержимое нескольких элементов одной страницы по XPath.
+    Страница загружается один раз, все XPath ожидаются на ней параллельно.
+    Таймауты загрузки и ожидания элемента вычисляются по статистике домена, ожидание
+    прекращается раньше, если страница загрузилась и перестала меняться.
+    Страница берется из общего пула браузеров, ненужные для поиска цены ресурсы не загружаются.
+
+    :param url: URL страницы с товаром.
+    :param xpaths: XPath элементов.
+    :param semaphore: Семафор для ограничения количества параллельных запросов.
+    :param report: Статистика блокировки ресурсов сканирования.
+    :param snapshots: Снимки страниц запуска: сохраняется DOM после ожидания элементов.
+    :return: Словарь {xpath: результат сканирования}.
+    """
+    domain = get_domain(url)
+    async with semaphore:  # Ждем, если лимит запросов превышен
+        started = time.monotonic()
+        try:
+            async with browser_pool.page() as page:
+                await block_resources(page, url, report)
+                observe_stage(STAGE_BROWSER_PAGE, started, domain)
+                started = time.monotonic()
+                timeout = domain_stats.timeout(domain, NAVIGATION)
+                try:
+                    response = await page.goto(url, wait_until='domcontentloaded', timeout=timeout)
+                except Exception as e:
+                    if isinstance(e, PlaywrightTimeoutError):
+                        domain_stats.record(domain, NAVIGATION, timeout)  # Загрузка заняла бы не меньше таймаута
+                    observe_stage(STAGE_NAVIGATION, started, domain, classify_error(e).status)
+                    raise
+                domain_stats.record(domain, NAVIGATION, (time.monotonic() - started) * 1000)
+
+                # Отказ в доступе или отсутствие страницы - элементы не ждем
+                if response is not None and response.status in BLOCKED_STATUSES:
+                    observe_stage(STAGE_NAVIGATION, started, domain, BLOCKED)
+                    outcome = ScanOutcome(BLOCKED, tier=TIER_BROWSER, error=f"HTTP {response.status}")
+                    return {xpath: outcome for xpath in xpaths}
+                if response is not None and response.status in (404, 410):
+                    observe_stage(STAGE_NAVIGATION, started, domain, NOT_FOUND)
+                    outcome = ScanOutcome(NOT_FOUND, tier=TIER_BROWSER, error=f"HTTP {response.status}")
+                    return {xpath: outcome for xpath in xpaths}
+                observe_stage(STAGE_NAVIGATION, started, domain)
+
+                outcomes = await asyncio.gather(*(_selector_text(page, domain, xpath) for xpath in xpaths))
+                if snapshots is not None:
+                    try:
+                        await snapshots.add(url, TIER_BROWSER, content=(await page.content()).encode())
+                    except Exception as e:
+                        logger.debug(f"Snapshot of {url} was not taken: {e}")
+                return dict(zip(xpaths, outcomes))
+        except Exception as e:
+            outcome = classify_error(e)
+            return {xpath: outcome for xpath in xpaths}
+
+
+async def get_element_content(url: str, xpath: str, semaphore: asyncio.Semaphore,
+                              report: Optional[BlockingReport] = None) -> ScanOutcome:
     """
     Асинхронно извлекает содержимое элемента с указанной страницы по XPath.
 
     :param url: URL страницы с товаром.
     :param xpath: XPath для элемента, содержащего цену.
     :param semaphore: Семафор для ограничения количества параллельных запросов.
-    :return: Цена в виде строки или сообщение об ошибке.
+    :param report: Статистика блокировки ресурсов сканирования.
+    :return: Результат сканирования.
     """
-    async with semaphore:  # Ждем, если лимит запросов превышен
-        async with async_playwright() as p:
-            browser = await p.chromium.launch(headless=True, args=['--disable-blink-features=AutomationControlled'])
-            context = await browser.new_context(
-                viewport={'width': 1280, 'height': 720},
-                user_agent='Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36',
-                locale='ru-RU',
-                timezone_id='Europe/Moscow'
-            )
-            await context.add_init_script("Object.defineProperty(navigator, 'webdriver', {get: () => undefined})")
-
-            page = await context.new_page()
-            await page.set_extra_http_headers({
-                'Accept-Language': 'ru-RU,ru;q=0.9,en-US;q=0.8,en;q=0.7',
-                'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,image/webp,*/*;q=0.8'
-            })
-
-            await page.goto(url, wait_until='domcontentloaded')
-
-            try:
-                element = await page.wait_for_selector(f'xpath={xpath}', timeout=20000)
-                content = await element.text_content()
-                await browser.close()
-                return content
-            except Exception as e:
-                await browser.close()
-                return str(e)
+    return (await get_elements_content(url, [xpath], semaphore, report))[xpath]
+
+
+async def get_prices_content(url: str, xpaths: List[str], semaphore: asyncio.Semaphore,
+                             report: Optional[BlockingReport] = None,
+                             cache_report: Optional[CacheReport] = None,
+                             snapshots: Optional[SnapshotRecorder] = None) -> Dict[str, ScanOutcome]:
+    """
+    Извлекает содержимое элементов одной страницы, начиная с быстрого HTTP-уровня.
+    Страница загружается один раз на уровень, в браузер уходят только XPath, не найденные по HTTP.
+    Сработавший уровень запоминается для домена. Браузер запоминается, только если страница
+    загрузилась по HTTP (200), но элементы нашлись лишь в браузере: 404, отказ в доступе или ошибка
+    соединения уровень не меняют. Домен, закрепленный за браузером, каждые TIER_REPROBE_PAGES страниц
+    снова пробуется по HTTP.
+
+    :param url: URL страницы с товаром.
+    :param xpaths: XPath элементов, которые нужно найти на странице.
+    :param semaphore: Семафор для ограничения количества параллельно открытых страниц браузера.
+    :param report: Статистика блокировки ресурсов сканирования.
+    :param cache_report: Статистика кэша страниц HTTP-уровня.
+    :param snapshots: Снимки страниц запуска, None - снимки не сохраняются.
+    :return: Словарь {xpath: результат сканирования}.
+    """
+    domain = get_domain(url)
+    results: Dict[str, ScanOutcome] = {}
+    http_status = None  # Статус ответа HTTP-уровня, None - HTTP-уровень не пробовался или не ответил
+    if domain_stats.get_tier(domain) != TIER_BROWSER or domain_stats.reprobe_due(domain, Config.TIER_REPROBE_PAGES):
+        started = time.monotonic()
+        http_status, contents = await http_fetcher.fetch_elements(url, xpaths, cache_report, snapshots)
+        for xpath, content in contents.items():
+            if content is not None:
+                results[xpath] = ScanOutcome(OK, content=content, tier=TIER_HTTP)
+        observe_stage(STAGE_HTTP, started, domain, OK if results else NOT_FOUND)
+        if results:
+            domain_stats.set_tier(domain, TIER_HTTP)
+
+    missed = [xpath for xpath in xpaths if xpath not in results]
+    if missed:
+        browser_results = await get_elements_content(url, missed, semaphore, report, snapshots)
+        results.update(browser_results)
+        # Страница по HTTP доступна, а элементы есть только в браузере - цена рисуется скриптами
+        if len(missed) == len(xpaths) and http_status in (200, 304) \
+                and any(outcome.ok for outcome in browser_results.values()):
+            domain_stats.set_tier(domain, TIER_BROWSER)
+    return results
+
+
+async def get_price_content(url: str, xpath: str, semaphore: asyncio.Semaphore,
+                            report: Optional[BlockingReport] = None,
+                            cache_report: Optional[CacheReport] = None) -> ScanOutcome:
+    """
+    Извлекает содержимое элемента, начиная с быстрого HTTP-уровня. В браузер уходят только промахи.
+
+    :param url: URL страницы с товаром.
+    :param xpath: XPath для элемента, содержащего цену.
+    :param semaphore: Семафор для ограничения количества параллельно открытых страниц браузера.
+    :param report: Статистика блокировки ресурсов сканирования.
+    :param cache_report: Статистика кэша страниц HTTP-уровня.
+    :return: Результат сканирования.
+    """
+    return (await get_prices_content(url, [xpath], semaphore, report, cache_report))[xpath]
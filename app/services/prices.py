@@ -0,0 +1,117 @@
+import re
+from functools import lru_cache
+from typing import Dict, Iterable, List, Optional, Tuple
+
+PRICE_CACHE_SIZE = 65536  # Сколько разных строк цен помнить: на сайтах цены повторяются от запуска к запуску
+MAX_PRICE_LENGTH = 200  # Более длинный текст - не цена, а, скорее всего, весь блок товара
+
+# Пробелы любого вида: \s включает неразрывный (U+00A0), узкий неразрывный (U+202F) и тонкий (U+2009)
+SPACES = re.compile(r'\s+')
+# Число с разделителями разрядов и дробной частью: "1 299,00", "1.299.000", "1'299.50"
+NUMBER = re.compile(r"\d+(?:[ .,'’]\d+)*")
+# Числа, за которыми идут проценты, штуки или единицы измерения, - не цена: "-20%", "2 шт", "за 1 кг"
+NOT_PRICE = re.compile(r"\s*(?:%|шт|кг|г\b|гр\b|гр\.|мл|л\b|м\b|см|мм|x\b|х\b|×)", re.IGNORECASE)
+THOUSANDS_GROUP = re.compile(r"\d{3}")
+
+
+def _split_spaces(token: str) -> List[Tuple[str, int]]:
+    """
+    Делит найденное число по пробелам: пробел - разделитель разрядов, только если за ним три цифры.
+    "1 299" - одно число, "2 150" - тоже, "1 299 1 599" - два числа, "12 5" - два числа.
+
+    :return: Список (число без пробелов, позиция конца числа в token).
+    """
+    numbers = []
+    position = 0
+    for part in token.split(' '):
+        position += len(part)
+        if numbers and THOUSANDS_GROUP.fullmatch(part.split(',')[0].split('.')[0]) \
+                and not any(separator in numbers[-1][0] for separator in '.,'):
+            numbers[-1] = (numbers[-1][0] + part, position)
+        else:
+            numbers.append((part, position))
+        position += 1
+    return numbers
+
+
+def _to_kopecks(number: str) -> Optional[int]:
+    """
+    Переводит число с разделителями в копейки без вычислений с плавающей точкой.
+    Разделитель дробной части определяется по записи:
+    - есть и точка, и запятая - дробная часть после последнего из них ("1.299,00", "1,299.00");
+    - разделитель встречается несколько раз - это разряды ("1.299.000"), группы после первой -
+      ровно по три цифры, иначе это не цена (например, дата "12.05.2024");
+    - после единственного разделителя три цифры - это разряды, если до него от одной до трех цифр
+      ("1.299", "1,299"); "1299.999" - не цена;
+    - одна или две цифры после разделителя - дробная часть ("1299,5", "1299.00").
+    """
+    number = number.replace("'", '').replace('’', '')
+    if '.' in number and ',' in number:
+        decimal_separator = '.' if number.rfind('.') > number.rfind(',') else ','
+        thousands_separator = ',' if decimal_separator == '.' else '.'
+        number = number.replace(thousands_separator, '')
+        whole, _, fraction = number.partition(decimal_separator)
+    else:
+        separator = '.' if '.' in number else ',' if ',' in number else None
+        if separator is None:
+            whole, fraction = number, ''
+        elif number.count(separator) > 1:
+            groups = number.split(separator)
+            if len(groups[0]) > 3 or any(len(group) != 3 for group in groups[1:]):
+                return None
+            whole, fraction = ''.join(groups), ''
+        else:
+            whole, fraction = number.split(separator)
+            if len(fraction) == 3 and whole != '0':
+                if len(whole) > 3:
+                    return None  # Разряды отделяются по три цифры: "1299.999" - не цена
+                whole, fraction = whole + fraction, ''
+    if not whole.isdigit() or (fraction and not fraction.isdigit()) or len(fraction) > 2:
+        return None
+    # Рубли и копейки складываются как целые числа: "0,29" - ровно 29 копеек, а не int(0.29 * 100) == 28
+    kopecks = int(whole) * 100 + int(fraction.ljust(2, '0'))
+    return kopecks or None
+
+
+@lru_cache(maxsize=PRICE_CACHE_SIZE)
+def parse_price(raw: str) -> Optional[int]:
+    """
+    Цена из текста элемента сайта в копейках. Понимает разделители разрядов (пробелы, в том числе
+    неразрывные, точки, запятые, апострофы), дробную часть через точку или запятую, знаки и названия
+    валют и диапазоны ("от 1 299 ₽", "1 299 - 1 599 ₽" - берется первая цена). Числа с процентами,
+    штуками и единицами измерения ("-20%", "цена за 1 кг") пропускаются.
+    Результаты запоминаются: одинаковые строки разбираются один раз.
+
+    :param raw: Текст с ценой.
+    :return: Цена в копейках или None, если цену распознать не удалось.
+    """
+    if not raw or len(raw) > MAX_PRICE_LENGTH:
+        return None
+    text = SPACES.sub(' ', raw).strip()
+
+    for match in NUMBER.finditer(text):
+        for number, end in _split_spaces(match.group()):
+            if NOT_PRICE.match(text, match.start() + end):
+                continue
+            kopecks = _to_kopecks(number)
+            if kopecks is not None:
+                return kopecks
+    return None
+
+
+def parse_prices(raws: Iterable[Optional[str]]) -> List[Optional[int]]:
+    """
+    Цены пакета строк, например всех результатов страницы или запуска сканирования.
+    Каждая различная строка разбирается один раз.
+
+    :param raws: Тексты с ценами (None - элемент не найден).
+    :return: Цены в копейках или None в том же порядке.
+    """
+    known: Dict[Optional[str], Optional[int]] = {None: None}
+    result = []
+    for raw in raws:
+        price = known.get(raw, known)
+        if price is known:
+            price = known[raw] = parse_price(raw)
+        result.append(price)
+    return result
@@ -0,0 +1,156 @@
+"""
+Повторное извлечение цен из архива снимков страниц, без обращения к сайтам.
+
+    python -m app.services.reextract check [--domain shop.ru] [--product-id 1 2] [--xpath XPATH] [--since 2024-05-01]
+    python -m app.services.reextract backfill [--domain shop.ru] [--product-id 1 2] [--since 2024-05-01]
+    python -m app.services.reextract prune
+
+check - проверка XPath товаров (или XPath из --xpath вместо них) на сохраненных снимках без записи в БД.
+backfill - цены, найденные на снимках, записываются в историю тех запусков, где цены товара нет:
+после исправления XPath история восстанавливается за время хранения снимков.
+prune - удаление снимков старше SNAPSHOT_RETENTION_DAYS и файлов архива без записей о снимках.
+"""
+import asyncio
+import argparse
+from collections import Counter
+from datetime import datetime
+from typing import Callable, Dict, List, Optional, Tuple
+
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.core.config import Config
+from app.core.database import async_session, create_tables
+from app.db.crud import add_price_scans, STORAGE_INTERVALS
+from app.db.snapshots import iter_product_snapshots, get_referenced_hashes
+from app.services.http_fetcher import extract_by_xpaths
+from app.services.parser import get_domain
+from app.services.prices import parse_prices
+from app.services.snapshots import SnapshotArchive
+
+# Результаты повторного извлечения (ключи статистики)
+FOUND = 'found'  # Цена найдена
+NOT_FOUND = 'not_found'  # Элемента нет на снимке
+PARSE_ERROR = 'parse_error'  # Элемент найден, цена не распознана
+NO_FILE = 'no_file'  # Файл снимка удален
+WRITTEN = 'written'  # Записано цен
+
+SAMPLES = 10  # Сколько найденных цен показывать при проверке
+
+
+def extract_prices(archive: SnapshotArchive, rows: List, xpath: Optional[str] = None) -> List[Tuple]:
+    """
+    Извлекает цены из снимков. Каждый снимок распаковывается и разбирается один раз для всех его товаров.
+
+    :param archive: Архив снимков.
+    :param rows: Строки (run_id, scan_time, content_hash, product_id, url, xpath) из iter_product_snapshots.
+    :param xpath: XPath вместо XPath товаров, None - XPath товаров.
+    :return: Список (строка, результат, цена в копейках или None).
+    """
+    by_hash: Dict[str, List] = {}
+    for row in rows:
+        by_hash.setdefault(row.content_hash, []).append(row)
+
+    results = []
+    for digest, snapshot_rows in by_hash.items():
+        try:
+            page_html = archive.load(digest)
+        except FileNotFoundError:
+            results.extend((row, NO_FILE, None) for row in snapshot_rows)
+            continue
+        contents = extract_by_xpaths(page_html, {xpath or row.xpath for row in snapshot_rows})
+        texts = [contents[xpath or row.xpath] for row in snapshot_rows]
+        for row, content, price in zip(snapshot_rows, texts, parse_prices(texts)):
+            if content is None:
+                results.append((row, NOT_FOUND, None))
+            else:
+                results.append((row, FOUND if price is not None else PARSE_ERROR, price))
+    return results
+
+
+async def reextract(archive: SnapshotArchive, write: bool = False, product_ids: Optional[List[int]] = None,
+                    domain: Optional[str] = None, xpath: Optional[str] = None, since: Optional[datetime] = None,
+                    session_factory: Callable[[], AsyncSession] = async_session) -> Tuple[Counter, List[Tuple]]:
+    """
+    Извлекает цены товаров из снимков их страниц.
+
+    :param archive: Архив снимков.
+    :param write: Записать найденные цены в историю (только для запусков, где цены товара нет).
+    :param product_ids: Только эти товары, None - все товары со снимками.
+    :param domain: Только товары этого домена.
+    :param xpath: XPath вместо XPath товаров (только проверка, без записи).
+    :param since: Только снимки не раньше этого времени (UTC).
+    :param session_factory: Фабрика асинхронных сессий.
+    :return: Статистика по результатам и примеры найденных цен (товар, URL, время, цена).
+    """
+    if write and xpath:
+        raise ValueError("XPath override is only allowed without writing")
+    stats = Counter()
+    samples = []
+    async with session_factory() as session, session_factory() as write_session:
+        async for batch in iter_product_snapshots(session, product_ids, since, missing_only=write):
+            if domain:
+                batch = [row for row in batch if get_domain(row.url) == domain]
+            rows = []
+            for row, result, price in extract_prices(archive, batch, xpath):
+                stats[result] += 1
+                if result != FOUND:
+                    continue
+                if len(samples) < SAMPLES:
+                    samples.append((row.product_id, row.url, row.scan_time, price))
+                rows.append(dict(product_id=row.product_id, price=price, scan_time=row.scan_time, run_id=row.run_id))
+            if write and rows:
+                await add_price_scans(write_session, rows)
+                stats[WRITTEN] += len(rows)
+    return stats, samples
+
+
+async def prune(archive: SnapshotArchive) -> Tuple[int, int]:
+    """
+    Удаляет снимки старше срока хранения и файлы архива, на которые не ссылается ни один снимок
+    (например, после очистки БД).
+
+    :param archive: Архив снимков.
+    :return: Количество файлов, удаленных по сроку хранения и без записей о снимках.
+    """
+    async with async_session() as session:
+        expired = await archive.expire(session)
+        referenced = await get_referenced_hashes(session)
+    orphans = await asyncio.to_thread(archive.stored_hashes)
+    return expired, await asyncio.to_thread(archive.remove, orphans - referenced)
+
+
+async def main():
+    parser = argparse.ArgumentParser(prog='python -m app.services.reextract', description=__doc__.split('\n\n')[0])
+    parser.add_argument('command', choices=['check', 'backfill', 'prune'])
+    parser.add_argument('--domain', help='Только товары домена')
+    parser.add_argument('--product-id', type=int, nargs='+', help='Только эти товары')
+    parser.add_argument('--xpath', help='XPath вместо XPath товаров (только check)')
+    parser.add_argument('--since', type=datetime.fromisoformat, help='Только снимки не раньше даты (UTC)')
+    args = parser.parse_args()
+    if args.xpath and args.command != 'check':
+        parser.error('--xpath можно использовать только с check')
+
+    await create_tables()
+    archive = SnapshotArchive(Config.SNAPSHOT_PATH, Config.SNAPSHOT_RETENTION_DAYS)
+    if args.command == 'prune':
+        expired, orphans = await prune(archive)
+        print(f"Удалено файлов снимков: по сроку хранения - {expired}, без записей - {orphans}")
+        return
+    if args.command == 'backfill' and Config.PRICE_STORAGE_MODE == STORAGE_INTERVALS:
+        # Периоды цен продлеваются только по порядку времени, старые цены в них не вставить
+        print("Запись истории из снимков работает только при PRICE_STORAGE_MODE=scans")
+        return
+
+    stats, samples = await reextract(archive, write=args.command == 'backfill', product_ids=args.product_id,
+                                     domain=args.domain, xpath=args.xpath, since=args.since)
+    for product_id, url, scan_time, price in samples:
+        print(f"{product_id} {url} {scan_time:%Y-%m-%d %H:%M}: {price / 100:.2f} ₽")
+    print(f"Снимков: {sum(stats[key] for key in (FOUND, NOT_FOUND, PARSE_ERROR, NO_FILE))}, "
+          f"цена найдена: {stats[FOUND]}, элемент не найден: {stats[NOT_FOUND]}, "
+          f"цена не распознана: {stats[PARSE_ERROR]}, файл удален: {stats[NO_FILE]}")
+    if args.command == 'backfill':
+        print(f"Записано цен: {stats[WRITTEN]}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
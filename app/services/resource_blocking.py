@@ -0,0 +1,172 @@
+import json
+import logging
+from collections import Counter
+from typing import Dict, Optional
+from urllib.parse import urlsplit
+
+from playwright.async_api import Page, Route
+
+from app.core.config import Config
+
+logger = logging.getLogger(__name__)
+
+# Ресурсы, которые не нужны для поиска цены на странице
+DEFAULT_BLOCK_TYPES = ['image', 'media', 'font']
+# Аналитика и реклама
+DEFAULT_BLOCK_HOSTS = [
+    'google-analytics.com', 'googletagmanager.com', 'doubleclick.net', 'googlesyndication.com',
+    'mc.yandex.ru', 'an.yandex.ru', 'yandex.ru/ads', 'top-fwz1.mail.ru', 'vk.com/rtrg',
+    'facebook.net', 'criteo.com', 'hotjar.com', 'adriver.ru', 'mediator.media',
+]
+# Средний размер заблокированного ресурса по типу, байт. Размер отмененного запроса
+# неизвестен, поэтому сэкономленный трафик оценивается по этим значениям
+AVERAGE_SIZE = {
+    'image': 40_000, 'media': 300_000, 'font': 50_000, 'stylesheet': 20_000,
+    'script': 30_000, 'xhr': 5_000, 'fetch': 5_000, 'other': 5_000,
+}
+
+# Профиль по умолчанию подходит любому сайту: блокирует только то, что не влияет на DOM
+DEFAULT_PROFILE = dict(block_types=DEFAULT_BLOCK_TYPES, block_hosts=DEFAULT_BLOCK_HOSTS,
+                       block_third_party=False, allow_hosts=[])
+
+
+def _host(url: str) -> str:
+    return (urlsplit(url).hostname or '').lower()
+
+
+def _matches(url: str, patterns) -> bool:
+    """
+    URL относится к одному из шаблонов списка. Шаблон - хост (учитываются и поддомены)
+    или хост с началом пути, например yandex.ru/ads.
+    """
+    parts = urlsplit(url)
+    host = (parts.hostname or '').lower()
+    for pattern in patterns:
+        pattern_host, _, pattern_path = pattern.lower().partition('/')
+        if host != pattern_host and not host.endswith(f'.{pattern_host}'):
+            continue
+        if not pattern_path or parts.path.lstrip('/').startswith(pattern_path):
+            return True
+    return False
+
+
+def _same_site(host: str, site: str) -> bool:
+    """Хост относится к сайту: совпадает с ним или является его поддоменом"""
+    return host == site or host.endswith(f'.{site}')
+
+
+class BlockingReport:
+    """
+    Статистика блокировки ресурсов за одно сканирование
+    """
+
+    def __init__(self):
+        self.blocked = Counter()  # Заблокировано запросов по типу ресурса
+        self.allowed = 0  # Пропущено запросов
+
+    @property
+    def blocked_total(self) -> int:
+        return sum(self.blocked.values())
+
+    @property
+    def estimated_bytes_saved(self) -> int:
+        """
+        Оценка сэкономленного трафика, байт: количество заблокированных запросов каждого типа,
+        умноженное на средний размер ресурса (AVERAGE_SIZE). Запрос отменяется до ответа,
+        поэтому настоящий размер ресурса неизвестен.
+        """
+        return sum(AVERAGE_SIZE.get(kind, AVERAGE_SIZE['other']) * count for kind, count in self.blocked.items())
+
+    def summary(self) -> str:
+        return (f"Заблокировано запросов: {self.blocked_total} "
+                f"(оценка экономии трафика ≈{self.estimated_bytes_saved / 1_000_000:.1f} МБ)")
+
+
+def load_profiles(path: Optional[str]) -> Dict[str, dict]:
+    """
+    Загружает профили блокировки по доменам из JSON-файла вида
+    {"shop.ru": {"block_types": [...], "block_hosts": [...], "block_third_party": true, "allow_hosts": [...]}}.
+    Незаданные ключи берутся из профиля по умолчанию, профиль "default" заменяет профиль по умолчанию.
+
+    :param path: Путь к файлу, None - только профиль по умолчанию.
+    :return: Словарь {домен: профиль}.
+    """
+    profiles = {'default': DEFAULT_PROFILE}
+    if not path:
+        return profiles
+    try:
+        with open(path, encoding='utf-8') as f:
+            loaded = json.load(f)
+    except (OSError, ValueError) as e:
+        logger.error(f"Failed to load resource blocking profiles from {path}: {e}")
+        return profiles
+    base = dict(DEFAULT_PROFILE, **loaded.pop('default', {}))
+    profiles['default'] = base
+    for domain, profile in loaded.items():
+        profiles[domain.lower()] = dict(base, **profile)
+    return profiles
+
+
+profiles = load_profiles(Config.RESOURCE_PROFILES_FILE)
+
+
+def _profile_domain(host: str) -> Optional[str]:
+    """Домен профиля, к которому относится хост: сам хост или его родительский домен"""
+    while host:
+        if host in profiles:
+            return host
+        host = host.split('.', 1)[1] if '.' in host else ''
+    return None
+
+
+def get_profile(url: str) -> dict:
+    """Профиль блокировки для страницы: по домену или его родительскому домену, иначе по умолчанию"""
+    domain = _profile_domain(_host(url))
+    return profiles[domain] if domain else profiles['default']
+
+
+def get_site(url: str) -> str:
+    """
+    Сайт страницы, ресурсы других хостов считаются сторонними: домен профиля страницы
+    (для www.shop.msk.ru с профилем "shop.msk.ru" - shop.msk.ru со всеми поддоменами),
+    без профиля - хост страницы без www. Последние две метки хоста сайтом не считаются:
+    shop.msk.ru и other.msk.ru - разные сайты.
+    """
+    host = _host(url)
+    return _profile_domain(host) or host.removeprefix('www.')
+
+
+async def block_resources(page: Page, url: str, report: Optional[BlockingReport] = None):
+    """
+    Включает на странице перехват запросов: ресурсы, не нужные для поиска цены, отменяются.
+
+    :param page: Страница Playwright до перехода по URL.
+    :param url: URL товара, по нему выбирается профиль.
+    :param report: Статистика блокировки, куда добавляются результаты.
+    """
+    if not Config.BLOCK_RESOURCES:
+        return
+    profile = get_profile(url)
+    block_types = set(profile['block_types'])
+    site = get_site(url)
+
+    async def handle(route: Route):
+        request = route.request
+        request_url = request.url
+        block = (
+            request.resource_type in block_types
+            or _matches(request_url, profile['block_hosts'])
+            or (profile['block_third_party'] and not _same_site(_host(request_url), site)
+                and not _matches(request_url, profile['allow_hosts']))
+        )
+        # Документ страницы не блокируется никогда
+        if block and not request.is_navigation_request():
+            if report is not None:
+                report.blocked[request.resource_type] += 1
+            await route.abort()
+        else:
+            if report is not None:
+                report.allowed += 1
+            await route.continue_()
+
+    await page.route('**/*', handle)
@@ -0,0 +1,382 @@
+import os
+import time
+import uuid
+import socket
+import asyncio
+import logging
+from contextlib import suppress
+from datetime import datetime, timedelta, timezone
+from typing import Callable, Dict, List, Optional, Set, Tuple
+
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.core.config import Config
+from app.core.database import async_session
+from app.db.crud import get_scan_run, add_scan_run, STORAGE_INTERVALS
+from app.db.scan_batches import (BATCH_FAILED, FINISHED_BATCH_STATUSES, create_scan_batches, get_scan_batches,
+                                 mark_scan_batches_reported, cancel_scan_batches, count_checkpoint_statuses)
+from app.db.scan_jobs import (JOB_QUEUED, JOB_RUNNING, JOB_DONE, JOB_FAILED, JOB_CANCELLED,
+                              enqueue_scan_job, get_active_scan_job, get_last_scan_job,
+                              claim_scan_job, heartbeat_scan_job, update_scan_job, requeue_interrupted_scan_jobs,
+                              count_scan_checkpoints, delete_scan_checkpoints)
+from app.models.models import ScanJob
+from app.services.functions import get_price_and_save
+from app.services.outcomes import DESCRIPTIONS
+from app.services.telegram_sender import TelegramSender, MessagePacker, ProgressMessage, telegram_sender
+
+logger = logging.getLogger(__name__)
+
+# Описания состояний задачи для пользователя
+JOB_DESCRIPTIONS = {
+    JOB_QUEUED: 'ожидает запуска',
+    JOB_RUNNING: 'выполняется',
+    JOB_DONE: 'завершено',
+    JOB_FAILED: 'завершено с ошибкой',
+    JOB_CANCELLED: 'остановлено',
+}
+
+
+class ScanQueue:
+    """
+    Очередь задач сканирования цен с одним фоновым обработчиком.
+
+    Задачи хранятся в БД (ScanJob). Обработчик запускается в lifespan приложения и выполняет
+    задачи по одной, поэтому одновременные нажатия "Получить цены" не запускают несколько
+    сканирований: запрос присоединяется к ожидающей или выполняющейся задаче, и результаты
+    приходят всем чатам задачи. Выполняющуюся задачу можно остановить. Ход сканирования
+    показывается в одном изменяемом сообщении, результаты упаковываются в полные сообщения.
+
+    Задача, прерванная остановкой или падением приложения, при следующем запуске
+    продолжается с товаров, которые еще не были обработаны (см. ScanCheckpoint).
+
+    Несколько экземпляров приложения с общей БД делят одну очередь: задача выдается одному
+    экземпляру условным обновлением строки, выполняющий экземпляр отмечает задачу каждую треть
+    SCAN_JOB_TIMEOUT. Задачу без отметок дольше SCAN_JOB_TIMEOUT (экземпляр упал) любой экземпляр
+    возвращает в очередь. Экземпляр, у которого задачу забрали или остановили из другого
+    экземпляра, прекращает ее выполнение.
+
+    С SCAN_EXTERNAL_WORKERS приложение само не сканирует: задача делится на пакеты (ScanBatch),
+    которые выполняют отдельные процессы python -m app.worker, а очередь отправляет их результаты в чаты.
+    """
+
+    def __init__(self, sender: TelegramSender = telegram_sender,
+                 session_factory: Callable[[], AsyncSession] = async_session, name: Optional[str] = None):
+        self.name = name or f"{socket.gethostname()}:{os.getpid()}"  # Экземпляр, выполняющий задачи
+        self._sender = sender
+        self._session_factory = session_factory
+        self._wakeup = asyncio.Event()
+        self._lock = asyncio.Lock()  # Проверка активной задачи и создание новой - одна операция
+        self._worker: Optional[asyncio.Task] = None
+        self._current: Optional[asyncio.Task] = None  # Выполнение текущей задачи
+        self._current_id: Optional[int] = None
+        self._chat_ids: Set[int] = set()  # Получатели результатов текущей задачи
+        self._cancelled: Set[int] = set()  # Задачи, остановленные пользователем
+        self._lost: Set[int] = set()  # Задачи, которые больше не выполняются этим экземпляром
+        self.progress: Tuple[int, int] = (0, 0)  # (обработано, всего) для текущей задачи
+        self._resumed = 0  # Товаров, обработанных текущей задачей до перезапуска
+        self._progress_messages: Dict[int, ProgressMessage] = {}  # Сообщения о ходе текущей задачи по чатам
+
+    async def start(self):
+        """
+        Запуск фонового обработчика. Задачи, которые выполнялись при аварийной остановке,
+        возвращаются в очередь (запущенные раньше SCAN_RESUME_MAX_AGE часов назад - прерываются),
+        ожидающие задачи выполняются.
+        """
+        self._worker = asyncio.create_task(self._run())
+        self._wakeup.set()
+
+    async def _requeue_interrupted(self):
+        """Возврат в очередь задач, выполнявшихся остановившимся экземпляром"""
+        async with self._session_factory() as session:
+            requeued, failed = await requeue_interrupted_scan_jobs(
+                session, timedelta(hours=Config.SCAN_RESUME_MAX_AGE), timedelta(seconds=Config.SCAN_JOB_TIMEOUT))
+        if requeued:
+            logger.warning(f"{requeued} interrupted scan job(s) will be resumed")
+        if failed:
+            logger.warning(f"{failed} interrupted scan job(s) are too old to resume")
+
+    async def stop(self):
+        """Остановка обработчика, выполняющаяся задача прерывается"""
+        if self._worker is not None:
+            self._worker.cancel()
+            with suppress(asyncio.CancelledError):
+                await self._worker
+            self._worker = None
+
+    async def submit(self, chat_id: Optional[int] = None,
+                     product_ids: Optional[List[int]] = None) -> Tuple[ScanJob, bool]:
+        """
+        Постановка сканирования в очередь.
+
+        :param chat_id: Чат, которому отправлять результаты.
+        :param product_ids: Товары для сканирования, None - все товары.
+        :return: Задача и признак того, что она создана (False - запрос присоединен к существующей).
+        """
+        async with self._lock:
+            async with self._session_factory() as session:
+                job, created = await enqueue_scan_job(session, chat_id, product_ids)
+            if job.id == self._current_id and chat_id is not None:
+                self._chat_ids.add(chat_id)
+        self._wakeup.set()
+        return job, created
+
+    async def cancel(self) -> Optional[int]:
+        """
+        Остановка выполняющейся или ожидающей задачи.
+
+        :return: ID остановленной задачи или None, если активных задач нет.
+        """
+        async with self._lock:
+            async with self._session_factory() as session:
+                job = await get_active_scan_job(session)
+                if job is None:
+                    return None
+                if job.id == self._current_id and self._current is not None:
+                    self._cancelled.add(job.id)
+                    self._current.cancel()  # Статус запишет обработчик
+                else:
+                    await update_scan_job(session, job.id, status=JOB_CANCELLED,
+                                          finished_at=datetime.now(timezone.utc))
+                    if job.run_id and Config.PRICE_STORAGE_MODE != STORAGE_INTERVALS:
+                        await delete_scan_checkpoints(session, job.run_id)  # Прерванный запуск не продолжится
+                    if Config.SCAN_EXTERNAL_WORKERS:
+                        await cancel_scan_batches(session, job.id)
+        return job.id
+
+    async def describe(self) -> str:
+        """Состояние последней задачи для пользователя"""
+        async with self._session_factory() as session:
+            job = await get_active_scan_job(session) or await get_last_scan_job(session)
+        if job is None:
+            return "Сканирований еще не было."
+
+        text = f"Сканирование #{job.id}: {JOB_DESCRIPTIONS[job.status]}."
+        if job.id == self._current_id:
+            processed, total = self.progress
+        else:
+            processed, total = job.processed, job.total
+        if job.status != JOB_QUEUED:
+            text += f"\nОбработано товаров: {processed} из {total}."
+        if job.started_at and job.status == JOB_RUNNING:
+            minutes = (datetime.now(timezone.utc).replace(tzinfo=None) - job.started_at).total_seconds() / 60
+            text += f"\nИдет {minutes:.0f} мин."
+        if job.finished_at and job.status != JOB_RUNNING:
+            text += f"\nЗавершено: {job.finished_at:%d.%m.%Y %H:%M} UTC."
+        if job.error:
+            text += f"\n{job.error}"
+        return text
+
+    async def _run(self):
+        """
+        Цикл обработчика: ждет сигнала и выполняет задачи из очереди по одной. Без сигнала
+        раз в треть SCAN_JOB_TIMEOUT проверяет задачи, прерванные падением других экземпляров.
+        """
+        while True:
+            with suppress(asyncio.TimeoutError):
+                await asyncio.wait_for(self._wakeup.wait(), timeout=Config.SCAN_JOB_TIMEOUT / 3)
+            self._wakeup.clear()
+            try:
+                await self._requeue_interrupted()
+            except Exception as e:
+                logger.error(f"Failed to requeue interrupted scan jobs: {e}")
+            while True:
+                # Под блокировкой, чтобы присоединившийся в этот момент чат не потерялся
+                async with self._lock:
+                    try:
+                        async with self._session_factory() as session:
+                            job = await claim_scan_job(session, self.name)
+                    except Exception as e:
+                        logger.error(f"Failed to claim a scan job: {e}")
+                        break
+                    if job is None:
+                        break
+                    self._current_id = job.id
+                    self._chat_ids = set(job.chat_ids)
+                    self.progress = (0, 0)
+                    self._current = asyncio.create_task(self._execute(job))
+                heartbeat = asyncio.create_task(self._heartbeat(job.id, self._current))
+                try:
+                    await self._current
+                except asyncio.CancelledError:
+                    if job.id not in self._cancelled and job.id not in self._lost:
+                        raise  # Остановка приложения
+                except Exception as e:
+                    logger.exception(f"Scan job {job.id} failed: {e}")
+                finally:
+                    heartbeat.cancel()
+                    self._cancelled.discard(job.id)
+                    self._lost.discard(job.id)
+                    self._current = self._current_id = None
+
+    async def _heartbeat(self, job_id: int, task: asyncio.Task):
+        """
+        Отметки о выполнении задачи каждую треть SCAN_JOB_TIMEOUT. Если задача больше не принадлежит
+        экземпляру (остановлена из другого экземпляра или возвращена в очередь), ее выполнение прекращается.
+
+        :param job_id: ID задачи.
+        :param task: Выполнение задачи.
+        """
+        while True:
+            await asyncio.sleep(Config.SCAN_JOB_TIMEOUT / 3)
+            try:
+                async with self._session_factory() as session:
+                    owned = await heartbeat_scan_job(session, job_id, self.name)
+            except Exception as e:
+                logger.error(f"Failed to update heartbeat of scan job {job_id}: {e}")
+                continue
+            if not owned:
+                logger.warning(f"Scan job {job_id} is no longer owned by {self.name}, stopping it")
+                self._lost.add(job_id)
+                task.cancel()
+                return
+
+    @property
+    def busy(self) -> bool:
+        """Выполняется ли сейчас задача"""
+        return self._current is not None
+
+    def _on_progress(self, processed: int, total: int):
+        self.progress = (self._resumed + processed, self._resumed + total)
+
+    async def _execute(self, job: ScanJob):
+        """Выполнение задачи с отправкой сообщений сканирования в чаты задачи"""
+        # У задачи, прерванной перезапуском, уже есть запуск: продолжаем его с тем же run_id и временем
+        resume = job.run_id is not None
+        run_id = job.run_id or uuid.uuid4().hex
+        scan_time = None
+        self._resumed = 0
+        self._progress_messages = {}
+        async with self._session_factory() as session:
+            if resume:
+                run = await get_scan_run(session, run_id)
+                scan_time = run.scan_time if run else None
+                self._resumed = await count_scan_checkpoints(session, run_id)
+            await update_scan_job(session, job.id, status=JOB_RUNNING, run_id=run_id,
+                                  started_at=job.started_at or datetime.now(timezone.utc))
+        if resume:
+            self._notify(f"Сканирование #{job.id} продолжается после перезапуска. "
+                         f"Уже обработано товаров: {self._resumed}.")
+        answer = None
+        packer = MessagePacker()  # Результаты товаров отправляются полными сообщениями
+        saved = time.monotonic()
+        try:
+            async with self._session_factory() as session:
+                if Config.SCAN_EXTERNAL_WORKERS:
+                    results = self._worker_results(job, run_id, scan_time)
+                else:
+                    results = get_price_and_save(session, run_id=run_id, progress=self._on_progress,
+                                                 product_ids=job.product_ids, scan_time=scan_time, resume=resume,
+                                                 session_factory=self._session_factory)
+                async for answer in results:
+                    for text in packer.add(answer):
+                        self._notify(text)
+                    await self._report_progress(job.id, JOB_RUNNING)
+                    if time.monotonic() - saved >= Config.TG_PROGRESS_INTERVAL:
+                        processed, total = self.progress
+                        await update_scan_job(session, job.id, processed=processed, total=total)
+                        saved = time.monotonic()
+            status, error = JOB_DONE, None
+        except asyncio.CancelledError:
+            for text in packer.flush():
+                self._notify(text)
+            if job.id in self._lost:
+                raise  # Задачей распоряжается другой экземпляр, итог записывать нельзя
+            # Остановленная пользователем задача завершается, прерванная остановкой приложения -
+            # возвращается в очередь и продолжится при следующем запуске
+            status = JOB_CANCELLED if job.id in self._cancelled else JOB_QUEUED
+            # Запись итога не должна прерываться повторной отменой
+            await asyncio.shield(self._finish(job.id, run_id, status, None, answer))
+            if status == JOB_CANCELLED:
+                await asyncio.shield(self._report_progress(job.id, status, force=True))
+            raise
+        except Exception as e:
+            status, error = JOB_FAILED, str(e)
+        for text in packer.flush():
+            self._notify(text)
+        await self._report_progress(job.id, status, force=True)
+        await self._finish(job.id, run_id, status, error, answer)
+
+    async def _worker_results(self, job: ScanJob, run_id: str, scan_time: Optional[datetime]):
+        """
+        Выполнение задачи внешними обработчиками (python -m app.worker): товары делятся на пакеты,
+        которые обработчики берут в аренду. Результаты пакетов отдаются по мере готовности,
+        последним - итоговый отчет. Задача, продолжаемая после перезапуска, ждет уже созданные пакеты.
+
+        :param job: Задача.
+        :param run_id: Идентификатор запуска задачи.
+        :param scan_time: Время сканирования продолжаемого запуска.
+        :return: Асинхронный генератор блоков текста для пользователя.
+        """
+        async with self._session_factory() as session:
+            if not await get_scan_batches(session, job.id):
+                await add_scan_run(session, run_id, scan_time or datetime.now(timezone.utc))
+                queued = await create_scan_batches(session, job.id, run_id, job.product_ids, Config.SCAN_BATCH_SIZE)
+                await update_scan_job(session, job.id, total=self._resumed + queued)
+                total = self._resumed + queued
+            else:
+                total = job.total
+        while True:
+            async with self._session_factory() as session:
+                batches = await get_scan_batches(session, job.id)
+                ready = [batch for batch in batches if batch.status in FINISHED_BATCH_STATUSES and not batch.reported]
+                for batch in ready:
+                    if batch.result:
+                        yield batch.result
+                if ready:
+                    await mark_scan_batches_reported(session, [batch.id for batch in ready])
+                self.progress = (await count_scan_checkpoints(session, run_id), total)
+                await update_scan_job(session, job.id, processed=self.progress[0], total=total)
+                if all(batch.status in FINISHED_BATCH_STATUSES for batch in batches):
+                    statuses = await count_checkpoint_statuses(session, run_id)
+                    break
+            await self._report_progress(job.id, JOB_RUNNING)
+            await asyncio.sleep(Config.SCAN_POLL_INTERVAL)
+
+        answer = "\nКонец списка."
+        answer += f"\nПакетов: {len(batches)}"
+        failed = [batch for batch in batches if batch.status == BATCH_FAILED]
+        if failed:
+            answer += f", не обработано: {len(failed)} ({failed[0].error})"
+        if statuses:
+            answer += "\n" + ", ".join(f"{DESCRIPTIONS[status]}: {count}" for status, count in statuses.items())
+        yield answer
+
+    async def _finish(self, job_id: int, run_id: str, status: str, error: Optional[str], summary: Optional[str]):
+        processed, total = self.progress
+        async with self._session_factory() as session:
+            if status == JOB_QUEUED:
+                await update_scan_job(session, job_id, status=status, owner=None, heartbeat_at=None,
+                                      processed=processed, total=total)
+                return
+            if Config.SCAN_EXTERNAL_WORKERS:
+                await cancel_scan_batches(session, job_id)  # Обработчики остановят отмененные пакеты
+            await update_scan_job(session, job_id, status=status, error=error, summary=summary,
+                                  processed=processed, total=total, finished_at=datetime.now(timezone.utc))
+            # При хранении периодами отметки - единственная запись о том, какие запуски сканировали товар
+            if Config.PRICE_STORAGE_MODE != STORAGE_INTERVALS:
+                await delete_scan_checkpoints(session, run_id)
+
+    def _notify(self, text: str):
+        """Постановка сообщения в очередь отправки всем чатам текущей задачи"""
+        for chat_id in self._chat_ids:
+            self._sender.send(chat_id, text, parse_mode="Markdown", disable_web_page_preview=True)
+
+    async def _report_progress(self, job_id: int, status: str, force: bool = False):
+        """
+        Обновление сообщения о ходе задачи в чатах задачи (не чаще TG_PROGRESS_INTERVAL секунд).
+
+        :param job_id: ID задачи.
+        :param status: Состояние задачи.
+        :param force: Обновить без учета интервала (итоговое состояние).
+        """
+        processed, total = self.progress
+        text = f"Сканирование #{job_id}: {JOB_DESCRIPTIONS[status]}. Обработано товаров: {processed} из {total}."
+        for chat_id in list(self._chat_ids):
+            if chat_id not in self._progress_messages:
+                self._progress_messages[chat_id] = ProgressMessage(self._sender, chat_id,
+                                                                   Config.TG_PROGRESS_INTERVAL)
+            await self._progress_messages[chat_id].update(text, force)
+
+
+# Общая очередь приложения, обработчик запускается и останавливается в lifespan
+scan_queue = ScanQueue()
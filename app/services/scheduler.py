@@ -0,0 +1,86 @@
+import asyncio
+import logging
+from contextlib import suppress
+from datetime import datetime, timezone
+from typing import Callable, Optional
+
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.core.config import Config
+from app.core.database import async_session
+from app.db.schedule import schedule_new_products, get_due_product_ids, get_scheduled_load
+from app.services.scan_queue import ScanQueue, scan_queue
+
+logger = logging.getLogger(__name__)
+
+
+class ScanScheduler:
+    """
+    Сканирование цен по расписанию.
+
+    У каждого товара есть время следующего сканирования. Раз в `tick` секунд товары,
+    время которых наступило, ставятся в очередь сканирования одной задачей. Нагрузка
+    ограничена: за проверку в очередь попадает не больше `max_per_hour * tick / 3600` товаров,
+    остальные ждут следующей проверки (самые просроченные первыми). Пока выполняется
+    другое сканирование, новые задачи не создаются.
+    """
+
+    def __init__(self, queue: ScanQueue, tick: float = 300, max_per_hour: int = 600,
+                 session_factory: Callable[[], AsyncSession] = async_session):
+        self.queue = queue
+        self.tick = tick
+        self.max_per_hour = max_per_hour
+        self._session_factory = session_factory
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def batch_limit(self) -> int:
+        """Максимум товаров, ставящихся в очередь за одну проверку"""
+        return max(1, int(self.max_per_hour * self.tick / 3600))
+
+    async def start(self):
+        """Запуск проверки расписания"""
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Остановка проверки расписания"""
+        if self._task is not None:
+            self._task.cancel()
+            with suppress(asyncio.CancelledError):
+                await self._task
+            self._task = None
+
+    async def run_once(self) -> int:
+        """
+        Одна проверка расписания.
+
+        :return: Количество товаров, поставленных в очередь.
+        """
+        if self.queue.busy:
+            return 0
+        now = datetime.now(timezone.utc).replace(tzinfo=None)
+        async with self._session_factory() as session:
+            if await schedule_new_products(session, now):
+                load = await get_scheduled_load(session)
+                if load > self.max_per_hour:
+                    logger.warning(f"Scheduled load {load:.0f} products/hour exceeds the cap of "
+                                   f"{self.max_per_hour}, scans will be delayed")
+            product_ids = await get_due_product_ids(session, now, self.batch_limit)
+        if product_ids:
+            await self.queue.submit(product_ids=product_ids)
+        return len(product_ids)
+
+    async def _run(self):
+        while True:
+            try:
+                queued = await self.run_once()
+                if queued:
+                    logger.info(f"Scheduled scan of {queued} products")
+            except Exception as e:
+                logger.error(f"Scan scheduler failed: {e}")
+            await asyncio.sleep(self.tick)
+
+
+# Общий планировщик приложения, запускается и останавливается в lifespan
+scan_scheduler = ScanScheduler(scan_queue, tick=Config.SCHEDULE_TICK, max_per_hour=Config.SCHEDULE_MAX_PER_HOUR)
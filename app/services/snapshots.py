@@ -0,0 +1,167 @@
+import os
+import gzip
+import asyncio
+import logging
+from datetime import datetime, timedelta, timezone
+from typing import Callable, Dict, Iterable, Optional
+
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.core.config import Config
+from app.core.database import async_session
+from app.db.snapshots import add_page_snapshots, expire_page_snapshots
+from app.services.page_cache import content_hash
+
+logger = logging.getLogger(__name__)
+
+SUFFIX = '.html.gz'
+
+
+class SnapshotArchive:
+    """
+    Архив снимков страниц на диске. Файл снимка называется хэшем содержимого
+    (<каталог>/<первые 2 символа хэша>/<хэш>.html.gz), поэтому страница, не менявшаяся
+    между сканированиями, хранится один раз. Какие страницы и когда сняты, записано в page_snapshots.
+    """
+
+    def __init__(self, path: str, retention_days: float = 30):
+        self.path = path
+        self.retention_days = retention_days
+
+    def file_path(self, digest: str) -> str:
+        return os.path.join(self.path, digest[:2], digest + SUFFIX)
+
+    def has(self, digest: str) -> bool:
+        return os.path.exists(self.file_path(digest))
+
+    def _write(self, digest: str, content: bytes):
+        path = self.file_path(digest)
+        if os.path.exists(path):
+            return
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temp_path = f"{path}.{os.getpid()}.tmp"
+        with open(temp_path, 'wb') as file:
+            file.write(gzip.compress(content, compresslevel=6))
+        os.replace(temp_path, path)  # Другой процесс не прочитает недописанный файл
+
+    async def store(self, content: bytes) -> str:
+        """
+        Сохраняет сжатый HTML, если такого содержимого в архиве еще нет.
+
+        :param content: HTML страницы.
+        :return: Хэш содержимого.
+        """
+        digest = content_hash(content)
+        await asyncio.to_thread(self._write, digest, content)
+        return digest
+
+    def load(self, digest: str) -> bytes:
+        """
+        Читает HTML снимка.
+
+        :param digest: Хэш содержимого.
+        :return: HTML страницы.
+        """
+        with open(self.file_path(digest), 'rb') as file:
+            return gzip.decompress(file.read())
+
+    def remove(self, digests: Iterable[str]) -> int:
+        """Удаляет файлы снимков, возвращает количество удаленных"""
+        removed = 0
+        for digest in digests:
+            try:
+                os.remove(self.file_path(digest))
+                removed += 1
+            except FileNotFoundError:
+                pass
+        return removed
+
+    def stored_hashes(self) -> set:
+        """Хэши всех файлов архива"""
+        hashes = set()
+        if not os.path.isdir(self.path):
+            return hashes
+        for directory in os.scandir(self.path):
+            if directory.is_dir():
+                hashes.update(entry.name[:-len(SUFFIX)] for entry in os.scandir(directory.path)
+                              if entry.name.endswith(SUFFIX))
+        return hashes
+
+    async def expire(self, session: AsyncSession) -> int:
+        """
+        Удаляет снимки старше срока хранения и файлы, на которые они ссылались одни.
+
+        :param session: Асинхронная сессия для взаимодействия с базой данных.
+        :return: Количество удаленных файлов.
+        """
+        before = datetime.now(timezone.utc) - timedelta(days=self.retention_days)
+        orphans = await expire_page_snapshots(session, before)
+        return await asyncio.to_thread(self.remove, orphans)
+
+
+class SnapshotRecorder:
+    """
+    Снимки страниц одного запуска сканирования. HTML сразу сохраняется в архив, записи
+    page_snapshots копятся и записываются пакетами. При закрытии (close) остаток записывается,
+    а снимки старше срока хранения удаляются.
+    """
+
+    def __init__(self, archive: SnapshotArchive, run_id: str, scan_time: datetime,
+                 batch_size: int = Config.SCAN_WRITE_BATCH,
+                 session_factory: Callable[[], AsyncSession] = async_session):
+        self.archive = archive
+        self.run_id = run_id
+        self.scan_time = scan_time
+        self.batch_size = batch_size
+        self._session_factory = session_factory
+        self._rows: Dict[str, dict] = {}  # {URL: снимок}, повторный снимок страницы заменяет прежний
+        self._lock = asyncio.Lock()
+        self.recorded = 0  # Всего снимков запуска
+
+    async def close(self):
+        """Записывает оставшиеся снимки и удаляет устаревшие. Ошибки не прерывают сканирование"""
+        try:
+            await self.flush()
+            async with self._session_factory() as session:
+                await self.archive.expire(session)
+        except Exception as e:
+            logger.error(f"Page snapshots were not saved: {e}")
+
+    async def add(self, url: str, tier: str, content: Optional[bytes] = None, digest: Optional[str] = None):
+        """
+        Добавляет снимок страницы.
+
+        :param url: URL страницы.
+        :param tier: Уровень извлечения (http или browser).
+        :param content: HTML страницы.
+        :param digest: Хэш уже сохраненного содержимого (страница не изменилась, сайт ответил 304).
+        """
+        try:
+            if content is not None:
+                digest = await self.archive.store(content)
+            elif digest is None or not self.archive.has(digest):
+                return
+        except OSError as e:
+            logger.error(f"Failed to store snapshot of {url}: {e}")
+            return
+        self._rows[url] = dict(run_id=self.run_id, url=url, content_hash=digest, scan_time=self.scan_time, tier=tier)
+        if len(self._rows) >= self.batch_size:
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.error(f"Page snapshots were not saved: {e}")  # Снимки не важнее сканирования
+
+    async def flush(self):
+        """Записывает накопленные снимки"""
+        async with self._lock:
+            if not self._rows:
+                return
+            rows, self._rows = list(self._rows.values()), {}
+            async with self._session_factory() as session:
+                await add_page_snapshots(session, rows)
+            self.recorded += len(rows)
+
+
+# Архив снимков приложения, None - снимки не сохраняются
+snapshot_archive = SnapshotArchive(Config.SNAPSHOT_PATH, Config.SNAPSHOT_RETENTION_DAYS) \
+    if Config.SNAPSHOTS_ENABLED else None
@@ -0,0 +1,383 @@
+import time
+import random
+import asyncio
+import logging
+from collections import Counter, deque
+from contextlib import suppress
+from itertools import islice
+from typing import Deque, Dict, Iterable, List, Optional
+
+from aiogram import Bot
+from aiogram.types import Message
+from aiogram.exceptions import (TelegramRetryAfter, TelegramNetworkError, TelegramServerError,
+                                TelegramBadRequest, TelegramAPIError)
+
+from app.core.config import Config
+from app.services.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+MESSAGE_LIMIT = 4096  # Максимальная длина сообщения Telegram
+
+# Виды исходящих запросов
+SEND = 'send'
+EDIT = 'edit'
+
+
+def _cut_position(line: str, limit: int) -> int:
+    """
+    Позиция разреза строки длиннее limit: после последнего пробела вне разметки Markdown
+    (*жирный*, _курсив_, `код`, [ссылка](url)), чтобы обе части остались корректной разметкой.
+    Если такого пробела нет - limit.
+    """
+    cut = 0
+    closing = None  # Символ, закрывающий открытый элемент разметки
+    for i, char in enumerate(line[:limit]):
+        if closing is None:
+            if char == ' ':
+                cut = i + 1
+            elif char in '*_`':
+                closing = char
+            elif char == '[':
+                closing = ']'
+        elif char == closing:
+            closing = ')' if char == ']' and line[i + 1:i + 2] == '(' else None
+    return cut or limit
+
+
+def split_text(text: str, limit: int = MESSAGE_LIMIT) -> List[str]:
+    """
+    Делит текст на части не длиннее limit по границам строк. Строка длиннее limit делится
+    по пробелу вне разметки Markdown (см. _cut_position), а если его нет - по символам.
+
+    :param text: Текст.
+    :param limit: Максимальная длина части.
+    :return: Список частей.
+    """
+    if len(text) <= limit:
+        return [text]
+    pieces, current = [], ''
+    for line in text.splitlines(keepends=True):
+        while len(line) > limit:
+            if current:
+                pieces.append(current)
+                current = ''
+            cut = _cut_position(line, limit)
+            pieces.append(line[:cut])
+            line = line[cut:]
+        if len(current) + len(line) > limit:
+            pieces.append(current)
+            current = ''
+        current += line
+    if current:
+        pieces.append(current)
+    return pieces
+
+
+class MessagePacker:
+    """
+    Упаковка текстовых блоков в минимальное количество сообщений: блоки добавляются
+    в текущее сообщение, пока оно не заполнится. Блок не разрезается, если помещается в сообщение
+    """
+
+    def __init__(self, limit: int = MESSAGE_LIMIT):
+        self.limit = limit
+        self._parts: List[str] = []
+        self._size = 0
+
+    def add(self, text: str) -> List[str]:
+        """
+        Добавляет блок текста.
+
+        :param text: Блок текста.
+        :return: Заполненные сообщения, готовые к отправке (обычно пустой список).
+        """
+        ready = []
+        for piece in split_text(text, self.limit):
+            if self._parts and self._size + len(piece) > self.limit:
+                ready.append(''.join(self._parts))
+                self._parts, self._size = [], 0
+            self._parts.append(piece)
+            self._size += len(piece)
+        return ready
+
+    def flush(self) -> List[str]:
+        """Остаток текста одним сообщением (пустой список, если добавлять было нечего)"""
+        if not self._parts:
+            return []
+        message = ''.join(self._parts)
+        self._parts, self._size = [], 0
+        return [message]
+
+
+def pack_messages(parts: Iterable[str], limit: int = MESSAGE_LIMIT) -> List[str]:
+    """Упаковывает блоки текста в минимальное количество сообщений"""
+    packer = MessagePacker(limit)
+    messages = []
+    for part in parts:
+        messages.extend(packer.add(part))
+    return messages + packer.flush()
+
+
+class TokenBucket:
+    """
+    Ограничитель частоты: `rate` операций в секунду с запасом до `capacity` операций подряд.
+    Может быть приостановлен, например, по ответу Telegram "retry after".
+    """
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+
+    def pause(self, seconds: float):
+        """Запрет операций на seconds секунд"""
+        self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+
+    async def acquire(self):
+        """Ожидание разрешения на одну операцию"""
+        while True:
+            now = time.monotonic()
+            if now < self._paused_until:
+                await asyncio.sleep(self._paused_until - now)
+                continue
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return
+            await asyncio.sleep((1 - self._tokens) / self.rate)
+
+
+class OutgoingRequest:
+    """Исходящий запрос в очереди чата"""
+
+    def __init__(self, kind: str, chat_id: int, text: str, kwargs: dict, message_id: Optional[int] = None):
+        self.kind = kind
+        self.chat_id = chat_id
+        self.text = text
+        self.kwargs = kwargs
+        self.message_id = message_id
+        self.future: asyncio.Future = asyncio.get_running_loop().create_future()
+
+
+class TelegramSender:
+    """
+    Очередь исходящих сообщений бота с учетом лимитов Telegram.
+
+    У каждого чата своя очередь, сообщения чата отправляются по порядку. Частота ограничена
+    общим лимитом бота и лимитом на чат (token bucket). На ответ "retry after" чат и общая
+    отправка приостанавливаются на указанное время и запрос повторяется, сетевые ошибки и ошибки
+    сервера повторяются с нарастающей задержкой, поэтому сообщения не теряются. Сообщение,
+    разметку которого Telegram отклонил, отправляется простым текстом.
+    Отправка не блокирует вызывающего: методы возвращают Future с результатом.
+    """
+
+    def __init__(self, global_rate: float = 25, chat_rate: float = 1, chat_burst: float = 3, retries: int = 5):
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.retries = retries
+        self._bot: Optional[Bot] = None
+        self._global = TokenBucket(global_rate, global_rate)
+        self._buckets: Dict[int, TokenBucket] = {}
+        self._queues: Dict[int, Deque[OutgoingRequest]] = {}
+        self._workers: Dict[int, asyncio.Task] = {}
+        self.stats = Counter()  # sent, edited, retried, failed
+
+    def start(self, bot: Bot):
+        """
+        Подключение бота, через которого отправляются сообщения.
+
+        :param bot: Бот.
+        """
+        self._bot = bot
+
+    @property
+    def queued(self) -> int:
+        """Сообщений в очередях отправки"""
+        return sum(len(queue) for queue in self._queues.values())
+
+    async def stop(self, timeout: float = 5.0):
+        """
+        Отправка оставшихся сообщений (не дольше timeout секунд) и остановка.
+
+        :param timeout: Сколько секунд ждать отправки очереди.
+        """
+        workers = list(self._workers.values())
+        if workers:
+            await asyncio.wait(workers, timeout=timeout)
+        for task in self._workers.values():
+            task.cancel()
+        for task in list(self._workers.values()):
+            with suppress(asyncio.CancelledError):
+                await task
+
+    def send(self, chat_id: int, text: str, **kwargs) -> asyncio.Future:
+        """
+        Ставит сообщение в очередь чата.
+
+        :param chat_id: ID чата.
+        :param text: Текст сообщения (не длиннее MESSAGE_LIMIT).
+        :param kwargs: Параметры bot.send_message (parse_mode и т.п.).
+        :return: Future с отправленным Message или None, если отправить не удалось.
+        """
+        return self._enqueue(OutgoingRequest(SEND, chat_id, text, kwargs))
+
+    def send_many(self, chat_id: int, parts: Iterable[str], **kwargs) -> List[asyncio.Future]:
+        """
+        Упаковывает блоки текста в минимальное количество сообщений и ставит их в очередь чата.
+
+        :param chat_id: ID чата.
+        :param parts: Блоки текста.
+        :param kwargs: Параметры bot.send_message.
+        :return: Список Future отправляемых сообщений.
+        """
+        return [self.send(chat_id, text, **kwargs) for text in pack_messages(parts)]
+
+    def edit(self, chat_id: int, message_id: int, text: str, **kwargs) -> asyncio.Future:
+        """
+        Ставит изменение текста сообщения в очередь чата. Если изменение того же сообщения
+        еще ждет отправки, оно заменяется новым текстом.
+
+        :param chat_id: ID чата.
+        :param message_id: ID сообщения.
+        :param text: Новый текст.
+        :param kwargs: Параметры bot.edit_message_text.
+        :return: Future с результатом изменения.
+        """
+        # Первый запрос очереди может уже отправляться, его не трогаем
+        for request in islice(self._queues.get(chat_id, ()), 1, None):
+            if request.kind == EDIT and request.message_id == message_id:
+                request.text, request.kwargs = text, kwargs
+                return request.future
+        return self._enqueue(OutgoingRequest(EDIT, chat_id, text, kwargs, message_id))
+
+    def _enqueue(self, request: OutgoingRequest) -> asyncio.Future:
+        self._queues.setdefault(request.chat_id, deque()).append(request)
+        if request.chat_id not in self._workers:
+            self._workers[request.chat_id] = asyncio.create_task(self._drain(request.chat_id))
+        return request.future
+
+    async def _drain(self, chat_id: int):
+        """Отправка очереди чата по порядку, обработчик завершается, когда очередь пуста"""
+        queue = self._queues[chat_id]
+        try:
+            while queue:
+                request = queue[0]
+                result = await self._deliver(request)
+                queue.popleft()
+                if not request.future.done():
+                    request.future.set_result(result)
+        finally:
+            del self._workers[chat_id]
+            if not queue:
+                del self._queues[chat_id]
+            else:
+                # Остановка: ожидающие не должны зависнуть
+                for request in queue:
+                    if not request.future.done():
+                        request.future.set_result(None)
+                queue.clear()
+                del self._queues[chat_id]
+
+    async def _deliver(self, request: OutgoingRequest):
+        """Отправка одного запроса с соблюдением лимитов и повторами"""
+        bucket = self._buckets.setdefault(request.chat_id, TokenBucket(self.chat_rate, self.chat_burst))
+        for attempt in range(self.retries + 1):
+            await bucket.acquire()
+            await self._global.acquire()
+            try:
+                if request.kind == SEND:
+                    result = await self._bot.send_message(request.chat_id, request.text, **request.kwargs)
+                    self.stats['sent'] += 1
+                else:
+                    result = await self._bot.edit_message_text(request.text, chat_id=request.chat_id,
+                                                               message_id=request.message_id, **request.kwargs)
+                    self.stats['edited'] += 1
+                return result
+            except TelegramRetryAfter as e:
+                # Telegram сам говорит, сколько ждать. Лимит может быть и общим для бота,
+                # поэтому приостанавливаются и чат, и все отправки
+                bucket.pause(e.retry_after)
+                self._global.pause(e.retry_after)
+                self.stats['retried'] += 1
+            except (TelegramNetworkError, TelegramServerError) as e:
+                delay = min(30, 2 ** attempt)
+                logger.warning(f"Telegram request to chat {request.chat_id} failed: {e}, retry in {delay} s")
+                self.stats['retried'] += 1
+                await asyncio.sleep(random.uniform(delay / 2, delay))
+            except TelegramBadRequest as e:
+                if 'message is not modified' in str(e):
+                    return None  # Текст не изменился - это не ошибка
+                if request.kwargs.get('parse_mode') is not None:
+                    # Обычно это разметка, которую Telegram не разобрал: текст отправляется без нее
+                    logger.warning(f"Telegram rejected request to chat {request.chat_id}: {e}, "
+                                   f"resending without parse_mode")
+                    request.kwargs = dict(request.kwargs, parse_mode=None)
+                    self.stats['retried'] += 1
+                    continue
+                logger.error(f"Telegram rejected request to chat {request.chat_id}: {e}")
+                self.stats['failed'] += 1
+                return None
+            except TelegramAPIError as e:
+                # Бот заблокирован, чат не найден и т.п. - повтор не поможет
+                logger.error(f"Telegram request to chat {request.chat_id} failed: {e}")
+                self.stats['failed'] += 1
+                return None
+            except Exception as e:
+                logger.exception(f"Unexpected error sending to chat {request.chat_id}: {e}")
+                self.stats['failed'] += 1
+                return None
+        logger.error(f"Telegram request to chat {request.chat_id} dropped after {self.retries} retries")
+        self.stats['failed'] += 1
+        return None
+
+
+class ProgressMessage:
+    """
+    Сообщение о ходе длительной операции: отправляется один раз, дальше изменяется.
+    Изменения не чаще min_interval секунд, промежуточные состояния пропускаются.
+    """
+
+    def __init__(self, sender: TelegramSender, chat_id: int, min_interval: float = 3.0):
+        self.sender = sender
+        self.chat_id = chat_id
+        self.min_interval = min_interval
+        self._message: Optional[asyncio.Future] = None
+        self._text: Optional[str] = None
+        self._updated = 0.0
+
+    async def update(self, text: str, force: bool = False) -> bool:
+        """
+        Обновляет текст сообщения.
+
+        :param text: Новый текст.
+        :param force: Обновить, даже если с прошлого обновления прошло меньше min_interval.
+        :return: Было ли отправлено обновление.
+        """
+        if text == self._text or not force and time.monotonic() - self._updated < self.min_interval:
+            return False
+        if self._message is not None and not self._message.done() and not force:
+            return False  # Первое сообщение еще не отправлено - не ждем, обновим позже
+        self._text = text
+        self._updated = time.monotonic()
+        if self._message is None:
+            self._message = self.sender.send(self.chat_id, text)
+            return True
+        message: Optional[Message] = await self._message
+        if message is not None:
+            self.sender.edit(self.chat_id, message.message_id, text)
+        return True
+
+
+# Общая очередь сообщений приложения, бот подключается в lifespan
+telegram_sender = TelegramSender(global_rate=Config.TG_GLOBAL_RATE, chat_rate=Config.TG_CHAT_RATE,
+                                 chat_burst=Config.TG_CHAT_BURST, retries=Config.TG_SEND_RETRIES)
+
+# Счетчики очереди читаются при выдаче /metrics
+metrics.callback('counter', 'telegram_requests_total', 'Запросы к Telegram по результату', ('result',),
+                 lambda: {(result,): telegram_sender.stats[result] for result in ('sent', 'edited', 'retried', 'failed')})
+metrics.callback('gauge', 'telegram_queued_messages', 'Сообщений в очередях отправки', (),
+                 lambda: {(): telegram_sender.queued})
@@ -0,0 +1,162 @@
+import time
+import asyncio
+import logging
+from collections import deque
+from contextlib import suppress
+from typing import Callable, Deque, Dict, List, Optional, Set, Tuple, Union
+
+from aiogram import Bot, Dispatcher
+from aiogram.types import Update
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.core.config import Config
+from app.core.database import async_session
+from app.services.domain_stats import percentile
+from app.services.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+LATENCY_SAMPLES = 1000  # Сколько последних измерений задержки хранить для статистики
+
+
+def chat_key(update: Update) -> Union[int, str]:
+    """
+    Ключ очередности обновления: обновления с одним ключом обрабатываются строго по порядку.
+    Чат события, для событий без чата - пользователь, иначе само обновление.
+    """
+    try:
+        event = update.event
+    except Exception:
+        return f"update:{update.update_id}"
+    chat = getattr(event, 'chat', None) or getattr(getattr(event, 'message', None), 'chat', None)
+    if chat is not None:
+        return chat.id
+    user = getattr(event, 'from_user', None)
+    if user is not None:
+        return f"user:{user.id}"
+    return f"update:{update.update_id}"
+
+
+class UpdateDispatcher:
+    """
+    Обработка входящих обновлений бота фиксированным числом обработчиков.
+
+    Очередь ограничена `queue_size` обновлениями: при переполнении новое обновление
+    не принимается, и вебхук отвечает ошибкой, чтобы Telegram повторил доставку позже.
+    Обновления одного чата обрабатываются по порядку и не параллельно, разные чаты -
+    параллельно. Каждый обработчик получает собственную сессию БД.
+    """
+
+    def __init__(self, workers: int = 8, queue_size: int = 1000,
+                 session_factory: Callable[[], AsyncSession] = async_session):
+        self.workers = workers
+        self.queue_size = queue_size
+        self._session_factory = session_factory
+        self._dp: Optional[Dispatcher] = None
+        self._bot: Optional[Bot] = None
+        self._pending: Dict[Union[int, str], Deque[Tuple[Update, float]]] = {}  # Ожидающие обновления по чатам
+        self._ready: asyncio.Queue = asyncio.Queue()  # Чаты, обновления которых можно обрабатывать
+        self._scheduled: Set[Union[int, str]] = set()  # Чаты в _ready или в обработке
+        self._tasks: List[asyncio.Task] = []
+        self.depth = 0  # Обновлений в очереди
+        self.max_depth = 0
+        self.handled = 0
+        self.failed = 0
+        self.rejected = 0
+        self._waits: Deque[float] = deque(maxlen=LATENCY_SAMPLES)  # Ожидание в очереди, мс
+        self._durations: Deque[float] = deque(maxlen=LATENCY_SAMPLES)  # Обработка, мс
+
+    def start(self, dp: Dispatcher, bot: Bot):
+        """
+        Запуск обработчиков.
+
+        :param dp: Диспетчер aiogram.
+        :param bot: Бот.
+        """
+        self._dp, self._bot = dp, bot
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def stop(self, timeout: float = 10.0):
+        """
+        Обработка оставшихся обновлений (не дольше timeout секунд) и остановка обработчиков.
+
+        :param timeout: Сколько секунд ждать опустошения очереди.
+        """
+        deadline = time.monotonic() + timeout
+        while self._scheduled and time.monotonic() < deadline:
+            await asyncio.sleep(0.1)
+        for task in self._tasks:
+            task.cancel()
+        for task in self._tasks:
+            with suppress(asyncio.CancelledError):
+                await task
+        self._tasks = []
+
+    def submit(self, update: Update) -> bool:
+        """
+        Постановка обновления в очередь.
+
+        :param update: Обновление Telegram.
+        :return: False, если очередь переполнена и обновление не принято.
+        """
+        if self.depth >= self.queue_size:
+            self.rejected += 1
+            logger.warning(f"Update queue is full ({self.depth}), update {update.update_id} rejected")
+            return False
+        key = chat_key(update)
+        self._pending.setdefault(key, deque()).append((update, time.monotonic()))
+        self.depth += 1
+        self.max_depth = max(self.max_depth, self.depth)
+        if key not in self._scheduled:
+            self._scheduled.add(key)
+            self._ready.put_nowait(key)
+        return True
+
+    async def _worker(self):
+        while True:
+            key = await self._ready.get()
+            pending = self._pending[key]
+            update, enqueued = pending.popleft()
+            self.depth -= 1
+            started = time.monotonic()
+            self._waits.append((started - enqueued) * 1000)
+            try:
+                async with self._session_factory() as session:
+                    await self._dp.feed_update(self._bot, update, db=session)
+                self.handled += 1
+            except Exception as e:
+                self.failed += 1
+                logger.exception(f"Failed to handle update {update.update_id}: {e}")
+            finally:
+                self._durations.append((time.monotonic() - started) * 1000)
+                # Следующее обновление чата - только после завершения текущего
+                if pending:
+                    self._ready.put_nowait(key)
+                else:
+                    del self._pending[key]
+                    self._scheduled.discard(key)
+
+    def stats(self) -> dict:
+        """Статистика очереди: глубина, счетчики и задержки (p50, p95, мс)"""
+        def summary(samples):
+            if not samples:
+                return dict(p50=None, p95=None)
+            return dict(p50=round(percentile(samples, 0.5), 1), p95=round(percentile(samples, 0.95), 1))
+
+        return dict(
+            depth=self.depth, max_depth=self.max_depth, queue_size=self.queue_size,
+            workers=self.workers, busy_chats=len(self._scheduled),
+            handled=self.handled, failed=self.failed, rejected=self.rejected,
+            wait_ms=summary(self._waits), handle_ms=summary(self._durations),
+        )
+
+
+# Общий диспетчер обновлений приложения, запускается и останавливается в lifespan
+update_dispatcher = UpdateDispatcher(workers=Config.UPDATE_WORKERS, queue_size=Config.UPDATE_QUEUE_SIZE)
+
+# Счетчики диспетчера читаются при выдаче /metrics
+metrics.callback('counter', 'webhook_updates_total', 'Входящие обновления по результату обработки', ('result',),
+                 lambda: {('handled',): update_dispatcher.handled, ('failed',): update_dispatcher.failed,
+                          ('rejected',): update_dispatcher.rejected})
+metrics.callback('gauge', 'webhook_queue_depth', 'Обновлений в очереди обработки', (),
+                 lambda: {(): update_dispatcher.depth})
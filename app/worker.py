@@ -0,0 +1,158 @@
+import os
+import signal
+import socket
+import asyncio
+import logging
+from contextlib import suppress
+from typing import Callable, Optional, Tuple
+
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.core.config import Config
+from app.core.database import async_session, create_tables
+from app.db.crud import get_scan_run
+from app.db.scan_batches import (BATCH_DONE, BATCH_QUEUED, lease_scan_batch, extend_scan_batch,
+                                 finish_scan_batch)
+from app.models.models import ScanBatch
+from app.services.browser_pool import browser_pool
+from app.services.http_fetcher import http_fetcher
+from app.services.domain_stats import domain_stats
+from app.services.functions import get_price_and_save
+
+logger = logging.getLogger(__name__)
+
+
+class ScanWorker:
+    """
+    Внешний обработчик сканирования: отдельный процесс со своими браузерами, который берет
+    из БД пакеты товаров (ScanBatch), сканирует их и записывает цены так же, как приложение.
+
+    Пакет выдается в аренду на SCAN_LEASE_TIMEOUT секунд, пока пакет сканируется, аренда
+    продлевается. Если обработчик упал, аренда истекает и пакет получает другой обработчик,
+    который продолжает его с необработанных товаров (см. ScanCheckpoint). Если аренда потеряна
+    (задача остановлена пользователем), сканирование пакета прекращается. Обработчиков можно
+    запустить сколько угодно и на разных машинах, если у них общая БД (DATABASE_URL).
+    """
+
+    def __init__(self, name: Optional[str] = None, lease_timeout: float = 300, poll_interval: float = 5,
+                 max_attempts: int = 3, session_factory: Callable[[], AsyncSession] = async_session):
+        self.name = name or f"{socket.gethostname()}:{os.getpid()}"
+        self.lease_timeout = lease_timeout
+        self.poll_interval = poll_interval
+        self.max_attempts = max_attempts
+        self._session_factory = session_factory
+
+    async def run(self):
+        """Цикл обработчика: берет пакеты, пока не будет остановлен"""
+        await browser_pool.start()
+        await http_fetcher.start()
+        logger.info(f"Scan worker {self.name} started")
+        try:
+            while True:
+                async with self._session_factory() as session:
+                    batch = await lease_scan_batch(session, self.name, self.lease_timeout, self.max_attempts)
+                if batch is None:
+                    await asyncio.sleep(self.poll_interval)
+                    continue
+                try:
+                    await self.process(batch)
+                except asyncio.CancelledError:
+                    raise
+                except Exception as e:
+                    logger.exception(f"Scan batch {batch.id} failed: {e}")
+        finally:
+            await http_fetcher.stop()
+            await browser_pool.stop()
+            domain_stats.save()
+            logger.info(f"Scan worker {self.name} stopped")
+
+    async def process(self, batch: ScanBatch):
+        """
+        Сканирование пакета с продлением аренды.
+
+        :param batch: Пакет, выданный обработчику.
+        """
+        logger.info(f"Scanning batch {batch.id} of job {batch.job_id}: {len(batch.product_ids)} products, "
+                    f"attempt {batch.attempts}")
+        scan = asyncio.create_task(self._scan(batch))
+        try:
+            while True:
+                # Аренда продлевается каждую треть срока, пока пакет сканируется
+                done, _ = await asyncio.wait({scan}, timeout=self.lease_timeout / 3)
+                if done:
+                    break
+                async with self._session_factory() as session:
+                    if not await extend_scan_batch(session, batch.id, self.name, self.lease_timeout):
+                        logger.warning(f"Lease of batch {batch.id} lost, scanning stopped")
+                        return
+            result, summary = scan.result()
+        except asyncio.CancelledError:
+            # Остановка обработчика: пакет сразу возвращается в очередь, а не ждет окончания аренды
+            await self._stop(scan)
+            await asyncio.shield(self._release(batch))
+            raise
+        except Exception as e:
+            # Сканирование прервано ошибкой или аренду не продлить (нет связи с БД): пакет возвращается
+            # в очередь и выдается снова, пока не исчерпает SCAN_BATCH_ATTEMPTS выдач
+            await self._stop(scan)
+            logger.exception(f"Scan batch {batch.id} failed: {e}")
+            try:
+                await self._release(batch, error=str(e))
+            except Exception as release_error:
+                logger.error(f"Batch {batch.id} was not released, it will be leased again "
+                             f"after the lease expires: {release_error}")
+            return
+        finally:
+            await self._stop(scan)  # Сканирование не должно продолжаться после выхода из process
+        async with self._session_factory() as session:
+            finished = await finish_scan_batch(session, batch.id, self.name, BATCH_DONE, result=result)
+        if finished:
+            logger.info(f"Batch {batch.id} done. {summary.strip()}")
+        else:
+            logger.warning(f"Batch {batch.id} scanned, but its lease was lost")
+
+    async def _scan(self, batch: ScanBatch) -> Tuple[str, str]:
+        """
+        Сканирование товаров пакета в запуске его задачи.
+
+        :param batch: Пакет.
+        :return: Результаты товаров для пользователя и итоговый отчет пакета.
+        """
+        async with self._session_factory() as session:
+            run = await get_scan_run(session, batch.run_id)
+            blocks = [block async for block in get_price_and_save(
+                session, run_id=batch.run_id, product_ids=batch.product_ids,
+                scan_time=run.scan_time if run else None, resume=True, raise_errors=True,
+                session_factory=self._session_factory)]
+        return ''.join(blocks[:-1]), blocks[-1]
+
+    @staticmethod
+    async def _stop(scan: asyncio.Task):
+        """Отмена сканирования пакета с ожиданием его завершения"""
+        if not scan.done():
+            scan.cancel()
+        with suppress(asyncio.CancelledError, Exception):
+            await scan
+
+    async def _release(self, batch: ScanBatch, error: Optional[str] = None):
+        """Возврат пакета в очередь при остановке обработчика или ошибке сканирования"""
+        async with self._session_factory() as session:
+            await finish_scan_batch(session, batch.id, self.name, BATCH_QUEUED, error=error)
+
+
+async def main():
+    """Запуск из командной строки: python -m app.worker"""
+    await create_tables()
+    worker = ScanWorker(lease_timeout=Config.SCAN_LEASE_TIMEOUT, poll_interval=Config.SCAN_POLL_INTERVAL,
+                        max_attempts=Config.SCAN_BATCH_ATTEMPTS)
+    task = asyncio.create_task(worker.run())
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, task.cancel)
+    with suppress(asyncio.CancelledError):
+        await task
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(main())
@@ -0,0 +1 @@
+"""Бенчмарки парсера цен на синтетических данных, запуск: python -m benchmarks"""
@@ -0,0 +1,145 @@
+"""
+Бенчмарки сканирования, импорта и просмотра истории на локальных данных.
+
+    python -m benchmarks scan --products 2000
+    python -m benchmarks import --rows 100000
+    python -m benchmarks history --scan-rows 1000000
+    python -m benchmarks prices --strings 100000
+    python -m benchmarks all [--quick] [--json results.json]
+
+Каждый запуск работает во временном каталоге с отдельной БД SQLite, рабочая БД и файлы
+приложения не используются. `all` запускает каждый бенчмарк в отдельном процессе,
+чтобы пиковая память (RSS) относилась только к нему.
+
+Код выхода 1, если бенчмарк упал или prices распознал строки корпуса неверно (mismatches):
+корпус цен работает как регрессионная проверка.
+"""
+import os
+import sys
+import json
+import asyncio
+import logging
+import argparse
+import resource
+import tempfile
+import subprocess
+from typing import Dict, List
+
+# Размеры наборов для `all`
+FULL = dict(products=2000, rows=[10000, 100000], scan_rows=[10000, 100000, 1000000], strings=100000)
+QUICK = dict(products=300, rows=[10000], scan_rows=[10000, 100000], strings=20000)
+
+
+def peak_rss_mb() -> float:
+    """Пиковая память процесса, МБ"""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(peak / (1024 * 1024 if sys.platform == 'darwin' else 1024), 1)
+
+
+def prepare_environment(workdir: str):
+    """
+    Настройки приложения для бенчмарка. Задаются до импорта приложения: Config читается при импорте,
+    а переменные окружения важнее .env. БД и файлы - только во временном каталоге.
+    """
+    os.environ['DATABASE_URL'] = f"sqlite+aiosqlite:///{workdir}/benchmark.db"
+    os.environ['DB_NAME'] = f"{workdir}/benchmark.db"
+    os.environ['FILE_PATH'] = workdir
+    os.environ['DOMAIN_STATS_FILE'] = f"{workdir}/domain_stats.json"
+    os.environ['RESOURCE_PROFILES_FILE'] = ''
+    for name, value in dict(BOT_TOKEN='0:benchmark', APP_PORTS='8000:8000', WEBHOOK_HOST='http://localhost',
+                            WEBHOOK_PATH='/webhook', SCHEDULE_ENABLED='0',
+                            # Вежливые паузы между запросами к сайту измеряли бы только сами себя
+                            SCAN_DOMAIN_INTERVAL='0', SCAN_DOMAIN_CONCURRENCY='4').items():
+        os.environ.setdefault(name, value)
+
+
+async def run_suite(args, workdir: str) -> Dict:
+    from benchmarks import suites
+
+    if args.suite == 'scan':
+        return await suites.bench_scan(args.products, browser=not args.no_browser)
+    if args.suite == 'import':
+        return await suites.bench_import(args.rows, workdir)
+    if args.suite == 'prices':
+        return suites.bench_prices(args.strings)
+    return await suites.bench_history(args.scan_rows)
+
+
+def run_in_process(args) -> Dict:
+    """Один бенчмарк в текущем процессе"""
+    with tempfile.TemporaryDirectory(prefix='price-parser-bench-') as workdir:
+        prepare_environment(workdir)
+        result = asyncio.run(run_suite(args, workdir))
+    return dict(suite=args.suite, result=result, peak_rss_mb=peak_rss_mb())
+
+
+def run_all(args) -> List[Dict]:
+    """Все бенчмарки, каждый в отдельном процессе"""
+    sizes = QUICK if args.quick else FULL
+    commands = [['scan', '--products', str(sizes['products'])] + (['--no-browser'] if args.no_browser else [])]
+    commands += [['import', '--rows', str(rows)] for rows in sizes['rows']]
+    commands += [['history', '--scan-rows', str(rows)] for rows in sizes['scan_rows']]
+    commands += [['prices', '--strings', str(sizes['strings'])]]
+    results = []
+    for command in commands:
+        print(f"== {' '.join(command)}", file=sys.stderr, flush=True)
+        output = subprocess.run([sys.executable, '-m', 'benchmarks', *command, '--print-json'],
+                                capture_output=True, text=True)
+        try:
+            # Бенчмарк с непройденной проверкой завершается с кодом 1, но результаты выводит
+            results.append(json.loads(output.stdout.strip().splitlines()[-1]))
+        except (IndexError, ValueError):
+            print(output.stderr[-2000:], file=sys.stderr)
+            results.append(dict(suite=command[0], error=f"exit code {output.returncode}"))
+            continue
+        print_result(results[-1])
+    return results
+
+
+def failed_checks(result: Dict) -> List[str]:
+    """Непройденные проверки результата бенчмарка"""
+    if 'error' in result:
+        return [f"{result['suite']}: {result['error']}"]
+    return [f"{result['suite']}: {mismatch['raw']!r} -> {mismatch['parsed']}, ожидалось {mismatch['expected']}"
+            for mismatch in result['result'].get('mismatches', [])]
+
+
+def print_result(result: Dict):
+    print(f"\n{result['suite']}: пиковая память {result.get('peak_rss_mb')} МБ")
+    print(json.dumps(result.get('result', result), ensure_ascii=False, indent=2))
+
+
+def main():
+    parser = argparse.ArgumentParser(prog='python -m benchmarks', description=__doc__.split('\n\n')[0])
+    parser.add_argument('suite', choices=['scan', 'import', 'history', 'prices', 'all'])
+    parser.add_argument('--products', type=int, default=FULL['products'], help='Товаров для scan')
+    parser.add_argument('--rows', type=int, default=10000, help='Строк таблицы для import')
+    parser.add_argument('--scan-rows', type=int, default=100000, help='Записей истории для history')
+    parser.add_argument('--strings', type=int, default=FULL['strings'], help='Строк цен для prices')
+    parser.add_argument('--no-browser', action='store_true', help='Не запускать браузеры в scan')
+    parser.add_argument('--quick', action='store_true', help='Уменьшенные наборы для all')
+    parser.add_argument('--json', metavar='FILE', help='Сохранить результаты в файл')
+    parser.add_argument('--print-json', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING)
+
+    if args.suite == 'all':
+        results = run_all(args)
+    else:
+        results = [run_in_process(args)]
+        if args.print_json:
+            print(json.dumps(results[0], ensure_ascii=False))
+        else:
+            print_result(results[0])
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as file:
+            json.dump(results, file, ensure_ascii=False, indent=2)
+
+    failures = [failure for result in results for failure in failed_checks(result)]
+    if failures:
+        print("\nПроверки не пройдены:\n" + "\n".join(failures), file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,84 @@
+"""
+Строки цен в том виде, в каком их отдают элементы страниц магазинов, и ожидаемые цены в копейках
+(None - цены в строке нет). Используются бенчмарком prices: проверка разбора и замер скорости.
+"""
+import re
+
+NBSP = '\u00a0'  # Неразрывный пробел
+NNBSP = '\u202f'  # Узкий неразрывный пробел
+THIN = '\u2009'  # Тонкий пробел
+
+CORPUS = [
+    # Рубли, разряды пробелами
+    ("1299", 129900),
+    ("1 299 ₽", 129900),
+    (f"1{NBSP}299{NBSP}₽", 129900),
+    (f"1{NNBSP}299 ₽", 129900),
+    (f"1{THIN}299 ₽", 129900),
+    ("12 345 678 ₽", 1234567800),
+    ("  1 299 ₽\n", 129900),
+    ("1 299 руб.", 129900),
+    ("1 299 р.", 129900),
+    ("1 299р", 129900),
+    ("1 299 RUB", 129900),
+    ("₽ 1 299", 129900),
+    ("1 299.–", 129900),
+    ("1 299,-", 129900),
+    # Копейки
+    ("1 299,50 ₽", 129950),
+    ("1 299.50 руб.", 129950),
+    ("1 299,5 ₽", 129950),
+    ("0,99 ₽", 99),
+    ("1 299.00 руб.", 129900),
+    ("19.99", 1999),
+    ("0.29", 29),  # float: int(0.29 * 100) == 28
+    ("1 299,57", 129957),
+    # Разряды точками, запятыми и апострофами
+    ("1.299,00", 129900),
+    ("1.299", 129900),
+    ("1.299.000 ₽", 129900000),
+    ("1,299", 129900),
+    ("1,299.00", 129900),
+    ("$1,299.99", 129999),
+    ("1,299,000.50", 129900050),
+    ("1'299.50 CHF", 129950),
+    ("1’299", 129900),
+    ("€ 1.299,95", 129995),
+    ("1299.999", None),  # Три цифры после точки - разряды, но перед ними больше трех цифр
+    ("1.29.000", None),
+    # Диапазоны и "от"
+    ("от 1 299 ₽", 129900),
+    ("от 1299.00 до 1599.00 руб.", 129900),
+    ("1 299 – 1 599 ₽", 129900),
+    ("1 299 - 1 599 ₽", 129900),
+    ("1299—1599", 129900),
+    ("до 5 000 ₽", 500000),
+    # Скидки, количества и единицы измерения
+    ("-20% 1 299 ₽", 129900),
+    ("Скидка 15 % 999 ₽", 99900),
+    ("Цена за 1 кг: 350 ₽", 35000),
+    ("2 шт по 150 ₽", 15000),
+    ("3 x 500 ₽", 50000),
+    ("1 299 ₽/шт", 129900),
+    ("Цена: 4 590 ₽", 459000),
+    ("Цена со скидкой 2 490 ₽ 3 190 ₽", 249000),
+    ("12.05.2024 1 299 ₽", 129900),  # Дата перед ценой
+    # Не цены
+    ("", None),
+    ("Нет в наличии", None),
+    ("Цена по запросу", None),
+    ("0 ₽", None),
+    ("—", None),
+    ("-", None),
+]
+
+
+def legacy_convert_price_to_kopecks(price_str: str) -> int:
+    """Прежний разбор цены (для сравнения): только цифры и запятая, через float, не длиннее 20 символов"""
+    if not price_str or len(price_str) > 20:
+        return 0
+    cleaned_price = re.sub(r'[^0-9,]', '', price_str).replace(',', '.')
+    try:
+        return int(float(cleaned_price) * 100)
+    except ValueError:
+        return 0
@@ -0,0 +1,167 @@
+import time
+import logging
+import threading
+from collections import Counter
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from typing import List, Tuple
+
+logger = logging.getLogger(__name__)
+
+GOLDEN_RATIO = 0.6180339887498949  # Доли n * φ (mod 1) равномерно распределены, судьба товара не зависит от магазина
+
+# Виды страниц товара
+STATIC = 'static'  # Цена в HTML
+JS = 'js'  # Цена появляется после выполнения скрипта
+SLOW = 'slow'  # Цена в HTML, ответ с задержкой
+NOT_FOUND = 'not_found'  # 404
+MISSING = 'missing'  # Страница есть, элемента с ценой нет
+
+PRICE_XPATH = '//span[@class="price"]'
+
+
+def product_price(n: int) -> int:
+    """Цена товара n в копейках (детерминированная, для проверки результатов)"""
+    return 10000 + n * 37 % 900000
+
+
+def format_price(kopecks: int) -> str:
+    """Цена как на сайте: '1 234,50 ₽'"""
+    rubles, kopecks = divmod(kopecks, 100)
+    return f"{rubles:,}".replace(',', ' ') + f",{kopecks:02d} ₽"
+
+
+class ShopHandler(BaseHTTPRequestHandler):
+    """Страницы товаров /p/<n> одного магазина"""
+
+    protocol_version = 'HTTP/1.1'  # Keep-alive, как у настоящих сайтов
+
+    def do_GET(self):
+        shop: 'Shop' = self.server.shop
+        try:
+            n = int(self.path.rsplit('/', 1)[-1])
+        except ValueError:
+            n = -1
+        kind = shop.page_kind(n) if n >= 0 else NOT_FOUND
+        shop.hits[kind] += 1
+        if kind == NOT_FOUND:
+            self._reply(404, b'<html><body><h1>404</h1></body></html>')
+            return
+        if kind == SLOW:
+            time.sleep(shop.slow_ms / 1000)
+        self._reply(200, shop.render(n, kind).encode())
+
+    def _reply(self, status: int, body: bytes):
+        self.send_response(status)
+        self.send_header('Content-Type', 'text/html; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class Shop:
+    """
+    Синтетический магазин на отдельном адресе: либо цены в HTML, либо цены, отрисованные скриптом.
+    Часть товаров отвечает медленно, часть - 404, на части страниц нет элемента с ценой.
+    """
+
+    def __init__(self, host: str, js: bool, slow_share: float, not_found_share: float, missing_share: float,
+                 slow_ms: int, page_kb: int):
+        self.host = host
+        self.js = js
+        self.slow_share = slow_share
+        self.not_found_share = not_found_share
+        self.missing_share = missing_share
+        self.slow_ms = slow_ms
+        self.filler = '<p class="description">' + 'Описание товара. ' * (page_kb * 1024 // 32) + '</p>'
+        self.hits = Counter()
+        self._server = ThreadingHTTPServer((host, 0), ShopHandler)
+        self._server.daemon_threads = True
+        self._server.shop = self
+        self.port = self._server.server_address[1]
+
+    def page_kind(self, n: int) -> str:
+        """Вид страницы товара n"""
+        share = n * GOLDEN_RATIO % 1
+        if share < self.not_found_share:
+            return NOT_FOUND
+        share -= self.not_found_share
+        if share < self.missing_share:
+            return MISSING
+        share -= self.missing_share
+        if share < self.slow_share:
+            return SLOW
+        return JS if self.js else STATIC
+
+    def render(self, n: int, kind: str) -> str:
+        price = f'<span class="price">{format_price(product_price(n))}</span>'
+        if kind == MISSING:
+            card = '<div class="card"><span class="sold-out">Нет в наличии</span></div>'
+        elif self.js:
+            card = ('<div class="card" id="card"></div>'
+                    f"<script>setTimeout(function () {{ document.getElementById('card').innerHTML = "
+                    f"'{price}'; }}, 50);</script>")
+        else:
+            card = f'<div class="card">{price}</div>'
+        return (f'<html><head><title>Товар {n}</title></head><body>'
+                f'<h1>Товар {n}</h1>{card}{self.filler}</body></html>')
+
+    def url(self, n: int) -> str:
+        return f"http://{self.host}:{self.port}/p/{n}"
+
+    def start(self):
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+
+class ShopServer:
+    """
+    Набор синтетических магазинов для бенчмарка сканирования. Каждый магазин слушает свой
+    адрес 127.0.0.x (в Linux весь 127.0.0.0/8 - локальный), поэтому для парсера это разные домены
+    со своими лимитами и уровнем извлечения. Если адреса недоступны (macOS), все магазины
+    слушают 127.0.0.1 и для парсера становятся одним доменом.
+    """
+
+    def __init__(self, static_shops: int = 6, js_shops: int = 2, slow_share: float = 0.1,
+                 not_found_share: float = 0.05, missing_share: float = 0.05, slow_ms: int = 800,
+                 page_kb: int = 30):
+        options = dict(slow_share=slow_share, not_found_share=not_found_share, missing_share=missing_share,
+                       slow_ms=slow_ms, page_kb=page_kb)
+        kinds = [False] * static_shops + [True] * js_shops
+        self.shops: List[Shop] = []
+        for index, js in enumerate(kinds):
+            try:
+                self.shops.append(Shop(f"127.0.0.{index + 2}", js, **options))
+            except OSError:
+                logger.warning("Loopback aliases are not available, all shops share 127.0.0.1")
+                self.shops.append(Shop("127.0.0.1", js, **options))
+
+    def __enter__(self) -> 'ShopServer':
+        for shop in self.shops:
+            shop.start()
+        return self
+
+    def __exit__(self, *exc):
+        for shop in self.shops:
+            shop.stop()
+
+    def products(self, count: int) -> List[Tuple[str, str, str]]:
+        """
+        Товары для сканирования, распределенные по магазинам по очереди.
+
+        :param count: Количество товаров.
+        :return: Список (title, url, xpath).
+        """
+        return [(f"Товар {n}", self.shops[n % len(self.shops)].url(n), PRICE_XPATH) for n in range(count)]
+
+    def hits(self) -> Counter:
+        """Количество запросов по видам страниц"""
+        total = Counter()
+        for shop in self.shops:
+            total.update(shop.hits)
+        return total
@@ -0,0 +1,239 @@
+import csv
+import time
+import uuid
+import logging
+from collections import Counter
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List
+
+from sqlalchemy import insert
+
+from app.core.config import Config
+from app.core.database import async_session, create_tables, engine
+from app.db.crud import add_price_scans, add_scan_run, iter_product_prices
+from app.db.scan_batches import count_checkpoint_statuses
+from app.models.models import ProductInfo
+from app.services import functions
+from app.services.browser_pool import browser_pool
+from app.services.circuit_breaker import circuit_breaker
+from app.services.data_processing import FileService
+from app.services.domain_stats import percentile
+from app.services.http_fetcher import http_fetcher
+from app.services.outcomes import OK
+from app.services.prices import parse_price, parse_prices
+
+from benchmarks.price_corpus import CORPUS, legacy_convert_price_to_kopecks
+from benchmarks.shop_server import ShopServer, format_price, product_price
+
+logger = logging.getLogger(__name__)
+
+INSERT_CHUNK = 5000  # Строк в одном INSERT при подготовке данных
+HISTORY_DAYS = 180  # За сколько дней генерируется история цен
+
+
+def _latency(samples: List[float]) -> Dict[str, float]:
+    """p50 и p95 задержек, мс"""
+    if not samples:
+        return dict(p50=None, p95=None)
+    return dict(p50=round(percentile(samples, 0.5), 1), p95=round(percentile(samples, 0.95), 1))
+
+
+def _page_status(outcomes: Dict) -> str:
+    """Результат загрузки страницы: ok, если найден хотя бы один элемент, иначе результат первого"""
+    if any(outcome.ok for outcome in outcomes.values()):
+        return OK
+    return next(iter(outcomes.values())).status if outcomes else 'error'
+
+
+async def _add_products(rows: List[tuple]) -> int:
+    """Быстрая вставка товаров (title, url, xpath) без проверок импорта"""
+    async with async_session() as session:
+        for start in range(0, len(rows), INSERT_CHUNK):
+            await session.execute(insert(ProductInfo), [dict(title=title, url=url, xpath=xpath)
+                                                        for title, url, xpath in rows[start:start + INSERT_CHUNK]])
+        await session.commit()
+    return len(rows)
+
+
+async def bench_scan(products: int, browser: bool = True, **shop_options) -> Dict:
+    """
+    Полное сканирование товаров синтетических магазинов через get_price_and_save.
+
+    :param products: Количество товаров.
+    :param browser: Запускать браузеры (без них JS-страницы и промахи HTTP не сканируются).
+    :param shop_options: Параметры ShopServer (доли медленных, 404 и пустых страниц и т.д.).
+    :return: Метрики: товаров в секунду, задержки страниц по результату загрузки, результаты по видам.
+    """
+    await create_tables()
+    browser_started = False
+    if browser:
+        try:
+            await browser_pool.start()
+            browser_started = True
+        except Exception as e:
+            logger.warning(f"Browser is not available, JS pages will fail: {str(e).splitlines()[0]}")
+    if not browser_started:
+        # Без браузера промахи HTTP-уровня - ошибки соединения, магазины из-за них не отключаются
+        circuit_breaker.threshold = float('inf')
+    await http_fetcher.start()
+
+    # Задержка каждой загрузки страницы (оба уровня извлечения, с повторами внутри уровня) по результату:
+    # мгновенные ошибки не должны смешиваться с задержкой успешных страниц
+    latencies: Dict[str, List[float]] = {}
+    original = functions.get_prices_content
+
+    async def timed_prices_content(*args, **kwargs):
+        started = time.perf_counter()
+        status = 'error'
+        try:
+            outcomes = await original(*args, **kwargs)
+            status = _page_status(outcomes)
+            return outcomes
+        finally:
+            latencies.setdefault(status, []).append((time.perf_counter() - started) * 1000)
+
+    functions.get_prices_content = timed_prices_content
+    run_id = uuid.uuid4().hex
+    try:
+        with ShopServer(**shop_options) as server:
+            await _add_products(server.products(products))
+            started = time.perf_counter()
+            async with async_session() as session:
+                async for answer in functions.get_price_and_save(session, run_id=run_id):
+                    pass
+            duration = time.perf_counter() - started
+            hits = server.hits()
+    finally:
+        functions.get_prices_content = original
+        await http_fetcher.stop()
+        await browser_pool.stop()
+
+    async with async_session() as session:
+        statuses = await count_checkpoint_statuses(session, run_id)
+    return dict(
+        products=products, browser=browser_started, seconds=round(duration, 2),
+        products_per_sec=round(products / duration, 1),
+        page_latency_ms={status: dict(_latency(samples), loads=len(samples))
+                         for status, samples in sorted(latencies.items())},
+        statuses=dict(statuses), pages=dict(hits),
+        summary=answer.strip(),
+    )
+
+
+async def bench_import(rows: int, workdir: str) -> Dict:
+    """
+    Импорт таблицы товаров через FileService.import_product_data: первый импорт (все товары новые)
+    и повторный импорт того же файла (все товары существуют, названия обновляются).
+
+    :param rows: Количество строк таблицы.
+    :param workdir: Каталог для файла таблицы.
+    :return: Метрики: строк в секунду для обоих импортов.
+    """
+    await create_tables()
+    path = f"{workdir}/products.csv"
+    result = dict(rows=rows)
+    for suffix in ('', ' (новое название)'):
+        with open(path, 'w', newline='', encoding='utf-8') as file:
+            writer = csv.writer(file)
+            writer.writerow(['title', 'url', 'xpath', 'interval'])
+            writer.writerows([f"Товар {n}{suffix}", f"https://shop{n % 50}.example/p/{n}",
+                              '//span[@class="price"]', 60 if n % 10 == 0 else '']
+                             for n in range(rows))
+        started = time.perf_counter()
+        async with async_session() as session:
+            _, stats = await FileService.import_product_data(path, session)
+        duration = time.perf_counter() - started
+        result['repeat' if suffix else 'first'] = dict(seconds=round(duration, 2),
+                                                       rows_per_sec=round(rows / duration), **stats)
+    return result
+
+
+async def bench_history(scan_rows: int, products: int = 1000) -> Dict:
+    """
+    Просмотр истории цен при scan_rows записях истории: запись истории так же, как ее пишет
+    сканирование (запуск и пакет цен на каждое время сканирования), затем перебор всех страниц
+    истории, как в "Посмотреть цены", и выборка за период из дневных сводок.
+
+    :param scan_rows: Количество записей истории.
+    :param products: Количество товаров (не больше scan_rows).
+    :return: Метрики: скорость записи, время первой страницы и всего просмотра.
+    """
+    await create_tables()
+    products = min(products, scan_rows)
+    scans_per_product = scan_rows // products
+    await _add_products([(f"Товар {n}", f"https://shop{n % 50}.example/p/{n}", '//span[@class="price"]')
+                         for n in range(products)])
+    async with async_session() as session:
+        ids = [row.id for row in (await session.execute(ProductInfo.__table__.select())).all()]
+
+    # Каждый запуск сканирования - все товары в одно время, цены иногда меняются
+    now = datetime.now(timezone.utc).replace(tzinfo=None)
+    step = timedelta(days=HISTORY_DAYS) / scans_per_product
+    started = time.perf_counter()
+    async with async_session() as session:
+        for scan in range(scans_per_product):
+            scan_time = now - step * (scans_per_product - scan)
+            run_id = uuid.uuid4().hex
+            await add_scan_run(session, run_id, scan_time)
+            rows = [dict(product_id=product_id, price=product_price(product_id) + scan // 10 * 100,
+                         scan_time=scan_time, run_id=run_id) for product_id in ids]
+            for start in range(0, len(rows), INSERT_CHUNK):
+                await add_price_scans(session, rows[start:start + INSERT_CHUNK])
+    write_duration = time.perf_counter() - started
+
+    views = {}
+    # Последние цены, как в "Посмотреть цены", и период длиннее ROLLUP_MIN_DAYS - из дневных сводок
+    views_options = dict(latest=dict(scans_per_product=Config.HISTORY_SCANS_PER_PRODUCT),
+                         period=dict(date_from=now - timedelta(days=90), date_to=now + timedelta(days=1)))
+    for name, options in views_options.items():
+        started = time.perf_counter()
+        first_page = None
+        points = Counter()
+        async with async_session() as session:
+            async for page in iter_product_prices(session, page_size=Config.HISTORY_PAGE_SIZE, **options):
+                if first_page is None:
+                    first_page = time.perf_counter() - started
+                points['products'] += len(page)
+                points['points'] += sum(len(dates) for _, _, _, dates in page)
+        views[name] = dict(first_page_ms=round((first_page or 0) * 1000, 1),
+                           seconds=round(time.perf_counter() - started, 2), **points)
+
+    await engine.dispose()
+    return dict(scan_rows=scans_per_product * products, products=products,
+                write=dict(seconds=round(write_duration, 2),
+                           rows_per_sec=round(scans_per_product * products / write_duration)),
+                **views)
+
+
+def bench_prices(strings: int, unique_share: float = 0.3) -> Dict:
+    """
+    Разбор строк цен: проверка на корпусе строк магазинов и скорость на пакете, похожем на результаты
+    сканирования (часть строк повторяется - одинаковые цены у разных товаров и между запусками).
+
+    :param strings: Количество строк в пакете.
+    :param unique_share: Доля различных строк.
+    :return: Метрики: ошибки на корпусе (новый и прежний разбор), строк в секунду без кэша и с кэшем.
+    """
+    mismatches = [dict(raw=raw, expected=expected, parsed=parse_price(raw))
+                  for raw, expected in CORPUS if parse_price(raw) != expected]
+    legacy_correct = sum((legacy_convert_price_to_kopecks(raw) or None) == expected for raw, expected in CORPUS)
+
+    unique = max(1, int(strings * unique_share))
+    batch = [format_price(product_price(n % unique)) for n in range(strings)]
+    batch[::7] = [CORPUS[n % len(CORPUS)][0] for n in range(len(batch[::7]))]
+
+    def rate(func) -> int:
+        started = time.perf_counter()
+        func()
+        return round(len(batch) / (time.perf_counter() - started))
+
+    parse_price.cache_clear()
+    return dict(
+        corpus=len(CORPUS), mismatches=mismatches,
+        legacy_corpus_errors=len(CORPUS) - legacy_correct,
+        strings=strings, unique=len(set(batch)),
+        legacy_per_sec=rate(lambda: [legacy_convert_price_to_kopecks(raw) for raw in batch]),
+        uncached_per_sec=rate(lambda: [parse_price.__wrapped__(raw) for raw in batch]),
+        batch_cold_per_sec=rate(lambda: parse_prices(batch)),
+        batch_warm_per_sec=rate(lambda: parse_prices(batch)),
+    )
@@ -0,0 +1,42 @@
+import os
+import asyncio
+
+import pytest
+
+# Конфигурация читается при импорте app, поэтому окружение задается до импорта модулей приложения
+os.environ.setdefault('BOT_TOKEN', '123456:TEST')
+os.environ.setdefault('APP_PORTS', '8000:8000')
+os.environ.setdefault('WEBHOOK_HOST', 'http://localhost')
+os.environ.setdefault('WEBHOOK_PATH', '/webhook')
+os.environ.setdefault('FILE_PATH', '/tmp')
+os.environ.setdefault('DB_NAME', ':memory:')
+
+from sqlalchemy.ext.asyncio import async_sessionmaker  # noqa: E402
+
+from app.core.database import create_db_engine  # noqa: E402
+from app.db.migrations import migrate  # noqa: E402
+
+
+@pytest.fixture
+def db_url(tmp_path):
+    """URL временной БД SQLite теста"""
+    return f"sqlite+aiosqlite:///{tmp_path / 'test.db'}"
+
+
+@pytest.fixture
+def run_db(db_url):
+    """
+    Запуск асинхронной проверки на временной БД с актуальной схемой:
+    run_db(check) вызывает `await check(session_factory)` и возвращает результат.
+    """
+    def run(check):
+        async def main():
+            engine = create_db_engine(db_url)
+            try:
+                async with engine.begin() as conn:
+                    await conn.run_sync(migrate)
+                return await check(async_sessionmaker(engine, expire_on_commit=False))
+            finally:
+                await engine.dispose()
+        return asyncio.run(main())
+    return run
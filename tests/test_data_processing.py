@@ -0,0 +1,18 @@
+import pytest
+
+from app.services.data_processing import normalize_url
+
+
+@pytest.mark.parametrize('url, expected', [
+    (" HTTPS://Shop.Example:443/item?id=1#reviews ", "https://shop.example/item?id=1"),
+    ("http://shop.example:8080", "http://shop.example:8080/"),
+    ("http://[2001:DB8::1]:8080/item", "http://[2001:db8::1]:8080/item"),
+    ("https://[2001:db8::1]/item", "https://[2001:db8::1]/item"),
+    # Некорректные URL остаются как есть, а не прерывают импорт
+    ("https://shop.example:port/item ", "https://shop.example:port/item"),
+    ("https://shop.example:99999/item", "https://shop.example:99999/item"),
+    ("http://[2001:db8::1/item", "http://[2001:db8::1/item"),
+    ("не ссылка", "не ссылка"),
+])
+def test_normalize_url(url, expected):
+    assert normalize_url(url) == expected
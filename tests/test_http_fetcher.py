@@ -0,0 +1,55 @@
+import asyncio
+
+import httpx
+
+from app.services.http_fetcher import HttpFetcher
+from app.services.page_cache import PageCache, CacheReport, NOT_MODIFIED, UNCHANGED, MISS
+
+URL = "https://shop.example/item"
+XPATH = "//span[@class='price']"
+
+
+def page(price: str, token: str) -> str:
+    return (f"<html><head><meta charset='utf-8'><meta name='csrf-token' content='{token}'></head>"
+            f"<body><span class='price'>{price}</span></body></html>")
+
+
+def fetch_pages(*responses):
+    """Загружает URL по разу на каждый ответ сайта, возвращает результаты и статистику кэша"""
+    async def main():
+        pending = list(responses)
+        requests = []
+
+        def handler(request: httpx.Request) -> httpx.Response:
+            requests.append(request)
+            return pending.pop(0)
+
+        fetcher = HttpFetcher(cache=PageCache(max_size=10))
+        fetcher._client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+        report = CacheReport()
+        try:
+            results = [await fetcher.fetch_elements(URL, [XPATH], report) for _ in responses]
+        finally:
+            await fetcher.stop()
+        return results, report, requests
+    return asyncio.run(main())
+
+
+def test_page_with_new_token_and_same_price_is_unchanged():
+    results, report, _ = fetch_pages(
+        httpx.Response(200, text=page("1 299 ₽", "a1")),
+        httpx.Response(200, text=page("1 299 ₽", "b2")),
+        httpx.Response(200, text=page("1 199 ₽", "c3")),
+    )
+    assert [contents[XPATH] for _, contents in results] == ["1 299 ₽", "1 299 ₽", "1 199 ₽"]
+    assert report.hits == {MISS: 2, UNCHANGED: 1}
+
+
+def test_not_modified_page_reuses_cached_price():
+    results, report, requests = fetch_pages(
+        httpx.Response(200, text=page("1 299 ₽", "a1"), headers={'ETag': '"v1"'}),
+        httpx.Response(304),
+    )
+    assert requests[1].headers['If-None-Match'] == '"v1"'
+    assert results[1] == (304, {XPATH: "1 299 ₽"})
+    assert report.hits == {MISS: 1, NOT_MODIFIED: 1}
@@ -0,0 +1,122 @@
+import asyncio
+from datetime import date, datetime
+
+import pytest
+from sqlalchemy import insert, inspect, select, text
+from sqlalchemy.exc import IntegrityError
+
+from app.core.database import create_db_engine
+from app.db.migrations import migrate, merge_duplicate_products, MIGRATIONS, UNIQUE_PRODUCT_INDEX
+from app.models.models import (ProductInfo, PriceScan, PriceInterval, PriceRollup, ScanRun, ScanCheckpoint,
+                               SchemaMigration)
+
+DAY = date(2024, 1, 1)
+
+
+def test_merge_duplicate_products_moves_all_history(run_db):
+    first, second = datetime(2024, 1, 1, 10), datetime(2024, 1, 1, 18)
+
+    def add_duplicates(conn):
+        conn.execute(text(f"DROP INDEX {UNIQUE_PRODUCT_INDEX}"))
+        conn.execute(insert(ProductInfo), [
+            dict(id=1, title="Товар", url="https://shop.example/item", xpath="//span"),
+            dict(id=2, title="Товар", url="HTTPS://Shop.Example:443/item#price", xpath=" //span "),
+        ])
+        conn.execute(insert(ScanRun), [dict(run_id="a", scan_time=first), dict(run_id="b", scan_time=second)])
+        conn.execute(insert(PriceScan), [dict(product_id=1, price=100, scan_time=first, run_id="a"),
+                                         dict(product_id=2, price=90, scan_time=second, run_id="b")])
+        conn.execute(insert(PriceInterval), [
+            dict(product_id=1, price=100, first_seen=first, last_seen=first, scan_count=1),
+            dict(product_id=2, price=90, first_seen=second, last_seen=second, scan_count=1),
+        ])
+        conn.execute(insert(ScanCheckpoint), [dict(run_id="a", product_id=1, status='ok'),
+                                              dict(run_id="a", product_id=2, status='timeout'),
+                                              dict(run_id="b", product_id=2, status='ok')])
+        rollup = dict(period='day', period_start=DAY)
+        conn.execute(insert(PriceRollup), [
+            dict(rollup, product_id=1, min_price=100, max_price=100, first_price=100, first_time=first,
+                 last_price=100, last_time=first, scan_count=1),
+            dict(rollup, product_id=2, min_price=90, max_price=90, first_price=90, first_time=second,
+                 last_price=90, last_time=second, scan_count=1),
+        ])
+        merge_duplicate_products(conn)
+
+    async def check(session_factory):
+        async with session_factory() as session:
+            await (await session.connection()).run_sync(add_duplicates)
+            await session.commit()
+            products = (await session.execute(select(ProductInfo.id))).scalars().all()
+            scans = (await session.execute(select(PriceScan.product_id, PriceScan.price))).all()
+            intervals = (await session.execute(select(PriceInterval.product_id))).scalars().all()
+            checkpoints = (await session.execute(
+                select(ScanCheckpoint.run_id, ScanCheckpoint.product_id, ScanCheckpoint.status)
+                .order_by(ScanCheckpoint.run_id))).all()
+            rollups = (await session.execute(select(PriceRollup))).scalars().all()
+        return products, scans, intervals, checkpoints, rollups
+
+    products, scans, intervals, checkpoints, rollups = run_db(check)
+    assert products == [1]
+    assert sorted(scans) == [(1, 90), (1, 100)]
+    assert intervals == [1, 1]
+    # В запуске "a" обработаны оба товара: остается отметка оставляемой записи
+    assert checkpoints == [("a", 1, 'ok'), ("b", 1, 'ok')]
+    rollup, = rollups
+    assert (rollup.product_id, rollup.min_price, rollup.max_price) == (1, 90, 100)
+    assert (rollup.first_price, rollup.last_price, rollup.scan_count) == (100, 90, 2)
+
+
+# Схема первой версии приложения: без уникального индекса товаров и без столбцов, добавленных позже
+LEGACY_SCHEMA = [
+    """CREATE TABLE product_info (
+        id INTEGER NOT NULL PRIMARY KEY, title VARCHAR(255) NOT NULL,
+        url VARCHAR(500) NOT NULL, xpath VARCHAR(500) NOT NULL)""",
+    "CREATE INDEX ix_product_info_id ON product_info (id)",
+    """CREATE TABLE price_scans (
+        id INTEGER NOT NULL PRIMARY KEY,
+        product_id INTEGER NOT NULL REFERENCES product_info (id) ON DELETE CASCADE,
+        price INTEGER NOT NULL, scan_time DATETIME NOT NULL)""",
+    "CREATE INDEX ix_price_scans_product_id ON price_scans (product_id)",
+    """INSERT INTO product_info (id, title, url, xpath) VALUES
+        (1, 'Товар', 'https://shop.example/item', '//span'),
+        (2, 'Товар (копия)', ' HTTPS://Shop.Example/item#price', '//span '),
+        (3, 'Другой товар', 'https://shop.example/other', '//span')""",
+    """INSERT INTO price_scans (product_id, price, scan_time) VALUES
+        (1, 100, '2024-01-01 10:00:00'), (2, 90, '2024-01-02 10:00:00'), (3, 500, '2024-01-02 10:00:00')""",
+]
+
+
+def test_migrate_legacy_database_twice(db_url):
+    async def main():
+        engine = create_db_engine(db_url)
+        try:
+            async with engine.begin() as conn:
+                for statement in LEGACY_SCHEMA:
+                    await conn.execute(text(statement))
+            async with engine.begin() as conn:
+                first = await conn.run_sync(migrate)
+            async with engine.begin() as conn:
+                second = await conn.run_sync(migrate)
+                indexes = await conn.run_sync(lambda sync: inspect(sync).get_indexes("product_info"))
+                columns = await conn.run_sync(lambda sync: inspect(sync).get_columns("price_scans"))
+                applied = (await conn.execute(select(SchemaMigration.name))).scalars().all()
+                products = (await conn.execute(
+                    select(ProductInfo.id, ProductInfo.url, ProductInfo.xpath).order_by(ProductInfo.id))).all()
+                scans = (await conn.execute(
+                    select(PriceScan.product_id, PriceScan.price).order_by(PriceScan.price))).all()
+                with pytest.raises(IntegrityError):
+                    async with conn.begin_nested():
+                        await conn.execute(insert(ProductInfo), dict(title="Копия", url="https://shop.example/item",
+                                                                     xpath="//span"))
+            return first, second, indexes, columns, applied, products, scans
+        finally:
+            await engine.dispose()
+
+    first, second, indexes, columns, applied, products, scans = asyncio.run(main())
+    names = [name for name, _ in MIGRATIONS]
+    assert first == names
+    assert second == []  # Повторный запуск ничего не меняет
+    assert sorted(applied) == sorted(names)  # Каждая миграция записана один раз
+    assert any(index['name'] == UNIQUE_PRODUCT_INDEX and index['unique'] for index in indexes)
+    assert 'run_id' in {column['name'] for column in columns}
+    assert products == [(1, "https://shop.example/item", "//span"), (3, "https://shop.example/other", "//span")]
+    assert scans == [(1, 90), (1, 100), (3, 500)]
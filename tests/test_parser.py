@@ -0,0 +1,75 @@
+import asyncio
+
+import pytest
+
+from app.services import parser
+from app.services.domain_stats import DomainStats, SELECTOR
+from app.services.outcomes import OK, NETWORK_ERROR, TIMEOUT, TRANSIENT
+
+
+class Locator:
+    def __init__(self, text):
+        self.first = self
+        self.text = text
+
+    async def text_content(self):
+        return self.text
+
+
+class Page:
+    """Страница браузера: evaluate возвращает или выбрасывает очередной результат из results"""
+
+    def __init__(self, *results, text="1 299 ₽"):
+        self.results = list(results)
+        self.text = text
+        self.evaluated = 0
+        self.loads = 0
+
+    async def evaluate(self, script, args):
+        self.evaluated += 1
+        result = self.results.pop(0) if len(self.results) > 1 else self.results[0]
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+    async def wait_for_load_state(self, state, timeout):
+        self.loads += 1
+
+    def locator(self, selector):
+        return Locator(self.text)
+
+
+@pytest.fixture
+def stats(monkeypatch):
+    stats = DomainStats()
+    monkeypatch.setattr(parser, 'domain_stats', stats)
+    return stats
+
+
+def navigated():
+    return Exception("Execution context was destroyed, most likely because of a navigation")
+
+
+def test_wait_is_repeated_after_script_redirect(stats):
+    page = Page(navigated(), 'found')
+    outcome = asyncio.run(parser._selector_text(page, 'shop.example', '//span'))
+    assert outcome.status == OK and outcome.content == "1 299 ₽"
+    assert page.evaluated == 2 and page.loads == 1
+
+
+def test_endless_redirects_are_transient(stats):
+    page = Page(navigated())
+    outcome = asyncio.run(parser._selector_text(page, 'shop.example', '//span'))
+    assert outcome.status == NETWORK_ERROR and outcome.status in TRANSIENT
+    assert page.evaluated == parser.NAVIGATED_RETRIES + 1
+
+
+def test_timeouts_raise_domain_timeout(stats):
+    for _ in range(10):
+        stats.record('shop.example', SELECTOR, 100)
+    low = stats.timeout('shop.example', SELECTOR)
+    for _ in range(5):
+        outcome = asyncio.run(parser._selector_text(Page('timeout'), 'shop.example', '//span'))
+        assert outcome.status == TIMEOUT
+    # Ожидание, прерванное таймаутом, учитывается значением таймаута, и таймаут домена растет
+    assert stats.timeout('shop.example', SELECTOR) > low
@@ -0,0 +1,99 @@
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import select
+
+from app.core.config import Config
+from app.db.crud import add_price_scans, add_scan_run, price_points, STORAGE_INTERVALS
+from app.models.models import ProductInfo, PriceInterval
+
+START = datetime(2024, 1, 1, 12, 0)
+
+
+@pytest.fixture(autouse=True)
+def intervals_mode(monkeypatch):
+    monkeypatch.setattr(Config, 'PRICE_STORAGE_MODE', STORAGE_INTERVALS)
+
+
+async def add_products(session_factory, count: int = 2):
+    async with session_factory() as session:
+        session.add_all(ProductInfo(title=f"Товар {i}", url=f"https://shop.example/{i}", xpath="//span")
+                        for i in range(count))
+        await session.commit()
+
+
+async def scan(session_factory, run_id: str, scan_time: datetime, prices: dict):
+    """Запуск сканирования: цены {product_id: price} и отметки об обработке, как их пишет PriceScanWriter"""
+    async with session_factory() as session:
+        await add_scan_run(session, run_id, scan_time)
+        rows = [dict(product_id=product_id, price=price, scan_time=scan_time, run_id=run_id)
+                for product_id, price in prices.items()]
+        checkpoints = [dict(run_id=run_id, product_id=product_id, status='ok') for product_id in prices]
+        await add_price_scans(session, rows, checkpoints)
+
+
+async def history(session_factory, product_id: int):
+    points = price_points()
+    async with session_factory() as session:
+        result = await session.execute(
+            select(points.c.scan_time, points.c.price)
+            .where(points.c.product_id == product_id).order_by(points.c.scan_time))
+        return [(scan_time, price) for scan_time, price in result.all()]
+
+
+async def intervals(session_factory, product_id: int):
+    async with session_factory() as session:
+        result = await session.execute(
+            select(PriceInterval.first_seen, PriceInterval.last_seen, PriceInterval.price, PriceInterval.scan_count)
+            .where(PriceInterval.product_id == product_id).order_by(PriceInterval.first_seen))
+        return result.all()
+
+
+def test_history_keeps_every_run_that_scanned_product(run_db):
+    async def check(session_factory):
+        await add_products(session_factory)
+        times = [START + timedelta(hours=hour) for hour in range(5)]
+        for i, scan_time in enumerate(times):
+            # Второй товар сканируется только в четных запусках
+            prices = {1: 100 if i < 3 else 120}
+            if i % 2 == 0:
+                prices[2] = 500
+            await scan(session_factory, f"run{i}", scan_time, prices)
+
+        assert await history(session_factory, 1) == [(t, 100 if i < 3 else 120) for i, t in enumerate(times)]
+        # Запуски, не сканировавшие товар, в его историю не попадают
+        assert await history(session_factory, 2) == [(times[0], 500), (times[2], 500), (times[4], 500)]
+    run_db(check)
+
+
+def test_late_result_does_not_move_interval_back(run_db):
+    async def check(session_factory):
+        await add_products(session_factory)
+        await scan(session_factory, "old", START, {1: 100})
+        await scan(session_factory, "new", START + timedelta(hours=2), {1: 100})
+        # Продолженный запуск пишет результат со своим прежним временем
+        async with session_factory() as session:
+            rows = [dict(product_id=1, price=100, scan_time=START + timedelta(hours=1), run_id="resumed")]
+            await add_price_scans(session, rows)
+        assert await intervals(session_factory, 1) == [(START, START + timedelta(hours=2), 100, 3)]
+    run_db(check)
+
+
+def test_late_result_with_other_price_does_not_overlap(run_db):
+    async def check(session_factory):
+        await add_products(session_factory)
+        late = START + timedelta(hours=1)
+        await scan(session_factory, "old", START, {1: 100})
+        await scan(session_factory, "new", START + timedelta(hours=2), {1: 100})
+        await scan(session_factory, "resumed", late, {1: 90})
+        # Последний период остается последним и продлевается следующим запуском
+        await scan(session_factory, "next", START + timedelta(hours=3), {1: 100})
+
+        assert await intervals(session_factory, 1) == [
+            (START, START + timedelta(hours=3), 100, 3),
+            (late, late, 90, 1),
+        ]
+        assert await history(session_factory, 1) == [
+            (START, 100), (late, 90), (START + timedelta(hours=2), 100), (START + timedelta(hours=3), 100),
+        ]
+    run_db(check)
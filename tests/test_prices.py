@@ -0,0 +1,20 @@
+import pytest
+
+from app.services.prices import parse_price, parse_prices
+from benchmarks.price_corpus import CORPUS
+
+
+@pytest.mark.parametrize('raw, expected', CORPUS)
+def test_parse_price(raw, expected):
+    assert parse_price(raw) == expected
+
+
+@pytest.mark.parametrize('raw, expected', CORPUS)
+def test_parse_prices(raw, expected):
+    # Повторы строки и отсутствующий элемент в пакете
+    assert parse_prices([raw, None, raw]) == [expected, None, expected]
+
+
+def test_parse_prices_keeps_order():
+    raws = [raw for raw, _ in CORPUS]
+    assert parse_prices(raws + raws[::-1]) == [expected for _, expected in CORPUS + CORPUS[::-1]]
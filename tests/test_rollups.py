@@ -0,0 +1,29 @@
+from datetime import datetime, timedelta, timezone
+
+from app.db.crud import add_price_scans, add_scan_run, get_product_prices_page
+from app.models.models import ProductInfo
+
+
+def test_long_period_is_read_from_daily_rollups(run_db):
+    now = datetime.now(timezone.utc)
+
+    async def check(session_factory):
+        async with session_factory() as session:
+            session.add(ProductInfo(title="Товар", url="https://shop.example/1", xpath="//span"))
+            await session.commit()
+            # Два сканирования в день за 60 дней, последнее - сегодня
+            for day in range(60):
+                for hour in (0, 1):
+                    scan_time = now - timedelta(days=day, hours=hour)
+                    run_id = f"run{day}-{hour}"
+                    await add_scan_run(session, run_id, scan_time)
+                    await add_price_scans(session, [dict(product_id=1, price=10000 + day * 10 + hour,
+                                                         scan_time=scan_time, run_id=run_id)])
+            return await get_product_prices_page(session, date_from=now - timedelta(days=59, hours=2),
+                                                 date_to=now, user_timezone='UTC')
+
+    (_, _, _, dates), = run_db(check)
+    # Одна точка на день, последняя цена дня; текущий день включается, хотя период заканчивается сейчас
+    assert 59 <= len(dates) <= 61
+    assert all(len(date) == len("01.01.2024") for date in dates)
+    assert list(dates.values())[-1] == 10000
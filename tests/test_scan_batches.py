@@ -0,0 +1,92 @@
+import asyncio
+from datetime import datetime, timezone
+
+from app.db.scan_batches import (BATCH_DONE, BATCH_FAILED, BATCH_LEASED, BATCH_QUEUED, create_scan_batches,
+                                 get_scan_batches, lease_scan_batch, extend_scan_batch, finish_scan_batch)
+from app.db.scan_jobs import JOB_RUNNING
+from app.models.models import ProductInfo, ScanJob
+from app.worker import ScanWorker
+
+LEASE = 300
+EXPIRED = -1  # Аренда, истекшая в момент выдачи
+
+
+async def add_job(session_factory, products: int = 4, batch_size: int = 2) -> int:
+    async with session_factory() as session:
+        session.add_all(ProductInfo(title=f"Товар {i}", url=f"https://shop.example/{i}", xpath="//span")
+                        for i in range(products))
+        job = ScanJob(status=JOB_RUNNING, chat_ids=[], run_id="run", created_at=datetime.now(timezone.utc))
+        session.add(job)
+        await session.commit()
+        await create_scan_batches(session, job.id, "run", None, batch_size)
+        return job.id
+
+
+async def lease(session_factory, worker: str, lease_timeout: float = LEASE, max_attempts: int = 3):
+    async with session_factory() as session:
+        return await lease_scan_batch(session, worker, lease_timeout, max_attempts)
+
+
+def test_concurrent_leases_get_different_batches(run_db):
+    async def check(session_factory):
+        await add_job(session_factory)
+        return await asyncio.gather(*(lease(session_factory, f"worker{i}") for i in range(5)))
+
+    batches = run_db(check)
+    leased = [batch for batch in batches if batch is not None]
+    assert len(leased) == 2 and batches.count(None) == 3
+    assert len({batch.id for batch in leased}) == 2  # Пакет не достается двум обработчикам
+
+
+def test_expired_lease_is_given_to_another_worker(run_db):
+    async def check(session_factory):
+        await add_job(session_factory, products=2)
+        first = await lease(session_factory, "first", lease_timeout=EXPIRED)
+        second = await lease(session_factory, "second")
+        async with session_factory() as session:
+            # Обработчик, потерявший аренду, не может ни продлить ее, ни завершить пакет
+            extended = await extend_scan_batch(session, first.id, "first", LEASE)
+            finished_by_first = await finish_scan_batch(session, first.id, "first", BATCH_DONE)
+            finished_by_second = await finish_scan_batch(session, second.id, "second", BATCH_DONE)
+            batch, = await get_scan_batches(session, first.job_id)
+        return first, second, extended, finished_by_first, finished_by_second, batch
+
+    first, second, extended, finished_by_first, finished_by_second, batch = run_db(check)
+    assert second.id == first.id and second.worker == "second" and second.attempts == 2
+    assert not extended and not finished_by_first and finished_by_second
+    assert batch.status == BATCH_DONE
+
+
+def test_batch_fails_after_max_attempts(run_db):
+    async def check(session_factory):
+        await add_job(session_factory, products=2)
+        leases = [await lease(session_factory, f"worker{i}", lease_timeout=EXPIRED, max_attempts=2)
+                  for i in range(3)]
+        async with session_factory() as session:
+            batch, = await get_scan_batches(session, leases[0].job_id)
+        return leases, batch
+
+    leases, batch = run_db(check)
+    assert [item is not None for item in leases] == [True, True, False]
+    assert batch.status == BATCH_FAILED and batch.attempts == 2 and batch.error
+
+
+def test_worker_returns_failed_batch_to_queue(run_db):
+    async def check(session_factory):
+        await add_job(session_factory, products=2)
+        worker = ScanWorker(name="worker", session_factory=session_factory)
+
+        async def scan(batch):
+            raise RuntimeError("browser crashed")
+
+        worker._scan = scan
+        batch = await lease(session_factory, worker.name)
+        leased_status = batch.status
+        await worker.process(batch)
+        async with session_factory() as session:
+            batch, = await get_scan_batches(session, batch.job_id)
+        return leased_status, batch
+
+    leased_status, batch = run_db(check)
+    assert leased_status == BATCH_LEASED
+    assert batch.status == BATCH_QUEUED and batch.worker is None and batch.error == "browser crashed"
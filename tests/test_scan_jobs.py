@@ -0,0 +1,116 @@
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from sqlalchemy import select
+
+from app.db.crud import add_scan_run, add_price_scans
+from app.db.scan_jobs import (JOB_QUEUED, JOB_RUNNING, JOB_DONE, JOB_FAILED, claim_scan_job,
+                              requeue_interrupted_scan_jobs)
+from app.models.models import ProductInfo, PriceScan, ScanJob
+from app.services import functions
+from app.services.domain_stats import domain_stats
+from app.services.http_fetcher import TIER_HTTP
+from app.services.outcomes import ScanOutcome, OK
+from app.services.scan_queue import ScanQueue
+
+NOW = datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+class Sender:
+    """Отправитель сообщений Telegram: задачи тестов без чатов ничего не отправляют"""
+
+    def send(self, *args, **kwargs):
+        raise AssertionError("unexpected message")
+
+
+@pytest.fixture
+def scanned_urls(monkeypatch):
+    """Загрузка страниц без сети: каждая страница отдает цену 100 ₽, загруженные URL запоминаются"""
+    urls = []
+
+    async def get_prices_content(url, xpaths, *args):
+        urls.append(url)
+        return {xpath: ScanOutcome(OK, content="100 ₽", tier=TIER_HTTP) for xpath in xpaths}
+
+    monkeypatch.setattr(functions, 'get_prices_content', get_prices_content)
+    monkeypatch.setattr(domain_stats, 'path', None)
+    return urls
+
+
+async def add_products(session_factory, count: int):
+    async with session_factory() as session:
+        # Разные сайты, чтобы тест не ждал интервала между запросами к одному сайту
+        session.add_all(ProductInfo(title=f"Товар {i}", url=f"https://shop{i}.example/item", xpath="//span")
+                        for i in range(1, count + 1))
+        await session.commit()
+
+
+def test_only_jobs_with_stale_heartbeat_are_requeued(run_db):
+    async def check(session_factory):
+        async with session_factory() as session:
+            session.add_all([
+                ScanJob(id=1, status=JOB_RUNNING, chat_ids=[], created_at=NOW, started_at=NOW,
+                        owner="alive", heartbeat_at=NOW),
+                ScanJob(id=2, status=JOB_RUNNING, chat_ids=[], created_at=NOW, started_at=NOW,
+                        owner="crashed", heartbeat_at=NOW - timedelta(minutes=10)),
+                ScanJob(id=3, status=JOB_RUNNING, chat_ids=[], created_at=NOW - timedelta(days=2),
+                        started_at=NOW - timedelta(days=2), owner=None, heartbeat_at=None),
+            ])
+            await session.commit()
+            counts = await requeue_interrupted_scan_jobs(session, timedelta(hours=24), timedelta(seconds=120))
+            jobs = (await session.execute(
+                select(ScanJob.id, ScanJob.status, ScanJob.owner).order_by(ScanJob.id))).all()
+        return counts, jobs
+
+    counts, jobs = run_db(check)
+    assert counts == (1, 1)
+    assert jobs == [(1, JOB_RUNNING, "alive"), (2, JOB_QUEUED, None), (3, JOB_FAILED, None)]
+
+
+def test_resumed_job_skips_checkpointed_products(run_db, scanned_urls):
+    scan_time = NOW - timedelta(minutes=30)
+
+    async def check(session_factory):
+        await add_products(session_factory, 4)
+        async with session_factory() as session:
+            # Запуск прерван после первых двух товаров
+            await add_scan_run(session, "run", scan_time)
+            await add_price_scans(
+                session, [dict(product_id=i, price=9900, scan_time=scan_time, run_id="run") for i in (1, 2)],
+                [dict(run_id="run", product_id=i, status=OK) for i in (1, 2)])
+            session.add(ScanJob(status=JOB_QUEUED, chat_ids=[], run_id="run", created_at=scan_time,
+                                started_at=scan_time))
+            await session.commit()
+            job = await claim_scan_job(session, "test")
+
+        queue = ScanQueue(sender=Sender(), session_factory=session_factory, name="test")
+        await queue._execute(job)
+        async with session_factory() as session:
+            job = await session.get(ScanJob, job.id)
+            scans = (await session.execute(
+                select(PriceScan.product_id, PriceScan.price, PriceScan.scan_time).order_by(PriceScan.product_id)
+            )).all()
+        return job, scans
+
+    job, scans = run_db(check)
+    assert sorted(scanned_urls) == ["https://shop3.example/item", "https://shop4.example/item"]
+    # Продолженный запуск пишет цены с прежним временем и считает ход с учетом обработанных товаров
+    assert scans == [(1, 9900, scan_time), (2, 9900, scan_time), (3, 10000, scan_time), (4, 10000, scan_time)]
+    assert (job.status, job.processed, job.total) == (JOB_DONE, 4, 4)
+
+
+def test_full_catalog_request_extends_queued_subset_job(run_db):
+    async def check(session_factory):
+        await add_products(session_factory, 3)
+        queue = ScanQueue(sender=Sender(), session_factory=session_factory, name="test")
+        subset, subset_created = await queue.submit(chat_id=1, product_ids=[2, 1])
+        full, full_created = await queue.submit(chat_id=2)
+        async with session_factory() as session:
+            jobs = (await session.execute(select(ScanJob))).scalars().all()
+        return subset, subset_created, full, full_created, jobs
+
+    subset, subset_created, full, full_created, jobs = run_db(check)
+    assert subset_created and not full_created
+    job, = jobs
+    assert job.id == subset.id == full.id
+    assert job.status == JOB_QUEUED and job.product_ids is None and job.chat_ids == [1, 2]
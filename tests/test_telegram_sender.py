@@ -0,0 +1,89 @@
+import asyncio
+
+from aiogram.exceptions import TelegramBadRequest, TelegramRetryAfter
+
+from app.services.telegram_sender import MessagePacker, TelegramSender, split_text
+
+LINK = "[Очень длинное название товара](https://shop.example/catalog/item?id=1)"
+
+
+def test_split_text_keeps_lines_whole():
+    text = "".join(f"{LINK}\n  Цена: {i}.00 ₽\n" for i in range(100))
+    pieces = split_text(text, 500)
+    assert "".join(pieces) == text
+    assert all(len(piece) <= 500 and piece.endswith("\n") for piece in pieces)
+
+
+def test_long_line_is_not_cut_inside_markdown():
+    line = " ".join([LINK, "*скидка 20%*", LINK] * 5) + "\n"
+    pieces = split_text(line, 120)
+    assert "".join(pieces) == line
+    for piece in pieces:
+        assert len(piece) <= 120
+        # Каждая часть - законченная разметка: ссылки и выделения не разрезаны
+        assert piece.count("[") == piece.count("](") == piece.count(")") and piece.count("*") % 2 == 0
+
+
+def test_packer_keeps_items_whole():
+    packer = MessagePacker(100)
+    item = f"{LINK}\n  Цена: 1.00 ₽\n\n"
+    messages = [message for _ in range(5) for message in packer.add(item)] + packer.flush()
+    assert "".join(messages) == item * 5
+    assert all(message.startswith("[") and message.endswith("\n\n") for message in messages)
+
+
+class Bot:
+    """Бот, который отвечает на отправку очередным результатом из results"""
+
+    def __init__(self, *results):
+        self.results = list(results)
+        self.calls = []
+
+    async def send_message(self, chat_id, text, **kwargs):
+        self.calls.append(kwargs)
+        result = self.results.pop(0)
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+
+def deliver(bot, **kwargs):
+    async def main():
+        sender = TelegramSender(global_rate=1000, chat_rate=1000, chat_burst=1000)
+        sender.start(bot)
+        result = await sender.send(1, "*текст", **kwargs)
+        return sender, result
+    return asyncio.run(main())
+
+
+def test_rejected_markdown_is_resent_as_plain_text():
+    bot = Bot(TelegramBadRequest(None, "Bad Request: can't parse entities"), "message")
+    sender, result = deliver(bot, parse_mode="Markdown", disable_web_page_preview=True)
+    assert result == "message"
+    assert bot.calls == [dict(parse_mode="Markdown", disable_web_page_preview=True),
+                         dict(parse_mode=None, disable_web_page_preview=True)]
+    assert sender.stats['sent'] == 1 and sender.stats['failed'] == 0
+
+
+def test_bad_request_without_markdown_is_dropped():
+    bot = Bot(TelegramBadRequest(None, "Bad Request: chat not found"))
+    sender, result = deliver(bot)
+    assert result is None and len(bot.calls) == 1 and sender.stats['failed'] == 1
+
+
+def test_retry_after_pauses_all_chats():
+    async def main():
+        sender = TelegramSender(global_rate=1000, chat_rate=1000, chat_burst=1000)
+        sender.start(Bot(TelegramRetryAfter(None, "Too Many Requests", retry_after=0.2), "sent", "sent"))
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        first = sender.send(1, "первый чат")
+        await asyncio.sleep(0.01)  # Первый чат получил "retry after"
+        second = await sender.send(2, "второй чат")
+        waited = loop.time() - started
+        return await first, second, waited
+
+    first, second, waited = asyncio.run(main())
+    assert (first, second) == ("sent", "sent")
+    # Другой чат тоже ждал окончания паузы
+    assert waited >= 0.2